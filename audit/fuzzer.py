@@ -0,0 +1,388 @@
+"""
+Schema driven fuzzing of a contract:
+- ValueGenerator: well typed and edge case values for a JSON schema node
+- Fuzzer: sends generated ExecuteMsg variants from several wallets, records coverage, shrinks failures
+
+    fuzzer = Fuzzer(token_contract, "contracts/terraswap_token/schema/execute_msg.json",
+                    [terra.wallets[f"test{i}"] for i in range(1, 9)])
+    fuzzer.run(5000)
+    print(fuzzer.report())
+
+Run it from the repository root, or from `audit/` like the notebooks.
+"""
+
+#============================ Imports ============================#
+
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+# We need the repository root (terra_sdk_wrapper) and the schema parsers
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "schema_to_class"))
+
+from parsers import RootSchema
+from terra_sdk_wrapper import BatchResult, TxBatch, get_terra
+from terra_sdk_wrapper.backends import is_backend
+
+#============================ Values ============================#
+
+UINT128_MAX = 2**128 - 1
+
+# Edge cases of the CosmWasm number strings
+number_string_edges = {
+    "Uint128": ["0", "1", str(UINT128_MAX), str(UINT128_MAX + 1), "-1", "", "1.5", "abc", "00"],
+    "Uint64": ["0", "1", str(2**64 - 1), str(2**64), "-1", ""],
+    "Decimal": ["0", "1", "0.000000000000000001", "1.0000000000000000001", "-1", "", "1e3"],
+}
+
+integer_edges = {
+    "uint32": [0, 1, 2**32 - 1, 2**32, -1],
+    "uint64": [0, 1, 2**64 - 1, 2**64, -1],
+    "uint8": [0, 255, 256, -1],
+}
+
+string_edges = ["", " ", "a" * 1024, "\u0000", "ü🚀", "<script>", "../../", "terra1invalid"]
+
+
+class ValueGenerator():
+    """
+    I build values for JSON schema nodes of one root schema.
+    With probability `edge_rate` a node gets an edge case (bounds, overflows,
+    wrong types, missing optionals), otherwise a well typed value.
+    Strings prefer the `addresses`, most fields of contracts are addresses or amounts.
+    """
+
+    def __init__(self, definitions: Dict[str, dict], rng: random.Random,
+                 addresses: List[str] = None, edge_rate: float = 0.2, max_depth: int = 6) -> None:
+        self.definitions = definitions or {}
+        self.rng = rng
+        self.addresses = addresses or []
+        self.edge_rate = edge_rate
+        self.max_depth = max_depth
+
+    def edge(self) -> bool:
+        return self.rng.random() < self.edge_rate
+
+    def generate(self, schema, depth: int = 0):
+        if not isinstance(schema, dict) or depth > self.max_depth:
+            return None
+        if "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+            if name in number_string_edges:
+                return self.number_string(name)
+            return self.generate(self.definitions.get(name, {}), depth + 1)
+        if "allOf" in schema:
+            return self.generate(schema["allOf"][0], depth + 1)
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                return self.generate(self.rng.choice(schema[key]), depth + 1)
+        if "enum" in schema:
+            return self.rng.choice(schema["enum"])
+
+        types = schema.get("type", "object")
+        instance_type = self.rng.choice(types) if isinstance(types, list) else types
+        if instance_type == "null":
+            return None
+        if instance_type == "string":
+            return self.string()
+        if instance_type == "integer":
+            return self.integer(schema.get("format"))
+        if instance_type == "number":
+            return self.rng.choice([0.0, 1.5, -1.0]) if self.edge() else self.rng.random() * 1000
+        if instance_type == "boolean":
+            return self.rng.random() < 0.5
+        if instance_type == "array":
+            size = self.rng.choice([0, 1, 2, 3, 50]) if self.edge() else self.rng.randint(0, 3)
+            return [self.generate(schema.get("items", {}), depth + 1) for _ in range(size)]
+        return self.object(schema, depth)
+
+    def object(self, schema: dict, depth: int) -> dict:
+        properties = schema.get("properties") or {}
+        required = set(schema.get("required") or [])
+        value = {}
+        for key, prop in properties.items():
+            if key not in required and self.rng.random() < 0.5:
+                continue
+            if key in required and self.edge() and self.rng.random() < 0.1:
+                # Missing required field
+                continue
+            value[key] = self.generate(prop, depth + 1)
+        return value
+
+    def number_string(self, name: str) -> str:
+        if self.edge():
+            return self.rng.choice(number_string_edges[name])
+        return str(self.rng.choice([self.rng.randint(1, 1000), self.rng.randint(1, 10**12)]))
+
+    def integer(self, format: str) -> int:
+        if self.edge():
+            return self.rng.choice(integer_edges.get(format, [0, -1, 2**63]))
+        return self.rng.randint(0, 100)
+
+    def string(self) -> str:
+        if self.edge():
+            return self.rng.choice(string_edges)
+        if self.addresses and self.rng.random() < 0.7:
+            return self.rng.choice(self.addresses)
+        return "".join(self.rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(self.rng.randint(1, 12)))
+
+#============================ Outcomes ============================#
+
+
+def error_class(error: str) -> str:
+    """
+    Errors differing only by addresses and numbers are the same class:
+    `failed to execute message; message index: 0: Cannot Sub with 0 and 10: ...` -> `Cannot Sub with <n> and <n>: ...`
+    """
+    error = error.split("message index: 0:")[-1]
+    error = re.sub(r"terra1[0-9a-z]{38,58}", "<address>", error)
+    error = re.sub(r"\d+", "<n>", error)
+    return error.strip()[:160]
+
+
+def outcome_of(result) -> str:
+    """"ok", or the error class of the execution result"""
+    if result is None:
+        # Nothing came back from the execution
+        return "exception"
+    error = getattr(result, "error", None)
+    if error is not None:
+        return error_class(str(error))
+    code = getattr(result, "code", None)
+    if code:
+        return error_class(getattr(result, "raw_log", "") or f"code {code}")
+    tx_result = getattr(result, "tx_result", None)
+    if tx_result is not None:
+        return outcome_of(tx_result)
+    return "ok"
+
+
+def shrink_candidates(value):
+    """Simpler versions of a value, simplest first"""
+    if isinstance(value, dict):
+        for key in value:
+            yield {k: v for k, v in value.items() if k != key}
+        for key, item in value.items():
+            for smaller in shrink_candidates(item):
+                yield {**value, key: smaller}
+    elif isinstance(value, list):
+        if value:
+            yield []
+            yield value[:len(value) // 2]
+            for i, item in enumerate(value):
+                for smaller in shrink_candidates(item):
+                    yield value[:i] + [smaller] + value[i + 1:]
+    elif isinstance(value, str):
+        if value not in ("", "0"):
+            yield "0" if value.isdigit() else ""
+            if len(value) > 1:
+                yield value[:len(value) // 2]
+    elif isinstance(value, bool):
+        if value:
+            yield False
+    elif isinstance(value, int):
+        if value != 0:
+            yield 0
+            yield value // 2
+
+#============================ Fuzzer ============================#
+
+
+class Fuzzer():
+    """
+    I fuzz the ExecuteMsg variants of a contract.
+    Every wallet sends its messages from its own thread (sequence ordering), in
+    `TxBatch`es of `batch_size` messages on a real chain, one by one on a Backend.
+    Coverage counts the outcomes (ok or error class) of every variant; the first
+    message of each new (variant, error class) is shrunk to a minimal one.
+    """
+
+    def __init__(self, contract, schema, wallets: List, seed: int = 0, edge_rate: float = 0.2,
+                 batch_size: int = 20, shrink_budget: int = 50) -> None:
+        if isinstance(schema, str):
+            with open(schema) as f:
+                schema = json.load(f)
+        self.root_schema = schema if isinstance(schema, RootSchema) else RootSchema(schema)
+        self.contract = contract
+        self.wallets = wallets
+        self.seed = seed
+        self.edge_rate = edge_rate
+        self.batch_size = batch_size
+        self.shrink_budget = shrink_budget
+
+        self.variants: Dict[str, dict] = {}
+        for variant in (self.root_schema.schema.one_of or []) + (self.root_schema.schema.any_of or []):
+            for name, variant_schema in (variant.properties or {}).items():
+                self.variants[name] = variant_schema
+        if not self.variants:
+            raise Exception("No ExecuteMsg variant in the schema")
+
+        self.coverage: Dict[str, Dict[str, int]] = {name: {} for name in self.variants}
+        self.failures: Dict[Tuple[str, str], dict] = {}
+        self.sent = 0
+        self.lock = threading.Lock()
+
+    def generator(self, rng: random.Random) -> ValueGenerator:
+        addresses = [w.key.acc_address for w in self.wallets]
+        if getattr(self.contract, "address", None):
+            addresses.append(self.contract.address)
+        return ValueGenerator(self.root_schema.definitions_data, rng, addresses, self.edge_rate)
+
+    def generate(self, generator: ValueGenerator, variant: str) -> dict:
+        return {variant: generator.generate(self.variants[variant])}
+
+    def record(self, wallet, msg: dict, outcome: str) -> None:
+        variant = next(iter(msg))
+        with self.lock:
+            self.sent += 1
+            counts = self.coverage[variant]
+            counts[outcome] = counts.get(outcome, 0) + 1
+            key = (variant, outcome)
+            if outcome == "ok" or key in self.failures:
+                return
+            self.failures[key] = {"wallet": wallet.key.acc_address, "msg": msg, "shrunk": None}
+
+    def execute(self, wallet, msg: dict) -> str:
+        try:
+            return outcome_of(self.contract.execute(wallet, msg))
+        except Exception as e:
+            return error_class(str(e))
+
+    def run_wallet(self, index: int, count: int) -> None:
+        rng = random.Random(f"{self.seed}:{index}")
+        generator = self.generator(rng)
+        wallet = self.wallets[index]
+        variants = list(self.variants)
+        batched = self.batch_size > 1 and not is_backend(get_terra())
+        sent = 0
+        while sent < count:
+            size = min(self.batch_size if batched else 1, count - sent)
+            msgs = [self.generate(generator, variants[(sent + i) % len(variants)]) for i in range(size)]
+            sent += size
+            if not batched:
+                self.record(wallet, msgs[0], self.execute(wallet, msgs[0]))
+                continue
+            results = []
+            try:
+                with TxBatch(get_terra(), wallet) as batch:
+                    for msg in msgs:
+                        try:
+                            results.append(self.contract.execute(wallet, msg, batch=batch))
+                        except Exception as e:
+                            results.append(e)
+            except Exception as e:
+                # The flush itself failed: every message left unsettled gets its error
+                results = [e if isinstance(r, BatchResult) and r.tx_result is None and r.error is None else r
+                           for r in results]
+                results += [e] * (len(msgs) - len(results))
+            for msg, result in zip(msgs, results):
+                outcome = error_class(str(result)) if isinstance(result, Exception) else outcome_of(result)
+                self.record(wallet, msg, outcome)
+
+    def run(self, count: int, shrink: bool = True) -> dict:
+        """Sends `count` messages spread over the wallets, returns the report"""
+        start = time.perf_counter()
+        shares = [count // len(self.wallets) + (i < count % len(self.wallets)) for i in range(len(self.wallets))]
+        with ThreadPoolExecutor(max_workers=len(self.wallets)) as executor:
+            futures = [executor.submit(self.run_wallet, i, share) for i, share in enumerate(shares) if share]
+            for future in futures:
+                future.result()
+        self.seconds = time.perf_counter() - start
+        if shrink:
+            for key in list(self.failures):
+                if self.failures[key]["shrunk"] is None:
+                    self.shrink(key)
+        return self.report()
+
+    def shrink(self, key: Tuple[str, str]) -> dict:
+        """
+        Greedily simplifies the failing message while it fails with the same error class,
+        within `shrink_budget` executions
+        """
+        failure = self.failures[key]
+        wallet = next(w for w in self.wallets if w.key.acc_address == failure["wallet"])
+        variant, outcome = key
+        current = failure["msg"][variant]
+        budget = self.shrink_budget
+        progress = True
+        while progress and budget > 0:
+            progress = False
+            for candidate in shrink_candidates(current):
+                if budget <= 0:
+                    break
+                budget -= 1
+                if self.execute(wallet, {variant: candidate}) == outcome:
+                    current = candidate
+                    progress = True
+                    break
+        failure["shrunk"] = {variant: current}
+        return failure["shrunk"]
+
+    def report(self) -> dict:
+        seconds = getattr(self, "seconds", 0)
+        return {
+            "sent": self.sent,
+            "msgs_per_minute": self.sent / seconds * 60 if seconds else None,
+            "variants_covered": sum(1 for counts in self.coverage.values() if counts.get("ok")),
+            "variants": len(self.variants),
+            "coverage": self.coverage,
+            "failures": [{"variant": variant, "error": outcome, "msg": f["msg"], "shrunk": f["shrunk"]}
+                         for (variant, outcome), f in sorted(self.failures.items())],
+        }
+
+
+def test_fuzzer():
+    from terra_sdk_wrapper import Contract, MockBackend, MockContract, configure
+
+    class Token(MockContract):
+        def instantiate(self, env, msg):
+            self.balances = {env.sender: 1000}
+
+        def execute_transfer(self, env, amount: str, recipient: str):
+            amount = int(amount)
+            if self.balances.get(env.sender, 0) < amount:
+                raise Exception(f"Cannot Sub with {self.balances.get(env.sender, 0)} and {amount}")
+            self.balances[env.sender] -= amount
+            self.balances[recipient] = self.balances.get(recipient, 0) + amount
+
+        def execute_burn(self, env, amount: str):
+            raise Exception("Unauthorized")
+
+    schema = {"title": "ExecuteMsg", "oneOf": [
+        {"type": "object", "properties": {"transfer": {"type": "object", "required": ["amount", "recipient"], "properties": {
+            "amount": {"$ref": "#/definitions/Uint128"}, "recipient": {"type": "string"}}}}},
+        {"type": "object", "properties": {"burn": {"type": "object", "required": ["amount"], "properties": {
+            "amount": {"$ref": "#/definitions/Uint128"}}}}}],
+        "definitions": {"Uint128": {"type": "string"}}}
+
+    mock = MockBackend()
+    mock.register_code("token", Token)
+    configure(client=mock)
+    wallets = list(mock.wallets.values())[:4]
+    token = Contract("token")
+    token.address = mock.instantiate(wallets[0], mock.store_code(wallets[0], "token"), {})
+
+    fuzzer = Fuzzer(token, schema, wallets, edge_rate=0.3)
+    report = fuzzer.run(2000)
+    assert(report["sent"] == 2000)
+    assert(report["coverage"]["transfer"].get("ok") and report["coverage"]["burn"].get("Unauthorized"))
+    # Edge cases reach the handler
+    assert(any(f["error"].startswith("invalid literal for int()") for f in report["failures"]))
+    burn = next(f for f in report["failures"] if f["error"] == "Unauthorized")
+    assert(burn["shrunk"]["burn"]["amount"] in ("", "0"))
+    assert(report["msgs_per_minute"] > 1000)
+    configure()
+    print(f"[+] Test fuzzer passed ({report['msgs_per_minute']:.0f} msgs per minute, "
+          f"{len(report['failures'])} failure classes)")
+
+
+if __name__ == "__main__":
+    test_fuzzer()
@@ -0,0 +1,311 @@
+"""
+Compares the generator targets when building messages:
+
+python3 schema_to_class/benchmark.py ./terraswap/contracts/terraswap_token -n 100000
+
+- dict: `json.dumps(Contract.execute_transfer(...)).encode()`, what terra_sdk does of today's dicts
+- slots: `Contract.ExecuteTransfer(...).to_json()`
+
+Or the schema parsing itself, over one contract or a whole workspace:
+
+python3 schema_to_class/benchmark.py --parse ./terraswap -n 200
+
+- parsers: the `RootSchema` / `SchemaObject` walk the generators used to do
+- compiler: `compile_contract`, the `__slots__` IR every target now reads
+
+Or the decoding of query responses, with lists of `-n` items:
+
+python3 schema_to_class/benchmark.py --responses ./terraswap/contracts/terraswap_token -n 10000
+
+- raw: the parsed JSON as is
+- dict: a generic walk of the parsed JSON converting Uint128 to int, what we did by hand
+- slots: the generated `Response.decode` (with `--ints`)
+Times leave `json.loads` out, it costs the same to all. Memory is what the decoded value
+holds once the parsed JSON is dropped, small responses may hold more as slots than raw.
+"""
+
+import inspect
+import json
+import sys
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+from compiler import Message, Shape, compile_contract
+from parsers import RootSchema, SchemaObject
+from resolver import TypeResolver
+from schema_to_class import (TARGETS, build_lines, build_slots_lines, collect_schemas, compile_schemas,
+                             discover_contracts, extract_name_from_path, get_option, process_arguments,
+                             slot_class_name)
+
+
+sample_values = {"str": "1000",
+                 "int": 1,
+                 "float": 1.0,
+                 "bool": True,
+                 "list": [],
+                 "dict": {}}
+
+
+def load_target(target: str, contract_name: str, contract_path: str):
+    """
+    Generates the code of `target` and returns the contract class
+    """
+    namespace = {}
+    exec("\n".join(TARGETS[target](contract_name, contract_path)), namespace)
+    return namespace[contract_name]
+
+
+def sample_kwargs(func: Callable) -> dict:
+    """
+    A value for every required argument, from its annotation
+    """
+    kwargs = {}
+    for name, param in inspect.signature(func).parameters.items():
+        if name == "self" or param.default is not inspect.Parameter.empty:
+            continue
+        annotation = getattr(param.annotation, "__name__", param.annotation)
+        kwargs[name] = sample_values.get(annotation, "1000")
+    return kwargs
+
+
+def without_none(data):
+    """
+    The slots target omits `None` optionals, the dict target sends them as null
+    """
+    if isinstance(data, dict):
+        return {k: without_none(v) for k, v in data.items() if v is not None}
+    if isinstance(data, list):
+        return [without_none(v) for v in data]
+    return data
+
+
+def pair_builders(dict_class, slots_class) -> List[Tuple[str, Callable, type, dict]]:
+    """
+    Matches `execute_transfer` with `ExecuteTransfer`, returns both with sample arguments
+    """
+    functions = {name.replace("_", ""): getattr(dict_class, name)
+                 for name in vars(dict_class) if not name.startswith("__")}
+    pairs = []
+    for name, cls in vars(slots_class).items():
+        func = functions.get(name.lower())
+        if func is None or not isinstance(cls, type):
+            continue
+        kwargs = sample_kwargs(cls.__init__)
+        pairs.append((name, func, cls, kwargs))
+    return pairs
+
+
+def measure(builders: List[Callable], n: int) -> dict:
+    start = time.perf_counter()
+    for i in range(n):
+        builders[i % len(builders)]()
+    seconds = time.perf_counter() - start
+    return {"seconds": seconds, "msgs_per_second": n / seconds}
+
+
+def measure_memory(constructors: List[Callable], n: int) -> int:
+    """
+    Peak memory of holding `n` built (not serialised) messages
+    """
+    tracemalloc.start()
+    held = [constructors[i % len(constructors)]() for i in range(n)]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del held
+    return peak
+
+
+def parse_with_parsers(root_schemas_data: List[dict]) -> list:
+    """
+    The walk of the generators before the compiler: parser objects, then
+    every variant wrapped again in a `SchemaObject`
+    """
+    parsed = []
+    for root_schema_data in root_schemas_data:
+        root_schema = RootSchema(root_schema_data)
+        resolver = TypeResolver(root_schema.definitions_data)
+        if root_schema.schema.instance_type == "object":
+            properties = root_schema.schema.properties or {}
+            parsed.append([(k, resolver.resolve(properties[k])) for k in properties])
+            continue
+        for variant in (root_schema.schema.any_of or []) + (root_schema.schema.one_of or []):
+            for msg_name in variant.properties or {}:
+                func_schema = SchemaObject(variant.properties[msg_name])
+                properties = func_schema.properties or {}
+                parsed.append([(k, resolver.resolve(properties[k])) for k in properties])
+    return parsed
+
+
+def measure_parse(parse: Callable, schemas: List[List[dict]], n: int) -> dict:
+    start = time.perf_counter()
+    for _ in range(n):
+        for root_schemas_data in schemas:
+            parse(root_schemas_data)
+    seconds = time.perf_counter() - start
+    # Peak of holding one parse of every contract
+    tracemalloc.start()
+    held = [parse(root_schemas_data) for root_schemas_data in schemas]
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del held
+    return {"seconds": seconds, "contracts_per_second": n * len(schemas) / seconds, "peak_bytes": peak}
+
+
+def main_parse():
+    path = get_option(sys.argv, ["--parse"], ".")
+    n = int(get_option(sys.argv, ["-n"], "200"))
+    contract_paths = discover_contracts(path) or [path]
+    # Files are read once, only parsing is measured
+    schemas = [collect_schemas(contract_path) for contract_path in contract_paths]
+
+    results = {"contracts": len(contract_paths), "rounds": n,
+               "schema_bytes": sum(len(json.dumps(s)) for s in schemas)}
+    results["parsers"] = measure_parse(parse_with_parsers, schemas, n)
+    results["compiler"] = measure_parse(lambda s: compile_contract("Contract", s), schemas, n)
+    results["speedup"] = results["parsers"]["seconds"] / results["compiler"]["seconds"]
+
+    # Parse and generate, what a workspace run costs per target
+    for target, build_target in (("dict", build_lines), ("slots", build_slots_lines)):
+        start = time.perf_counter()
+        for _ in range(max(1, n // 10)):
+            for contract_path in contract_paths:
+                build_target(extract_name_from_path(contract_path), contract_path)
+        results[f"generate_{target}_seconds"] = time.perf_counter() - start
+    print(json.dumps(results, indent=2))
+
+
+sample_plain = {"str": "terra1x46rqay4d3cssq8gxxvqz8xt6nwlz4td20k38v",
+                "int": 6,
+                "float": 1.0,
+                "bool": True,
+                "list": [],
+                "dict": {"never": {}}}
+
+
+def sample_value(shape: Shape, type_instance: str, definitions: dict, items: int):
+    """
+    A value of `shape`, lists hold `items` items (2 when nested)
+    """
+    if shape.kind == "integer":
+        return "340282366920938463463"
+    if shape.kind == "object":
+        return sample_object(definitions[shape.name], definitions, 2)
+    if shape.kind == "list":
+        item_type = "str" if shape.item.kind == "plain" else None
+        return [sample_value(shape.item, item_type, definitions, 2) for _ in range(items)]
+    if shape.kind == "optional":
+        return sample_value(shape.item, type_instance, definitions, items)
+    return sample_plain.get(type_instance, "1000")
+
+
+def sample_object(message: Message, definitions: dict, items: int) -> dict:
+    return {f.name: sample_value(f.shape, f.type, definitions, items) for f in message.fields}
+
+
+def walk(shape: Shape, value, definitions: dict):
+    """
+    Generic decoding of a parsed value, to dicts with int amounts
+    """
+    if value is None or shape.kind == "plain":
+        return value
+    if shape.kind == "integer":
+        return int(value)
+    if shape.kind == "object":
+        return walk_object(definitions[shape.name], value, definitions)
+    if shape.kind == "list":
+        if shape.item.kind == "plain":
+            return value
+        return [walk(shape.item, v, definitions) for v in value]
+    return walk(shape.item, value, definitions)
+
+
+def walk_object(message: Message, value: dict, definitions: dict) -> dict:
+    return {f.name: walk(f.shape, value.get(f.name), definitions) for f in message.fields}
+
+
+def measure_decode(decode: Callable, text: str, rounds: int) -> dict:
+    data = json.loads(text)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(data)
+    seconds = (time.perf_counter() - start) / rounds
+    # Memory held by the decoded value, parsed strings it keeps included
+    tracemalloc.start()
+    held = decode(json.loads(text))
+    held_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del held
+    return {"seconds": seconds, "held_bytes": held_bytes}
+
+
+def main_responses():
+    contract_path = get_option(sys.argv, ["--responses"], ".")
+    items = int(get_option(sys.argv, ["-n"], "10000"))
+    rounds = int(get_option(sys.argv, ["-r"], "20"))
+    contract_name = extract_name_from_path(contract_path)
+    ir = compile_schemas(contract_name, contract_path, True)
+    namespace = {}
+    exec("\n".join(build_slots_lines(contract_name, contract_path, True)), namespace)
+    contract_class = namespace[contract_name]
+    if not ir.responses:
+        print(f"[!] No response schema in {contract_path}")
+        return
+
+    results = {"items": items, "rounds": rounds}
+    for message in ir.responses:
+        text = json.dumps(sample_object(message, ir.response_definitions, items))
+        response_class = getattr(contract_class, slot_class_name(message))
+        result = {"raw": measure_decode(lambda d: d, text, rounds),
+                  "dict": measure_decode(lambda d: walk_object(message, d, ir.response_definitions), text, rounds),
+                  "slots": measure_decode(response_class.decode, text, rounds)}
+        result["speedup"] = result["dict"]["seconds"] / result["slots"]["seconds"]
+        result["memory_ratio"] = result["dict"]["held_bytes"] / max(1, result["slots"]["held_bytes"])
+        result["raw_memory_ratio"] = result["raw"]["held_bytes"] / max(1, result["slots"]["held_bytes"])
+        for baseline in ("raw", "dict"):
+            if result["slots"]["held_bytes"] > result[baseline]["held_bytes"]:
+                print(f"[~] {message.title} holds more as slots ({result['slots']['held_bytes']} B) "
+                      f"than {baseline} ({result[baseline]['held_bytes']} B)")
+        results[message.title] = result
+    print(json.dumps(results, indent=2))
+
+
+def main():
+    if "--parse" in sys.argv:
+        main_parse()
+        return
+    if "--responses" in sys.argv:
+        main_responses()
+        return
+    contract_path = process_arguments(sys.argv)
+    n = int(get_option(sys.argv, ["-n"], "100000"))
+    contract_name = extract_name_from_path(contract_path)
+
+    dict_class = load_target("dict", contract_name, contract_path)
+    slots_class = load_target("slots", contract_name, contract_path)
+    pairs = pair_builders(dict_class, slots_class)
+    if not pairs:
+        print(f"[!] No message to benchmark in {contract_path}")
+        return
+
+    dict_builders = [lambda f=f, kw=kw: json.dumps(f(**kw)).encode() for _, f, _, kw in pairs]
+    slots_builders = [lambda c=c, kw=kw: c(**kw).to_json() for _, _, c, kw in pairs]
+
+    # Both targets must produce the same message
+    for name, dict_builder, slots_builder in zip([p[0] for p in pairs], dict_builders, slots_builders):
+        if without_none(json.loads(dict_builder())) != json.loads(slots_builder()):
+            print(f"[~] {name} differs: {dict_builder()} != {slots_builder()}")
+
+    results = {"messages": n, "variants": len(pairs)}
+    results["dict"] = measure(dict_builders, n)
+    results["slots"] = measure(slots_builders, n)
+    results["speedup"] = results["dict"]["seconds"] / results["slots"]["seconds"]
+    results["dict"]["peak_bytes"] = measure_memory(
+        [lambda f=f, kw=kw: f(**kw) for _, f, _, kw in pairs], n)
+    results["slots"]["peak_bytes"] = measure_memory(
+        [lambda c=c, kw=kw: c(**kw) for _, _, c, kw in pairs], n)
+
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
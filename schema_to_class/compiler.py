@@ -0,0 +1,329 @@
+from typing import Dict, List
+from resolver import TypeResolver
+
+
+# Definitions holding an integer in a string, decoded to int when asked
+INTEGER_STRINGS = {"Uint64", "Uint128", "Uint256", "Int64", "Int128"}
+
+
+class Shape():
+    """
+    How a response value is decoded:
+    - `plain`: kept as it is in the JSON
+    - `integer`: a Uint64, Uint128... string, to int when asked
+    - `object`: an object definition `name`, decoded to its class
+    - `list`: every item decoded as `item`
+    - `optional`: None or decoded as `item`
+    """
+    __slots__ = ("kind", "name", "item")
+
+    def __init__(self, kind: str, name: str = None, item: "Shape" = None) -> None:
+        self.kind = kind
+        self.name = name
+        self.item = item
+
+    def is_plain(self, ints: bool) -> bool:
+        """Nothing to do to decode it"""
+        if self.kind == "integer":
+            return not ints
+        if self.kind in ("list", "optional"):
+            return self.item.is_plain(ints)
+        return self.kind == "plain"
+
+
+PLAIN = Shape("plain")
+
+
+class Field():
+    """
+    One parameter of a message, its type already resolved to python.
+    Response fields also have a `shape`
+    """
+    __slots__ = ("name", "type", "required", "shape")
+
+    def __init__(self, name: str, type: str, required: bool, shape: Shape = None) -> None:
+        self.name = name
+        self.type = type
+        self.required = required
+        self.shape = shape
+
+
+class Message():
+    """
+    One message of a schema, or an object definition:
+    - `title` of its root schema, eg. ExecuteMsg, InstantiateMsg
+    - `msg_name` its wrapping key, eg. `transfer`, None for flat messages like InstantiateMsg
+    - `definition` the definition name, eg. `Cw20Coin`, None for messages
+    - `fields` its parameters, None when the schema has no `properties` at all
+    - `value` when the variant wraps no object but a value, eg. `{'upload_logo': Logo}`:
+      its one field is named `msg_name` and holds that value
+    A variant of an enum definition like Expiration has both `msg_name` and `definition`.
+    """
+    __slots__ = ("title", "msg_name", "definition", "fields", "value")
+
+    def __init__(self, title: str, msg_name: str, fields: List[Field], definition: str = None,
+                 value: bool = False) -> None:
+        self.title = title
+        self.msg_name = msg_name
+        self.definition = definition
+        self.fields = fields
+        self.value = value
+
+
+class ContractIR():
+    """
+    Every message of a contract, compiled once and shared by the generator targets.
+    `messages` holds, schema after schema, its messages then its new object definitions,
+    `definitions` the same definitions by name, an enum definition has a message per variant.
+    `responses` and `response_definitions` are the same for the `*_response.json` schemas.
+    """
+    __slots__ = ("name", "messages", "definitions", "responses", "response_definitions")
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.messages: List[Message] = []
+        self.definitions: Dict[str, List[Message]] = {}
+        self.responses: List[Message] = []
+        self.response_definitions: Dict[str, Message] = {}
+
+
+def compile_shape(schema: dict, definitions: dict, resolving: frozenset = frozenset()) -> Shape:
+    """
+    Decoding of a response value. Unions other than nullables stay plain,
+    like recursions through refs only
+    """
+    if not isinstance(schema, dict):
+        return PLAIN
+    if "$ref" in schema:
+        name = schema["$ref"].split("/")[-1]
+        if name in INTEGER_STRINGS:
+            return Shape("integer")
+        definition = definitions.get(name)
+        if definition is None or name in resolving:
+            return PLAIN
+        if "properties" in definition:
+            return Shape("object", name)
+        return compile_shape(definition, definitions, resolving | {name})
+    type_instance = schema.get("type")
+    if type(type_instance) == list:
+        types = [t for t in type_instance if t != "null"]
+        if len(types) != 1:
+            return PLAIN
+        shape = compile_shape(dict(schema, type=types[0]), definitions, resolving)
+        return shape if len(types) == len(type_instance) else Shape("optional", item=shape)
+    if type_instance == "array":
+        return Shape("list", item=compile_shape(schema.get("items"), definitions, resolving))
+    if type_instance is not None:
+        return PLAIN
+    if "allOf" in schema and len(schema["allOf"]) == 1:
+        return compile_shape(schema["allOf"][0], definitions, resolving)
+    for union in ("anyOf", "oneOf"):
+        if union in schema:
+            parts = [part for part in schema[union] if part.get("type") != "null"]
+            if len(parts) != 1:
+                return PLAIN
+            shape = compile_shape(parts[0], definitions, resolving)
+            return shape if len(parts) == len(schema[union]) else Shape("optional", item=shape)
+    return PLAIN
+
+
+def compile_fields(properties: dict, required: list, resolver: TypeResolver, shapes: bool = False) -> List[Field]:
+    if properties is None:
+        return None
+    required = set(required or ())
+    if shapes:
+        return [Field(key, resolver.resolve(properties[key]), key in required,
+                      compile_shape(properties[key], resolver.definitions)) for key in properties]
+    return [Field(key, resolver.resolve(properties[key]), key in required) for key in properties]
+
+
+def object_body(schema: dict, definitions: dict) -> dict:
+    """
+    The object schema a variant wraps, through `$ref`s like `{"$ref": "#/definitions/Cw20Coin"}`,
+    None when it wraps something else (a scalar, a union)
+    """
+    seen = set()
+    while isinstance(schema, dict):
+        if "$ref" in schema:
+            name = schema["$ref"].split("/")[-1]
+            if name in seen:
+                return None
+            seen.add(name)
+            schema = definitions.get(name)
+        elif "allOf" in schema and len(schema["allOf"]) == 1:
+            schema = schema["allOf"][0]
+        else:
+            break
+    if isinstance(schema, dict) and (schema.get("type") == "object" or "properties" in schema):
+        return schema
+    return None
+
+
+def is_enum(schema: dict) -> bool:
+    """A union like Expiration, of `{"at_height": ..}` objects and unit variants like `"never"`"""
+    variants = schema.get("anyOf", []) + schema.get("oneOf", [])
+    return bool(variants) and all("properties" in v or "enum" in v for v in variants)
+
+
+def compile_variants(title: str, variants: List[dict], resolver: TypeResolver, definition: str = None) -> List[Message]:
+    """
+    A message per variant of an enum, `{"transfer": {..}}` or `{"upload_logo": Logo}`.
+    Unit variants are plain strings, nothing to generate: skipped with a warning
+    """
+    messages = []
+    for variant in variants:
+        if not variant.get("properties"):
+            if "enum" in variant:
+                names = ", ".join(f'"{v}"' for v in variant["enum"])
+                print(f"[~] {definition or title}: skipped the unit variant {names}, send it as a plain string")
+            else:
+                print(f"[~] {definition or title}: skipped a variant without properties")
+            continue
+        for msg_name, msg_schema in variant["properties"].items():
+            body = object_body(msg_schema, resolver.definitions)
+            if body is not None:
+                messages.append(Message(title, msg_name, compile_fields(
+                    body.get("properties"), body.get("required"), resolver), definition))
+            else:
+                field = Field(msg_name, resolver.resolve(msg_schema), True)
+                messages.append(Message(title, msg_name, [field], definition, True))
+    return messages
+
+
+def compile_root(root_data: dict, ir: ContractIR) -> None:
+    """
+    Single pass over a raw root schema: adds its messages and definitions to `ir`.
+    The dict is read directly, nothing is wrapped in parser objects.
+    """
+    definitions = root_data.get("definitions")
+    resolver = TypeResolver(definitions)
+    title = root_data.get("title")
+
+    # If instance is `object`, it is a flat message like InstantiateMsg
+    if root_data.get("type") == "object":
+        ir.messages.append(Message(title, None, compile_fields(
+            root_data.get("properties"), root_data.get("required"), resolver)))
+    else:
+        # Messages are pretty deep in the object:
+        # ./oneOf/{message index}/properties/{message definition}
+        ir.messages += compile_variants(title, root_data.get("anyOf", []) + root_data.get("oneOf", []), resolver)
+
+    for name, schema_data in (definitions or {}).items():
+        if name in ir.definitions:
+            continue
+        if "properties" in schema_data:
+            ir.definitions[name] = [Message(title, None, compile_fields(
+                schema_data["properties"], schema_data.get("required"), resolver), name)]
+        elif is_enum(schema_data):
+            ir.definitions[name] = compile_variants(
+                title, schema_data.get("anyOf", []) + schema_data.get("oneOf", []), resolver, name)
+        else:
+            continue
+        ir.messages += ir.definitions[name]
+
+
+def compile_response(root_data: dict, ir: ContractIR) -> None:
+    """
+    Adds an object response like BalanceResponse to `ir`, with the object definitions it uses.
+    Responses that aren't objects (a bare Uint128...) have no class
+    """
+    definitions = root_data.get("definitions")
+    resolver = TypeResolver(definitions)
+    title = root_data.get("title")
+    if "properties" in root_data:
+        ir.responses.append(Message(title, None, compile_fields(
+            root_data["properties"], root_data.get("required"), resolver, True)))
+    for name, schema_data in (definitions or {}).items():
+        if name not in ir.response_definitions and "properties" in schema_data:
+            ir.response_definitions[name] = Message(title, None, compile_fields(
+                schema_data["properties"], schema_data.get("required"), resolver, True), name)
+
+
+def compile_contract(contract_name: str, root_schemas_data: List[dict],
+                     response_schemas_data: List[dict] = ()) -> ContractIR:
+    ir = ContractIR(contract_name)
+    for root_data in root_schemas_data:
+        compile_root(root_data, ir)
+    for root_data in response_schemas_data:
+        compile_response(root_data, ir)
+    return ir
+
+
+def test_compile():
+    root_data = {
+        "title": "ExecuteMsg",
+        "oneOf": [
+            {"type": "object", "required": ["transfer"], "properties": {"transfer": {
+                "type": "object", "required": ["amount", "recipient"], "properties": {
+                    "amount": {"$ref": "#/definitions/Uint128"},
+                    "recipient": {"type": "string"},
+                    "memo": {"type": ["string", "null"]}}}}},
+            {"type": "object", "properties": {"burn_all": {"type": "object"}}},
+            {"type": "string", "enum": ["never"]},
+            {"type": "object", "properties": {"mint_coin": {"$ref": "#/definitions/Cw20Coin"}}},
+            {"type": "object", "properties": {"upload_logo": {"$ref": "#/definitions/Logo"}}},
+        ],
+        "definitions": {
+            "Uint128": {"type": "string"},
+            "Cw20Coin": {"type": "object", "required": ["address"], "properties": {
+                "address": {"type": "string"}, "amount": {"$ref": "#/definitions/Uint128"}}},
+            "Logo": {"oneOf": [
+                {"type": "object", "required": ["url"], "properties": {"url": {"type": "string"}}},
+                {"type": "object", "required": ["embedded"], "properties": {"embedded": {"type": "object"}}},
+                {"type": "string", "enum": ["none"]}]},
+            "Nullable": {"anyOf": [{"$ref": "#/definitions/Uint128"}, {"type": "null"}]},
+        },
+    }
+    ir = compile_contract("Token", [root_data])
+    assert([m.msg_name or m.definition for m in ir.messages] ==
+           ["transfer", "burn_all", "mint_coin", "upload_logo", "Cw20Coin", "url", "embedded"])
+    transfer = ir.messages[0]
+    assert([(f.name, f.type, f.required) for f in transfer.fields] ==
+           [("amount", "str", True), ("recipient", "str", True), ("memo", "str", False)])
+    assert(ir.messages[1].fields is None)
+    # Variants wrapping a definition get its fields, or its value
+    mint_coin, upload_logo = ir.messages[2:4]
+    assert([(f.name, f.required) for f in mint_coin.fields] == [("address", True), ("amount", False)])
+    assert(not mint_coin.value and upload_logo.value)
+    assert([(f.name, f.type, f.required) for f in upload_logo.fields] == [("upload_logo", "'dict | str'", True)])
+    # Enum definitions get a message per variant
+    assert(list(ir.definitions) == ["Cw20Coin", "Logo"])
+    url, embedded = ir.definitions["Logo"]
+    assert(url.definition == "Logo" and url.value and url.fields[0].type == "str")
+    assert(embedded.fields is None and not embedded.value)
+    print("[+] Test compile passed")
+
+
+def test_compile_response():
+    response_data = {
+        "title": "AllAllowancesResponse",
+        "type": "object",
+        "required": ["allowances"],
+        "properties": {"allowances": {"type": "array", "items": {"$ref": "#/definitions/AllowanceInfo"}},
+                       "total": {"anyOf": [{"$ref": "#/definitions/Uint128"}, {"type": "null"}]}},
+        "definitions": {
+            "Uint128": {"type": "string"},
+            "Timestamp": {"$ref": "#/definitions/Uint64"},
+            "Expiration": {"oneOf": [{"type": "object"}, {"type": "string"}]},
+            "AllowanceInfo": {"type": "object", "required": ["allowance", "spender"], "properties": {
+                "allowance": {"$ref": "#/definitions/Uint128"},
+                "spender": {"type": "string"},
+                "expires": {"$ref": "#/definitions/Expiration"},
+                "at": {"type": ["array", "null"], "items": {"$ref": "#/definitions/Timestamp"}}}},
+        },
+    }
+    ir = compile_contract("Token", [], [response_data])
+    allowances, total = ir.responses[0].fields
+    assert(allowances.shape.kind == "list" and allowances.shape.item.kind == "object")
+    assert(allowances.shape.item.name == "AllowanceInfo")
+    assert(total.shape.kind == "optional" and total.shape.item.kind == "integer")
+    assert(not total.shape.is_plain(True) and total.shape.is_plain(False))
+    shapes = {f.name: f.shape for f in ir.response_definitions["AllowanceInfo"].fields}
+    assert(shapes["spender"].kind == "plain" and shapes["expires"].kind == "plain")
+    assert(shapes["at"].kind == "optional" and shapes["at"].item.item.kind == "integer")
+    print("[+] Test compile response passed")
+
+
+if __name__ == "__main__":
+    test_compile()
+    test_compile_response()
@@ -23,6 +23,33 @@ class ParamHolder():
         res = f"'{self.name}': {self.name}"
         return res
 
+    def as_value(self):
+        """
+        Attribute as it goes in a dict, nested messages are converted
+        """
+        if self.type_instance in ("str", "int", "bool", "float"):
+            return f"self.{self.name}"
+        return f"_to_dict(self.{self.name})"
+
+    def as_json(self):
+        """
+        JSON fragment of the attribute, like `'"amount":' + _encode_str(self.amount)`
+        The encoder is picked at generation time from the type, ints and bools
+        are checked inline (a bool is not an int), strs by `_encode_str` itself
+        """
+        value = f"self.{self.name}"
+        if self.type_instance == "str":
+            encoded = f"_encode_str({value})"
+        elif self.type_instance == "int":
+            encoded = (f"(str({value}) if isinstance({value}, int) and {value}.__class__ is not bool "
+                       f"else _raise(_type_error(self, '{self.name}', 'an int')))")
+        elif self.type_instance == "bool":
+            encoded = (f"('true' if {value} is True else 'false' if {value} is False "
+                       f"else _raise(_type_error(self, '{self.name}', 'a bool')))")
+        else:
+            encoded = f"_encode({value})"
+        return f"'\"{self.name}\":' + {encoded}"
+
 
 class FunctionHolder():
     prefix: str
@@ -98,6 +125,264 @@ class ClassHolder():
         return lines
 
 
+# Shared by every slotted class of a generated module
+SLOTS_PRELUDE = [
+    "from base64 import b64encode",
+    "from json import dumps",
+    "from json.encoder import encode_basestring_ascii as _encode_str",
+    "",
+    "",
+    "def _default(value):",
+    "\treturn value.to_dict()",
+    "",
+    "",
+    "def _encode(value):",
+    "\tif isinstance(value, Msg):",
+    "\t\treturn value.to_json_str()",
+    "\treturn dumps(value, separators=(',', ':'), default=_default)",
+    "",
+    "",
+    "def _to_dict(value):",
+    "\tif isinstance(value, Msg):",
+    "\t\treturn value.to_dict()",
+    "\tif isinstance(value, list):",
+    "\t\treturn [_to_dict(v) for v in value]",
+    "\tif isinstance(value, dict):",
+    "\t\treturn {k: _to_dict(v) for k, v in value.items()}",
+    "\treturn value",
+    "",
+    "",
+    "def _type_error(msg, name, kind):",
+    "\tvalue = getattr(msg, name)",
+    "\treturn Exception(f'{type(msg).__name__}.{name} must be {kind}, got {type(value).__name__} {value!r}')",
+    "",
+    "",
+    "def _raise(error):",
+    "\traise error",
+    "",
+    "",
+    "def _str_error(msg, required, optional):",
+    "\tfor name in required + optional:",
+    "\t\tvalue = getattr(msg, name)",
+    "\t\tif not isinstance(value, str) and (value is not None or name in required):",
+    "\t\t\treturn _type_error(msg, name, 'a str')",
+    "\treturn Exception(f'{type(msg).__name__} has a field that is not JSON serializable')",
+    "",
+    "",
+    "class Msg():",
+    "\t__slots__ = ()",
+    "",
+    "\tdef to_json(self) -> bytes:",
+    "\t\treturn self.to_json_str().encode()",
+    "",
+    "\tdef to_binary(self) -> str:",
+    "\t\treturn b64encode(self.to_json_str().encode()).decode()",
+    "",
+    "\tdef __repr__(self):",
+    "\t\treturn f'{type(self).__name__}({self.to_json_str()})'",
+]
+
+
+class SlotClassHolder():
+    """
+    A message as a `__slots__` class, eg. for `{'transfer': {'amount': .., 'recipient': ..}}`:
+    class ExecuteTransfer(Msg):
+        __slots__ = ('amount', 'recipient')
+    with `to_dict()` and a precompiled `to_json_str()` that skips `None` optionals.
+    `msg_name` is the wrapping key, None for flat messages (instantiate, definitions)
+    """
+    name: str
+    msg_name: str
+    params: List[ParamHolder]
+
+    def __init__(self, name: str, msg_name: str = None) -> None:
+        self.name = name
+        self.msg_name = msg_name
+        self.params = []
+
+    def add_param(self, param: ParamHolder):
+        self.params.append(param)
+
+    def sorted_params(self) -> List[ParamHolder]:
+        return sorted(self.params, key=lambda p: not p.required)
+
+    def build_init(self) -> List[str]:
+        args = ", ".join(["self"] + [p.as_arg() for p in self.sorted_params()])
+        lines = [f"def __init__({args}):"]
+        for p in self.params:
+            lines.append(f"\tself.{p.name} = {p.name}")
+        if not self.params:
+            lines.append("\tpass")
+        return lines
+
+    def build_to_dict(self) -> List[str]:
+        lines = ["def to_dict(self) -> dict:"]
+        required = [p for p in self.params if p.required]
+        optional = [p for p in self.params if not p.required]
+        items = ", ".join([f"'{p.name}': {p.as_value()}" for p in required])
+        lines.append(f"\td = {{{items}}}")
+        for p in optional:
+            lines.append(f"\tif self.{p.name} is not None:")
+            lines.append(f"\t\td['{p.name}'] = {p.as_value()}")
+        if self.msg_name is None:
+            lines.append("\treturn d")
+        else:
+            lines.append(f"\treturn {{'{self.msg_name}': d}}")
+        return lines
+
+    def build_to_json(self) -> List[str]:
+        lines = ["def to_json_str(self) -> str:"]
+        body = self.build_to_json_body()
+        required = tuple(p.name for p in self.params if p.type_instance == "str" and p.required)
+        optional = tuple(p.name for p in self.params if p.type_instance == "str" and not p.required)
+        if not required and not optional:
+            return lines + body
+        # `_encode_str` only says "argument must be str", name the field instead
+        lines.append("\ttry:")
+        lines += ["\t" + line for line in body]
+        lines.append("\texcept TypeError:")
+        lines.append(f"\t\traise _str_error(self, {required!r}, {optional!r}) from None")
+        return lines
+
+    def build_to_json_body(self) -> List[str]:
+        lines = []
+        required = [p for p in self.params if p.required]
+        optional = [p for p in self.params if not p.required]
+        opening, closing = "'{", "}'"
+        if self.msg_name is not None:
+            opening, closing = f"'{{\"{self.msg_name}\":{{", "}}'"
+        if not self.params:
+            lines.append(f"\treturn {opening}{closing}")
+        elif not optional:
+            body = " + ',' + ".join([p.as_json() for p in required])
+            lines.append(f"\treturn {opening}' + {body} + '{closing}")
+        else:
+            items = ", ".join([p.as_json() for p in required])
+            lines.append(f"\tfields = [{items}]")
+            for p in optional:
+                lines.append(f"\tif self.{p.name} is not None:")
+                lines.append(f"\t\tfields.append({p.as_json()})")
+            lines.append(f"\treturn {opening}' + ','.join(fields) + '{closing}")
+        return lines
+
+    def build_lines(self) -> List[str]:
+        lines = [f"class {self.name}(Msg):"]
+        slots = "".join([f"'{p.name}', " for p in self.params])
+        lines.append(f"\t__slots__ = ({slots.strip()})")
+        for method in [self.build_init(), self.build_to_dict(), self.build_to_json()]:
+            lines.append("")
+            lines += ["\t" + line if line else line for line in method]
+        return lines
+
+
+# Shared by every response class of a generated module
+RESPONSES_PRELUDE = [
+    "_new = object.__new__",
+    "",
+    "",
+    "def _fields(cls):",
+    "\treturn [k for c in reversed(cls.__mro__) for k in c.__dict__.get('__slots__', ())]",
+    "",
+    "",
+    "class Response():",
+    "\t__slots__ = ()",
+    "",
+    "\tdef __eq__(self, other):",
+    "\t\treturn type(self) is type(other) and all(getattr(self, k) == getattr(other, k) for k in _fields(type(self)))",
+    "",
+    "\tdef __repr__(self):",
+    "\t\treturn f\"{type(self).__name__}({', '.join(f'{k}={getattr(self, k)!r}' for k in _fields(type(self)))})\"",
+]
+
+
+def decode_expression(shape, source: str, contract_name: str, ints: bool, depth: int = 0) -> str:
+    """
+    Python expression decoding `source` according to its `Shape`, eg.
+    `[Token.AllowanceInfo.decode(v0) for v0 in data['allowances']]`
+    `source` is evaluated twice for optionals, it must be a name then
+    """
+    if shape.is_plain(ints):
+        return source
+    if shape.kind == "integer":
+        return f"int({source})"
+    if shape.kind == "object":
+        return f"{contract_name}.{shape.name}.decode({source})"
+    if shape.kind == "list":
+        item = f"v{depth}"
+        return f"[{decode_expression(shape.item, item, contract_name, ints, depth + 1)} for {item} in {source}]"
+    return f"None if {source} is None else {decode_expression(shape.item, source, contract_name, ints, depth)}"
+
+
+class ResponseClassHolder():
+    """
+    A query response as a `__slots__` class, eg. for BalanceResponse:
+    class BalanceResponse(Response):
+        __slots__ = ('balance',)
+    with a generated `decode(data)` building it from the JSON in one pass,
+    nested definitions included. With `ints`, Uint64 / Uint128... become int.
+    `base` is a message class of the same name (eg. MinterResponse), extended with `decode`.
+    Its fields stay strings then, they are encoded again by the message methods.
+    """
+    name: str
+    fields: list
+
+    def __init__(self, name: str, fields: list, contract_name: str, ints: bool = False, base: str = None) -> None:
+        self.name = name
+        self.fields = fields
+        self.contract_name = contract_name
+        self.ints = ints
+        self.base = base
+
+    def field_type(self, field) -> str:
+        if self.ints and field.shape.kind == "integer":
+            return "int"
+        if field.shape.kind == "object":
+            return f"'{field.shape.name}'"
+        return field.type
+
+    def build_init(self) -> List[str]:
+        params = [ParamHolder(f.name, self.field_type(f), f.required) for f in self.fields]
+        args = ", ".join(["self"] + [p.as_arg() for p in sorted(params, key=lambda p: not p.required)])
+        lines = [f"def __init__({args}):"]
+        for p in params:
+            lines.append(f"\tself.{p.name} = {p.name}")
+        if not params:
+            lines.append("\tpass")
+        return lines
+
+    def build_decode(self) -> List[str]:
+        lines = ["@classmethod", f"def decode(cls, data: dict) -> '{self.name}':", "\tself = _new(cls)"]
+        ints = self.ints and self.base is None
+        for field in self.fields:
+            shape = field.shape
+            if not field.required and shape.kind != "optional":
+                # A missing field is None, like a null one
+                shape = type(shape)("optional", item=shape)
+            key = f"data['{field.name}']" if field.required else f"data.get('{field.name}')"
+            if shape.is_plain(ints) or shape.kind != "optional":
+                lines.append(f"\tself.{field.name} = {decode_expression(shape, key, self.contract_name, ints)}")
+            else:
+                lines.append(f"\tv = {key}")
+                lines.append(f"\tself.{field.name} = {decode_expression(shape, 'v', self.contract_name, ints)}")
+        lines.append("\treturn self")
+        return lines
+
+    def build_lines(self) -> List[str]:
+        if self.base is not None:
+            # The message `__repr__` would come first
+            lines = [f"class {self.name}({self.base}, Response):", "\t__slots__ = ()", "\t__repr__ = Response.__repr__"]
+            methods = [self.build_decode()]
+        else:
+            lines = [f"class {self.name}(Response):"]
+            slots = "".join([f"'{f.name}', " for f in self.fields])
+            lines.append(f"\t__slots__ = ({slots.strip()})")
+            methods = [self.build_init(), self.build_decode()]
+        for method in methods:
+            lines.append("")
+            lines += ["\t" + line if line else line for line in method]
+        return lines
+
+
 def test_param():
     p = ParamHolder("amount", "int", False)
     expected = "amount: int = None"
@@ -161,7 +446,124 @@ def test_class():
     print("[+] Test class passed")
 
 
+def test_slot_class():
+    import json
+    c = SlotClassHolder("ExecuteIncreaseAllowance", "increase_allowance")
+    c.add_param(ParamHolder("amount", "str"))
+    c.add_param(ParamHolder("expires", "dict", False))
+    c.add_param(ParamHolder("spender", "str"))
+    namespace = {}
+    exec("\n".join(SLOTS_PRELUDE + [""] + c.build_lines()), namespace)
+    cls = namespace["ExecuteIncreaseAllowance"]
+
+    msg = cls("10", "terra1")
+    assert(msg.to_dict() == {'increase_allowance': {'amount': '10', 'spender': 'terra1'}})
+    assert(msg.to_json() == b'{"increase_allowance":{"amount":"10","spender":"terra1"}}')
+    msg = cls("10", "terra1", {'never': {}})
+    assert(msg.to_json() == b'{"increase_allowance":{"amount":"10","spender":"terra1","expires":{"never":{}}}}')
+    assert(not hasattr(msg, "__dict__"))
+
+    c = SlotClassHolder("Instantiate")
+    c.add_param(ParamHolder("decimals", "int"))
+    c.add_param(ParamHolder("mint", "dict", False))
+    exec("\n".join(c.build_lines()), namespace)
+    cls = namespace["Instantiate"]
+    assert(cls(6).to_json() == b'{"decimals":6}')
+    assert(cls(6, namespace["ExecuteIncreaseAllowance"]("1", "a")).to_dict()
+           == {'decimals': 6, 'mint': {'increase_allowance': {'amount': '1', 'spender': 'a'}}})
+
+    # Nested messages in lists and maps
+    c = SlotClassHolder("Cw20Coin")
+    c.add_param(ParamHolder("address", "str"))
+    c.add_param(ParamHolder("amount", "str"))
+    exec("\n".join(c.build_lines()), namespace)
+    coin = namespace["Cw20Coin"]
+    c = SlotClassHolder("InstantiateBalances")
+    c.add_param(ParamHolder("decimals", "int"))
+    c.add_param(ParamHolder("initial_balances", "list"))
+    c.add_param(ParamHolder("extra", "dict", False))
+    exec("\n".join(c.build_lines()), namespace)
+    msg = namespace["InstantiateBalances"](6, [coin("a", "1"), coin("b", "2")], {"c": [coin("c", "3")]})
+    expected = {'decimals': 6, 'initial_balances': [{'address': 'a', 'amount': '1'}, {'address': 'b', 'amount': '2'}],
+                'extra': {'c': [{'address': 'c', 'amount': '3'}]}}
+    assert(msg.to_dict() == expected)
+    assert(json.dumps(msg.to_dict(), separators=(',', ':')).encode() == msg.to_json())
+
+    try:
+        coin("a", 10).to_json()
+        assert(False)
+    except Exception as e:
+        assert(str(e) == "Cw20Coin.amount must be a str, got int 10")
+
+    # Ints and bools are checked, a bool is not an int
+    c = SlotClassHolder("Limits")
+    c.add_param(ParamHolder("decimals", "int"))
+    c.add_param(ParamHolder("limit", "int", False))
+    c.add_param(ParamHolder("paused", "bool", False))
+    exec("\n".join(c.build_lines()), namespace)
+    limits = namespace["Limits"]
+    assert(limits(6, 10, False).to_json() == b'{"decimals":6,"limit":10,"paused":false}')
+    assert(limits(6).to_json() == b'{"decimals":6}')
+    for args, error in [((None,), "Limits.decimals must be an int, got NoneType None"),
+                        ((6, "abc"), "Limits.limit must be an int, got str 'abc'"),
+                        ((6, True), "Limits.limit must be an int, got bool True"),
+                        ((6, 10, "false"), "Limits.paused must be a bool, got str 'false'")]:
+        try:
+            limits(*args).to_json()
+            assert(False)
+        except Exception as e:
+            assert(str(e) == error), str(e)
+
+    print("[+] Test slot class passed")
+
+
+def test_response_class():
+    from compiler import Field, Shape
+    integer = Shape("integer")
+    info = ResponseClassHolder("AllowanceInfo", [
+        Field("allowance", "str", True, integer), Field("spender", "str", True, Shape("plain")),
+        Field("expires", "dict", False, Shape("plain"))], "Token", True)
+    page = ResponseClassHolder("AllAllowancesResponse", [
+        Field("allowances", "list", True, Shape("list", item=Shape("object", "AllowanceInfo"))),
+        Field("total", "str", False, integer),
+        Field("heights", "list", False, Shape("optional", item=Shape("list", item=integer)))], "Token", True)
+    lines = RESPONSES_PRELUDE + ["", "", "class Token():"]
+    for holder in (info, page):
+        lines.append("")
+        lines += ["\t" + line if line else line for line in holder.build_lines()]
+    namespace = {}
+    exec("\n".join(lines), namespace)
+    token = namespace["Token"]
+
+    decoded = token.AllAllowancesResponse.decode({"allowances": [{"allowance": "10", "spender": "terra1"}],
+                                                 "heights": ["1", "2"]})
+    assert(decoded.allowances == [token.AllowanceInfo(10, "terra1")] and decoded.total is None)
+    assert(decoded.heights == [1, 2] and not hasattr(decoded, "__dict__"))
+    assert(repr(decoded.allowances[0]) == "AllowanceInfo(allowance=10, spender='terra1', expires=None)")
+    assert(token.AllAllowancesResponse.decode({"allowances": [], "total": "5", "heights": None}).total == 5)
+
+    # A response that is also a message keeps its strings, to be sent back
+    message = SlotClassHolder("MinterResponse")
+    message.add_param(ParamHolder("minter", "str"))
+    message.add_param(ParamHolder("cap", "str", False))
+    minter = ResponseClassHolder("MinterResponse", [
+        Field("minter", "str", True, Shape("plain")), Field("cap", "str", False, integer)], "Token", True, "MinterResponse")
+    lines = SLOTS_PRELUDE + [""] + RESPONSES_PRELUDE + ["", "", "class Token():", ""]
+    for holder in (message, minter):
+        lines += ["\t" + line if line else line for line in holder.build_lines()] + [""]
+    exec("\n".join(lines), namespace)
+    decoded = namespace["Token"].MinterResponse.decode({"minter": "terra1", "cap": "10"})
+    assert(decoded.cap == "10" and decoded.to_json() == b'{"minter":"terra1","cap":"10"}')
+    assert(repr(decoded) == "MinterResponse(minter='terra1', cap='10')")
+    assert(decoded == namespace["Token"].MinterResponse.decode({"minter": "terra1", "cap": "10"}))
+    assert(decoded != namespace["Token"].MinterResponse.decode({"minter": "terra1"}))
+
+    print("[+] Test response class passed")
+
+
 if __name__ == "__main__":
     test_param()
     test_function()
     test_class()
+    test_slot_class()
+    test_response_class()
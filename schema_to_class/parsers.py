@@ -82,6 +82,7 @@ class RootSchema():
     meta_schema: str = None
     schema: SchemaObject = None
     definitions: Dict[str, SchemaObject] = None
+    definitions_data: Dict[str, dict] = None  # raw, for the TypeResolver
 
     def __init__(self, root_data: dict) -> None:
         if '$schema' in root_data:
@@ -89,6 +90,7 @@ class RootSchema():
         if 'definitions' in root_data:
             self.definitions = dict()
             definitions_data = root_data['definitions']
+            self.definitions_data = definitions_data
             for k in definitions_data:
                 schema_data = definitions_data[k]
                 # May be a boolean ? Never came across this
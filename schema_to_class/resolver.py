@@ -0,0 +1,150 @@
+from typing import Dict, List
+
+
+simple_types = {"array": "list",
+                "boolean": "bool",
+                "integer": "int",
+                "null": "None",
+                "number": "float",
+                "object": "dict",
+                "string": "str"}
+
+
+class TypeResolver():
+    """
+    Compiles the `definitions` of a RootSchema into python types, eg:
+    "Uint128": {"type": "string"}                           -> str
+    "Timestamp": {"allOf": [{"$ref": "#/definitions/Uint64"}]} -> str
+    "Expiration": {"oneOf": [{"type": "object", ...}, ...]}  -> dict
+    Each definition is resolved once and memoized, so a schema is resolved in linear time.
+    """
+    definitions: Dict[str, dict]
+    resolved: Dict[str, str]
+
+    def __init__(self, definitions: Dict[str, dict] = None) -> None:
+        self.definitions = definitions or {}
+        self.resolved = {}
+        self.resolving = set()
+
+    def resolve_ref(self, ref: str) -> str:
+        # ref looks like #/definitions/Uint128
+        # we only want Uint128
+        name = ref.split("/")[-1]
+        if name in self.resolved:
+            return self.resolved[name]
+        if name not in self.definitions or name in self.resolving:
+            # Unknown, or recursive through refs only: nothing to learn from it
+            return None
+        self.resolving.add(name)
+        type_instance = self.resolve(self.definitions[name])
+        self.resolving.discard(name)
+        self.resolved[name] = type_instance
+        return type_instance
+
+    def resolve_union(self, schemas: List[dict]) -> str:
+        """
+        `anyOf`/`oneOf`: the variants types, without `null` which only makes it optional
+        """
+        types = []
+        for schema in schemas:
+            type_instance = self.resolve(schema)
+            if type_instance is None:
+                return None
+            if type_instance != "None" and type_instance not in types:
+                types.append(type_instance)
+        if not types:
+            return "None"
+        if len(types) == 1:
+            return types[0]
+        return "'" + " | ".join(t.strip("'") for t in types) + "'"
+
+    def resolve(self, schema: dict) -> str:
+        """
+        Python type of a schema (a property, an item, a definition), or None if unknown
+        """
+        if not isinstance(schema, dict):
+            return None
+        if "$ref" in schema:
+            return self.resolve_ref(schema["$ref"])
+        if "type" in schema:
+            type_instance = schema["type"]
+            # Nullable like ["string", "null"]
+            if type(type_instance) == list:
+                types = [t for t in type_instance if t != "null"] or ["null"]
+                return self.resolve_union([{"type": t} for t in types])
+            return simple_types.get(type_instance)
+        if "allOf" in schema:
+            # Intersection, the first part gives the shape
+            for part in schema["allOf"]:
+                type_instance = self.resolve(part)
+                if type_instance is not None:
+                    return type_instance
+            return None
+        if "anyOf" in schema:
+            return self.resolve_union(schema["anyOf"])
+        if "oneOf" in schema:
+            return self.resolve_union(schema["oneOf"])
+        if "enum" in schema:
+            return self.resolve_union([{"type": simple_type_of(v)} for v in schema["enum"]])
+        return None
+
+    def resolve_all(self) -> Dict[str, str]:
+        """Resolve every definition, returns the whole graph"""
+        for name in self.definitions:
+            self.resolve_ref(name)
+        return self.resolved
+
+
+def simple_type_of(value) -> str:
+    """JSON schema type name of a python value"""
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "boolean"
+    if isinstance(value, int):
+        return "integer"
+    if isinstance(value, float):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, list):
+        return "array"
+    return "object"
+
+
+def test_resolve_refs():
+    definitions = {
+        "Uint64": {"type": "string"},
+        "Timestamp": {"allOf": [{"$ref": "#/definitions/Uint64"}]},
+        "Expiration": {"oneOf": [
+            {"type": "object", "properties": {"at_height": {"type": "integer"}}},
+            {"type": "object", "properties": {"at_time": {"$ref": "#/definitions/Timestamp"}}},
+        ]},
+    }
+    r = TypeResolver(definitions)
+    assert(r.resolve({"$ref": "#/definitions/Timestamp"}) == "str")
+    assert(r.resolve({"$ref": "#/definitions/Expiration"}) == "dict")
+    assert(r.resolve({"anyOf": [{"$ref": "#/definitions/Expiration"}, {"type": "null"}]}) == "dict")
+    assert(r.resolve({"type": ["string", "null"]}) == "str")
+    assert(r.resolve({"$ref": "#/definitions/Unknown"}) is None)
+
+    print("[+] Test resolve refs passed")
+
+
+def test_resolve_recursive():
+    definitions = {
+        "A": {"anyOf": [{"$ref": "#/definitions/B"}, {"type": "null"}]},
+        "B": {"allOf": [{"$ref": "#/definitions/A"}]},
+        "Mixed": {"oneOf": [{"type": "string", "enum": ["never"]}, {"type": "object"}]},
+    }
+    r = TypeResolver(definitions)
+    assert(r.resolve({"$ref": "#/definitions/A"}) is None)
+    assert(r.resolve({"$ref": "#/definitions/Mixed"}) == "'str | dict'")
+    assert(len(r.resolve_all()) == 3)
+
+    print("[+] Test resolve recursive passed")
+
+
+if __name__ == "__main__":
+    test_resolve_refs()
+    test_resolve_recursive()
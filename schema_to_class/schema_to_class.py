@@ -3,8 +3,13 @@ from pprint import pprint
 import sys
 from typing import Dict, List, Set
 import os
-from holders import ClassHolder, ParamHolder, FunctionHolder
-from parsers import RootSchema, SchemaObject, Metadata
+import glob
+import time
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from holders import (ClassHolder, ParamHolder, FunctionHolder, SlotClassHolder, ResponseClassHolder,
+                     SLOTS_PRELUDE, RESPONSES_PRELUDE)
+from compiler import ContractIR, Message, compile_contract
 
 
 def get_json_data(path: str) -> json:
@@ -32,6 +37,9 @@ def process_arguments(argv: list) -> str:
 
     if "-h" in arguments or "-help" in arguments:
         print("usage: python3 schema_to_class.py ./terraswap/contracts/terraswap_token")
+        print("       python3 schema_to_class.py --workspace ./terraswap -o ./generated [-j 8] [--force]")
+        print("       -t/--target dict (default) or slots")
+        print("       --ints: with slots, response Uint64/Uint128 values are decoded to int")
         print("commands list: python3 schema_to_class.py -h")
         exit()
 
@@ -81,16 +89,7 @@ def extract_name_from_path(path: str) -> str:
     return new_name
 
 
-simple_types = {"array": "list",
-                "boolean": "bool",
-                "integer": "int",
-                "null": "None",
-                "number": "float",
-                "object": "dict",
-                "string": "str"}
-
-
-def collect_schemas(contract_path: str) -> List[RootSchema]:
+def collect_schemas(contract_path: str) -> List[dict]:
     """
     Goes into `contract_path` directory, list the messages (only) schemas,
     and returns the schemas in a list
@@ -111,199 +110,398 @@ def collect_schemas(contract_path: str) -> List[RootSchema]:
     return res
 
 
-def find_type_in_definitions(definitions: List[SchemaObject], target_type) -> str:
+def collect_response_schemas(contract_path: str) -> List[dict]:
     """
-    Read through all the defined types of the Json file, and try to find the
-    target type, eg:
-    "Uint128": {
-      "description": "A thin wrapper around u128 that is using strings for JSON encoding/decoding, such that the full u128 range can be used for clients that convert JSON numbers to floats, like JavaScript and jq.\n\n# Examples\n\nUse `from` to create instances of this and `u128` to get the value out:\n\n``` # use cosmwasm_std::Uint128; let a = Uint128::from(123u128); assert_eq!(a.u128(), 123);\n\nlet b = Uint128::from(42u64); assert_eq!(b.u128(), 42);\n\nlet c = Uint128::from(70u32); assert_eq!(c.u128(), 70); ```",
-      "type": "string"
-    },
+    The `*_response.json` schemas of the contract, by file name
     """
-    # ref looks like #/definitions/Uint128
-    # we only want Uint128
-    target_type = target_type.split("/")[-1]
-
-    if target_type in definitions:
-        ref_object: SchemaObject = definitions[target_type]
-
-        # We're looking at `Uint128/type`
-        if ref_object.instance_type:
-            type_instance = ref_object.instance_type
+    schema_directory_path = f"{contract_path}/schema/"
+    return [get_json_data(os.path.join(schema_directory_path, schema_path))
+            for schema_path in sorted(os.listdir(schema_directory_path))
+            if schema_path.endswith("_response.json")]
 
-            # Map to python type (string -> str)
-            if type_instance in simple_types:
-                type_instance = simple_types[type_instance]
-                return type_instance
-            else:
-                # It happens that some types could be like
-                # "allOf": [
-                #     {
-                #       "$ref": "#/definitions/Uint64"
-                #     }
-                #   ]
-                # TODO: recursive definition exploring
-                # For now just return None
-                pass
-        else:
-            pass
 
-    return None
+def compile_schemas(contract_name: str, contract_path: str, responses: bool = False) -> ContractIR:
+    """
+    Compiles every message schema of the contract once, for any target.
+    With `responses`, the response schemas too
+    """
+    return compile_contract(contract_name, collect_schemas(contract_path),
+                            collect_response_schemas(contract_path) if responses else ())
 
 
-def build(contract_name: str, contract_path: str) -> None:
-    classes = []
-    defined_types = []  # [{'Uint128': 'str'}]
-    root_schemas_data = collect_schemas(contract_path)
+def build_lines(contract_name: str, contract_path: str) -> List[str]:
+    """
+    Generates the class of the contract, returns its lines
+    """
+    # The class object holding all messages constructors
+    # Compiled to string at the end of the script
     class_holder = ClassHolder(contract_name)
 
-    # Go through each JSON msg data
-    for root_schema_data in root_schemas_data:
+    for message in compile_schemas(contract_name, contract_path).messages:
 
-        # Parse into RootSchema format
-        root_schema = RootSchema(root_schema_data)
-
-        # The class object holding all messages constructors
-        # Compiled to string at the end of the script
-
-        # If instance is `object`, it is an InstantiateMsg
-        if root_schema.schema.instance_type == "object":
+        # Definitions only become classes in the slots target
+        if message.definition is not None:
+            continue
 
-            # We want to call it like `Contract.InstantiateMsg()` so we need a function
-            func_name = root_schema.schema.metadata.title
+        # Flat message like InstantiateMsg
+        # We want to call it like `Contract.instantiate()` so we need a function
+        if message.msg_name is None:
+            # TODO: Handle migrate msg...
+            if not message.fields:
+                continue
+            func_name = message.title
             if func_name == "InstantiateMsg":
                 func_name = "instantiate"
-
             function_holder = FunctionHolder(func_name)
 
-            # Go through all properties like `{'claim': {'type': 'object'}}`
-            if not root_schema.schema.properties:
-                # TODO: Handle migrate msg...
-                continue
-            for prop_key in root_schema.schema.properties:
-
-                # There is a required `"required": ["anchor_token","genesis_time","owner"]`
-                # at the root of the schema, we check inclusion
-                required = False
-                if root_schema.schema.required:
-                    required = prop_key in root_schema.schema.required
-
-                # Get the type of the prop, and map it to a python type
-                # ex: integer -> int, string -> str
-                type_instance = None
-                if "type" in root_schema.schema.properties[prop_key]:
-                    type_instance = root_schema.schema.properties[prop_key]["type"]
-
-                    # Sometimes they could be a type like [str, null], we take the first one
-                    if type(type_instance) == list:
-                        type_instance = type_instance[0]
-
-                    # Map to python type
-                    if type_instance in simple_types:
-                        type_instance = simple_types[type_instance]
-                    else:
-                        pass  # TODO
-                else:
-                    pass  # TODO
-
-                # Add the parameter to the InstantiateMsg function holder
-                function_holder.add_param(ParamHolder(
-                    prop_key, type_instance, required))
-
-            # Add the function holder to the class holder
-            class_holder.add_function(function_holder)
-
-        # Else, it is a ExecuteMsg or QueryMsg
+        # Else, it is a ExecuteMsg or QueryMsg variant
         else:
-
             # Get the prefix (execute or query)
-            prefix = root_schema.schema.metadata.title
-            if prefix == "ExecuteMsg":
-                prefix = "execute"
-            elif prefix == "QueryMsg":
-                prefix = "query"
-            elif prefix == "Cw20HookMsg":
-                prefix = "cw20"
-
-            # Messages are pretty deep in the object:
-            # ./oneOf/{message index}/properties/{message definition}
-
-            schema_object: SchemaObject
-            schema_list = []
-            if root_schema.schema.any_of:
-                for s in root_schema.schema.any_of:
-                    schema_list.append(s)
-            if root_schema.schema.one_of:
-                for s in root_schema.schema.one_of:
-                    schema_list.append(s)
-            for schema_object in schema_list:
-                # ./oneOf/{message index}
-
-                for func_name in schema_object.properties:
-                    func_schema = SchemaObject(
-                        schema_object.properties[func_name])
-
-                    # We want to call it like `Contract.InstantiateMsg()` so we need a function
-                    function_holder = FunctionHolder(func_name, prefix, True)
-
-                    # Go through all properties like `{'claim': {'type': 'object'}}`
-                    # Sometimes it could just be `{'claim': {}}`
-                    if func_schema.properties == None:
-                        continue
-                    for prop_key in func_schema.properties:
-
-                        # There is a required `"required": ["anchor_token","genesis_time","owner"]`
-                        # at the root of the schema, we check inclusion
-                        required = False
-                        if func_schema.required:
-                            required = prop_key in func_schema.required
-
-                        # Get the type of the prop, and map it to a python type
-                        # ex: integer -> int, string -> str
-                        # Sometimes it may be a ref to a definition `{'$ref': '#/definitions/Uint128'}`
-                        type_instance = None
-                        if "type" in func_schema.properties[prop_key]:
-                            type_instance = func_schema.properties[prop_key]["type"]
-
-                            # Sometimes they could be a type like [str, null], we take the first one
-                            if type(type_instance) == list:
-                                type_instance = type_instance[0]
-
-                            # Map to python type
-                            if type_instance in simple_types:
-                                type_instance = simple_types[type_instance]
-                            else:
-                                pass  # TODO
-                        else:
-                            if "$ref" in func_schema.properties[prop_key]:
-                                ref = func_schema.properties[prop_key]['$ref']
-                                type_instance = find_type_in_definitions(
-                                    root_schema.definitions, ref)
-
-                        # Add the parameter to the InstantiateMsg function holder
-                        function_holder.add_param(ParamHolder(
-                            prop_key, type_instance, required))
-
-                        # lines = function_holder.build_lines()
-                        # print("\n".join(lines))
-
-                # Add the function holder to the class holder
-                class_holder.add_function(function_holder)
+            prefix = {"ExecuteMsg": "execute", "QueryMsg": "query",
+                      "Cw20HookMsg": "cw20"}.get(message.title, message.title)
+            # A variant wrapping a value, eg. `{'upload_logo': logo}`, is its one param
+            function_holder = FunctionHolder(message.msg_name, prefix, not message.value)
+
+        # Sometimes it could just be `{'claim': {}}`
+        for field in message.fields or []:
+            function_holder.add_param(ParamHolder(field.name, field.type, field.required))
+
+        # Add the function holder to the class holder
+        class_holder.add_function(function_holder)
+
     # Compile the class holder to string
     lines = class_holder.build_lines()
+    return lines
+
+
+def camel_case(name: str) -> str:
+    """
+    `increase_allowance` -> `IncreaseAllowance`
+    """
+    return "".join(word[:1].upper() + word[1:] for word in name.replace("-", "_").split("_"))
+
+
+def slot_class_name(message: Message) -> str:
+    """
+    `ExecuteMsg` / `transfer` -> `ExecuteTransfer`, `InstantiateMsg` -> `Instantiate`,
+    `Expiration` / `at_height` -> `ExpirationAtHeight`
+    """
+    if message.definition is not None:
+        return message.definition + camel_case(message.msg_name or "")
+    if message.msg_name is None:
+        return "Instantiate" if message.title == "InstantiateMsg" else message.title
+    prefix = {"ExecuteMsg": "Execute", "QueryMsg": "Query",
+              "Cw20HookMsg": "Cw20"}.get(message.title, "")
+    return prefix + camel_case(message.msg_name)
+
+
+def build_slots_lines(contract_name: str, contract_path: str, ints: bool = False) -> List[str]:
+    """
+    Generates the `__slots__` target: one class per message variant, per
+    object definition and per variant of enum definitions, nested in the contract class, eg. `TerraswapToken.ExecuteTransfer`.
+    Response schemas become classes with a `decode`, listed per query in `responses`
+    """
+    ir = compile_schemas(contract_name, contract_path, True)
+    slot_classes = {}
+    for message in ir.messages:
+        # Flat messages without properties have nothing to hold
+        if message.msg_name is None and not message.fields:
+            continue
+        name = slot_class_name(message)
+        if name in slot_classes:
+            continue
+        # A variant wrapping a value is flat, its one field is named after the variant
+        slot_class = SlotClassHolder(name, None if message.value else message.msg_name)
+        for field in message.fields or []:
+            slot_class.add_param(ParamHolder(field.name, field.type, field.required))
+        slot_classes[name] = slot_class
+
+    response_classes = {}
+    for message in list(ir.response_definitions.values()) + ir.responses:
+        name = slot_class_name(message)
+        if name in response_classes or message.fields is None:
+            continue
+        base = name if name in slot_classes else None
+        response_classes[name] = ResponseClassHolder(name, message.fields, contract_name, ints, base)
+
+    prelude = SLOTS_PRELUDE + ["", ""] + RESPONSES_PRELUDE if response_classes else SLOTS_PRELUDE
+    lines = prelude + ["", "", f"class {contract_name}():"]
+    for holder in list(slot_classes.values()) + list(response_classes.values()):
+        lines.append("")
+        lines += ["\t" + line if line else line for line in holder.build_lines()]
+
+    if response_classes:
+        # `{'balance': BalanceResponse}`, by the CosmWasm naming of responses
+        queries = [m.msg_name for m in ir.messages if m.title == "QueryMsg" and m.msg_name is not None]
+        items = [f"'{q}': {camel_case(q)}Response" for q in queries if f"{camel_case(q)}Response" in response_classes]
+        lines += ["", f"\tresponses = {{{', '.join(items)}}}"]
+    return lines
+
+
+# Generator targets, `dict` is the historical one
+TARGETS = {"dict": build_lines,
+           "slots": build_slots_lines}
+
+
+def build_target(target: str, contract_name: str, contract_path: str, ints: bool = False) -> List[str]:
+    """
+    Lines of `target`, `ints` only matters to the responses of the slots target
+    """
+    if target == "slots":
+        return build_slots_lines(contract_name, contract_path, ints)
+    return TARGETS[target](contract_name, contract_path)
+
+
+def build(contract_name: str, contract_path: str, target: str = "dict", ints: bool = False) -> None:
+    lines = build_target(target, contract_name, contract_path, ints)
     print("\n".join(lines))
 
 
+def discover_contracts(workspace_path: str) -> List[str]:
+    """
+    Finds every `contracts/*/schema/` directory under `workspace_path`,
+    returns the contract directories (fathers of `/schema/`)
+    """
+    pattern = os.path.join(workspace_path, "**", "contracts", "*", "schema")
+    schema_dirs = glob.glob(pattern, recursive=True)
+    return sorted(os.path.dirname(d) for d in schema_dirs if os.path.isdir(d))
+
+
+def extract_module_name_from_path(path: str) -> str:
+    """
+    Python module name of a contract, `contracts/terraswap-token` -> `terraswap_token`
+    """
+    name = os.path.basename(os.path.normpath(path))
+    name = name.replace(" ", "_").replace("-", "_").lower()
+    if name[0].isdigit():
+        name = "_" + name
+    return name
+
+
+def check_module_names(contract_paths: List[str]) -> None:
+    """
+    Two contracts of the same directory name would overwrite each other's module
+    """
+    seen = {}
+    for path in contract_paths:
+        module_name = extract_module_name_from_path(path)
+        if module_name in seen:
+            raise Exception(f"{seen[module_name]} and {path} would both generate {module_name}.py, rename one of them")
+        seen[module_name] = path
+
+
+GENERATED_HEADER = "# Generated by schema_to_class, do not edit"
+MANIFEST_NAME = ".schema_to_class.json"
+GENERATOR_FILES = ["schema_to_class.py", "holders.py", "compiler.py", "resolver.py"]
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path: str) -> str:
+    with open(path, "rb") as f:
+        return hash_bytes(f.read())
+
+
+def hash_schemas(contract_path: str) -> Dict[str, str]:
+    """
+    Content hash of every schema file of the contract, by file name
+    """
+    schema_directory_path = os.path.join(contract_path, "schema")
+    return {name: hash_file(os.path.join(schema_directory_path, name))
+            for name in sorted(os.listdir(schema_directory_path))
+            if name.endswith(".json")}
+
+
+def hash_generator() -> str:
+    """
+    A new version of the generator must regenerate everything
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return hash_bytes("".join(hash_file(os.path.join(directory, name)) for name in GENERATOR_FILES).encode())
+
+
+def load_manifest(output_dir: str) -> dict:
+    """
+    The manifest maps each contract, by its path relative to the workspace,
+    to its schema hashes and generated output hash
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {"generator": None, "contracts": {}}
+    return get_json_data(manifest_path)
+
+
+def save_manifest(output_dir: str, manifest: dict) -> None:
+    write_if_changed(os.path.join(output_dir, MANIFEST_NAME),
+                     json.dumps(manifest, indent=2, sort_keys=True) + "\n")
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """
+    Leaves the file untouched (and its mtime) if it already holds `content`
+    """
+    data = content.encode()
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+def is_up_to_date(entry: dict, schemas: Dict[str, str], output_dir: str) -> bool:
+    """
+    Schemas didn't change and the generated module is still the one we wrote
+    """
+    if not entry or entry["schemas"] != schemas:
+        return False
+    module_path = os.path.join(output_dir, f"{entry['module']}.py")
+    return os.path.exists(module_path) and hash_file(module_path) == entry["output"]
+
+
+def generate_module(contract_path: str, output_dir: str, target: str = "dict", ints: bool = False) -> dict:
+    """
+    Generates the module of one contract in `output_dir`, returns what has been written.
+    Runs in a worker process in workspace mode.
+    """
+    start = time.perf_counter()
+    contract_name = extract_name_from_path(contract_path)
+    module_name = extract_module_name_from_path(contract_path)
+    lines = [GENERATED_HEADER, ""] + build_target(target, contract_name, contract_path, ints)
+    content = "\n".join(lines) + "\n"
+    module_path = os.path.join(output_dir, f"{module_name}.py")
+    written = write_if_changed(module_path, content)
+    return {"contract": contract_path,
+            "module": module_name,
+            "class": contract_name,
+            "output": hash_bytes(content.encode()),
+            "written": written,
+            "seconds": time.perf_counter() - start}
+
+
+def prune_modules(output_dir: str, removed: Dict[str, dict], kept: List[str]) -> None:
+    """
+    Deletes the modules of contracts gone from the workspace,
+    unless edited since we wrote them or now generated by another contract
+    """
+    for key, entry in removed.items():
+        module_path = os.path.join(output_dir, f"{entry['module']}.py")
+        if entry["module"] in kept or not os.path.exists(module_path):
+            continue
+        if hash_file(module_path) != entry["output"]:
+            print(f"[~] {module_path} of removed {key} was edited, kept")
+            continue
+        os.remove(module_path)
+        print(f"[+] {module_path} of removed {key} deleted")
+
+
+def write_package_init(output_dir: str, reports: List[dict]) -> None:
+    """
+    The package `__init__` re-exports every generated class
+    """
+    lines = [GENERATED_HEADER, ""]
+    for report in sorted(reports, key=lambda r: r["module"]):
+        lines.append(f"from .{report['module']} import {report['class']}")
+    write_if_changed(os.path.join(output_dir, "__init__.py"), "\n".join(lines) + "\n")
+
+
+def build_workspace(workspace_path: str, output_dir: str, jobs: int = None, force: bool = False,
+                    target: str = "dict", ints: bool = False) -> List[dict]:
+    """
+    Generates one module per contract of the workspace in a process pool,
+    plus a package `__init__`, and reports per contract timing.
+    Contracts whose schemas didn't change since the last run (see the manifest)
+    are not parsed again, and their module is left untouched. Modules of contracts
+    removed from the workspace are deleted.
+    """
+    start = time.perf_counter()
+    contract_paths = discover_contracts(workspace_path)
+    check_module_names(contract_paths)
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest = load_manifest(output_dir)
+    generator = hash_generator() + ":" + target + (":ints" if ints else "")
+    if manifest["generator"] != generator:
+        force = True
+    entries = {}
+    keys = {path: os.path.relpath(path, workspace_path) for path in contract_paths}
+
+    reports = []
+    to_generate = []
+    for path in contract_paths:
+        schemas = hash_schemas(path)
+        entry = manifest["contracts"].get(keys[path])
+        if not force and is_up_to_date(entry, schemas, output_dir):
+            entries[keys[path]] = entry
+            reports.append({"contract": path, "module": entry["module"], "class": entry["class"],
+                            "output": entry["output"], "written": False, "seconds": 0.0})
+            continue
+        to_generate.append((path, schemas))
+
+    if to_generate:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            futures = [executor.submit(generate_module, path, output_dir, target, ints)
+                       for path, _ in to_generate]
+            for (path, schemas), future in zip(to_generate, futures):
+                try:
+                    report = future.result()
+                    reports.append(report)
+                    entries[keys[path]] = {"schemas": schemas, "module": report["module"],
+                                           "class": report["class"], "output": report["output"]}
+                    status = "written" if report["written"] else "unchanged"
+                    print(f"[+] {report['class']} -> {report['module']}.py {status} in {report['seconds'] * 1000:.1f}ms")
+                except Exception as e:
+                    print(f"[!] Error generating {path}: {e}")
+
+    removed = {key: entry for key, entry in manifest["contracts"].items() if key not in keys.values()}
+    prune_modules(output_dir, removed, [r["module"] for r in reports])
+    write_package_init(output_dir, reports)
+    save_manifest(output_dir, {"generator": generator, "contracts": entries})
+    skipped = len(contract_paths) - len(to_generate)
+    print(f"[+] {len(reports)}/{len(contract_paths)} contracts generated ({skipped} up to date) in {time.perf_counter() - start:.2f}s")
+    return reports
+
+
+def get_option(argv: list, names: list, default: str = None) -> str:
+    """
+    Value following one of the `names` flags, eg. `-o ./generated`
+    """
+    for name in names:
+        if name in argv:
+            index = argv.index(name)
+            if index + 1 < len(argv):
+                return argv[index + 1]
+    return default
+
+
 def main():
     """
     # Entry function
     Expects the program to receive 1 argument, specifying the directory to handle.
+    With `--workspace`, every contract of the directory is generated in `-o`.
     """
 
+    target = get_option(sys.argv, ["-t", "--target"], "dict")
+    ints = "--ints" in sys.argv
+    if target not in TARGETS:
+        print(f"[!] Unknown target {target}, expected one of {list(TARGETS)}")
+        exit()
+
+    if "--workspace" in sys.argv:
+        workspace_path = get_option(sys.argv, ["--workspace"], ".")
+        output_dir = get_option(sys.argv, ["-o", "--output"], "generated")
+        jobs = get_option(sys.argv, ["-j", "--jobs"])
+        force = "--force" in sys.argv
+        build_workspace(workspace_path, output_dir, int(jobs) if jobs else None, force, target, ints)
+        return
+
     contract_path = process_arguments(sys.argv)
     contract_name = extract_name_from_path(contract_path)
 
-    build(contract_name, contract_path)
+    build(contract_name, contract_path, target, ints)
 
 
 if __name__ == "__main__":
@@ -1 +1,83 @@
-from .common import *
+"""
+Everything is loaded on first access, so `import terra_sdk_wrapper` doesn't import
+terra_sdk nor create a client. `terra` itself is created on first use (see `configure`).
+"""
+
+import importlib
+
+# Public name -> submodule defining it
+_lazy_attributes = {
+    "to_binary": "encoding",
+    "to_msg": "encoding",
+    "configure": "client",
+    "get_terra": "client",
+    "terra": "common",
+    "Contract": "common",
+    "store_contract": "common",
+    "instantiate_contract": "common",
+    "execute_contract": "common",
+    "send": "common",
+    "TxBatch": "batch",
+    "BatchResult": "batch",
+    "SequenceManager": "sequence",
+    "sequence_manager": "sequence",
+    "AsyncContract": "async_common",
+    "get_async_terra": "async_common",
+    "create_async_terra": "async_common",
+    "close_async_terra": "async_common",
+    "async_store_contract": "async_common",
+    "async_instantiate_contract": "async_common",
+    "async_execute_contract": "async_common",
+    "async_send": "async_common",
+    "QueryCache": "cache",
+    "FeeStrategy": "fees",
+    "GasStats": "fees",
+    "Backend": "backends",
+    "MockBackend": "backends",
+    "MockContract": "backends",
+    "EventStream": "events",
+    "WasmEvent": "events",
+    "FakeTendermintServer": "events",
+    "wasm_checksum": "deploy",
+    "CodeRegistry": "deploy",
+    "store_contracts": "deploy",
+    "Deployment": "deployment",
+    "load_spec": "deployment",
+    "add_sink": "instrument",
+    "remove_sink": "instrument",
+    "HistogramSink": "instrument",
+    "JsonlSink": "instrument",
+    "PrometheusSink": "instrument",
+    "Snapshot": "snapshot",
+    "read_snapshot": "snapshot",
+    "diff_snapshots": "snapshot",
+    "ContractValidator": "validation",
+    "SchemaValidator": "validation",
+    "WalletPool": "pool",
+    "WasmBackend": "wasm_backend",
+    "TxIndex": "txindex",
+    "LCDPool": "lcdpool",
+    "FakeLCDServer": "lcdpool",
+    "Scenario": "loadgen",
+    "Operation": "loadgen",
+    "run_scenario": "loadgen",
+    "report_json": "loadgen",
+}
+
+__all__ = list(_lazy_attributes)
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        module = importlib.import_module(f".{_lazy_attributes[name]}", __name__)
+        return getattr(module, name)
+    # What `from .common import *` used to export (terra_sdk classes...)
+    if not name.startswith("__"):
+        common = importlib.import_module(".common", __name__)
+        if hasattr(common, name):
+            return getattr(common, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,243 @@
+"""
+Asyncio version of the wrapper, built on terra_sdk AsyncLCDClient.
+The coroutines of an event loop share one client, on one HTTP connection pool;
+a semaphore of the client bounds the operations in flight:
+- get_async_terra / close_async_terra
+- async_store_contract
+- async_instantiate_contract
+- async_execute_contract
+- async_send
+
+And the AsyncContract interface:
+- instantiate
+- execute
+- query
+
+    balances = await asyncio.gather(*[token.query(Cw20.query_balance(a)) for a in addresses])
+
+Senders are the usual `Wallet` (eg. `terra.wallets['test1']`), only their key is used.
+Queries, signatures (simulation included) and broadcasts are measured like the sync ones (see `instrument`).
+"""
+
+#============================ Imports ============================#
+
+from contextlib import nullcontext
+import asyncio
+import weakref
+from terra_sdk.client.lcd import AsyncLCDClient
+from terra_sdk.client.localterra import Wallet
+from terra_sdk.util.contract import read_file_as_b64, get_code_id
+from terra_sdk.core.wasm import MsgStoreCode
+from terra_sdk.core.fee import Fee
+from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.util.contract import get_contract_address
+from terra_sdk.core.coins import Coins
+from terra_sdk.core.bank import MsgSend
+from aiohttp import ClientSession, TCPConnector
+from .client import endpoint
+from .encoding import to_msg
+from .messages import execute_message, instantiate_message
+from .instrument import span, describe_broadcast
+import chalk
+
+#============================ Get async Terra ============================#
+
+LOCALTERRA_URL = "http://localhost:1317"
+LOCALTERRA_CHAIN_ID = "localterra"
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_MAX_CONCURRENCY = 64
+
+# A session only works on the loop it was created in: one client per loop
+_async_terras = weakref.WeakKeyDictionary()
+
+
+def create_async_terra(url: str = None, chain_id: str = None,
+                       max_connections: int = DEFAULT_MAX_CONNECTIONS,
+                       max_concurrency: int = DEFAULT_MAX_CONCURRENCY) -> AsyncLCDClient:
+    """
+    Create an AsyncLCDClient on a pooled session.
+    Without `url` and `chain_id`, those of `client.configure` or the environment are used,
+    like the sync client, LocalTerra's otherwise. Of several urls, the first one is used.
+    No more than `max_concurrency` operations (a query, a signed and broadcast tx) run at once,
+    on at most `max_connections` connections; the others wait.
+    Must be called from a running event loop.
+    """
+    urls, configured_chain_id = endpoint()
+    url = url or (urls[0] if urls else LOCALTERRA_URL)
+    chain_id = chain_id or configured_chain_id or LOCALTERRA_CHAIN_ID
+    terra = AsyncLCDClient(url, chain_id, _create_session=False)
+    terra.session = ClientSession(
+        headers={"Accept": "application/json"},
+        connector=TCPConnector(limit=max_connections)
+    )
+    terra.semaphore = asyncio.Semaphore(max_concurrency)
+    return terra
+
+
+def limit(terra: AsyncLCDClient):
+    """The semaphore of `terra`, nothing for a client not made by `create_async_terra`"""
+    return getattr(terra, "semaphore", None) or nullcontext()
+
+
+def get_async_terra() -> AsyncLCDClient:
+    """Returns the AsyncLCDClient of the running loop, created on first use"""
+    loop = asyncio.get_running_loop()
+    terra = _async_terras.get(loop)
+    if terra is None or terra.session.closed:
+        terra = _async_terras[loop] = create_async_terra()
+    return terra
+
+
+async def close_async_terra() -> None:
+    """Close the connection pool of the running loop"""
+    terra = _async_terras.pop(asyncio.get_running_loop(), None)
+    if terra is not None:
+        await terra.session.close()
+
+#============================ SDK wrappers ============================#
+
+
+async def async_store_contract(terra: AsyncLCDClient, sender: Wallet, wasm_path: str) -> str:
+    """Uploads contract, returns code ID"""
+    contract_bytes = read_file_as_b64(wasm_path)
+    store_code = MsgStoreCode(
+        sender=sender.key.acc_address,
+        wasm_byte_code=contract_bytes
+    )
+    async with limit(terra):
+        with span("sign", None, "store_code"):
+            tx = await terra.wallet(sender.key).create_and_sign_tx(
+                CreateTxOptions(
+                    msgs=[store_code],
+                    fee=Fee(10_000_000, "10000000uluna")
+                )
+            )
+        with span("broadcast", None, "store_code") as s:
+            result = await terra.tx.broadcast(tx)
+            describe_broadcast(s, sender, result)
+    try:
+        code_id = get_code_id(result)
+        print(chalk.green(f"[+] Code ID of {wasm_path}: {code_id}"))
+    except ValueError as e:
+        print(chalk.red(f"[!] Error storing contract {wasm_path}"))
+        print(result)
+        raise e
+    return code_id
+
+
+async def async_instantiate_contract(terra: AsyncLCDClient, sender: Wallet, contract_id: str, init_msg: dict) -> str:
+    """Instantiate contract, returns the contract address"""
+    instantiate = instantiate_message(sender.key.acc_address, contract_id, init_msg)
+    async with limit(terra):
+        with span("sign", None, "instantiate"):
+            tx = await terra.wallet(sender.key).create_and_sign_tx(
+                CreateTxOptions(
+                    msgs=[instantiate],
+                    fee=Fee(10_000_000, "10000000uluna")
+                )
+            )
+        with span("broadcast", None, "instantiate") as s:
+            result = await terra.tx.broadcast(tx)
+            describe_broadcast(s, sender, result)
+    try:
+        contract_address = get_contract_address(result)
+        print(chalk.green(
+            f"[+] Contract ID {contract_id} is instantiated at: {contract_address}"))
+    except ValueError as e:
+        print(chalk.red(f"[!] Error instantiating contract ID {contract_id}"))
+        print(result)
+        raise e
+    return contract_address
+
+
+async def async_execute_contract(terra: AsyncLCDClient, sender: Wallet, contract_address: str, execute_msg: dict, init_coins: Coins = None) -> str:
+    """Execute a message"""
+    execute = execute_message(sender.key.acc_address, contract_address, execute_msg, init_coins)
+    try:
+        async with limit(terra):
+            with span("sign", contract_address, execute_msg):
+                tx = await terra.wallet(sender.key).create_and_sign_tx(
+                    CreateTxOptions(
+                        msgs=[execute])
+                )
+            with span("broadcast", contract_address, execute_msg) as s:
+                result = await terra.tx.broadcast(tx)
+                describe_broadcast(s, sender, result)
+        print(chalk.green(f"[+] Success executing {execute_msg}"))
+        return result
+    except Exception as e:
+        print(chalk.red(f"[!] Error executing {execute_msg}"))
+        raise e
+
+
+async def async_send(terra: AsyncLCDClient, sender: Wallet, to_address: str, amount=None) -> str:
+    """Send coins"""
+    send_msg = MsgSend(from_address=sender.key.acc_address,
+                       to_address=to_address, amount=amount)
+    async with limit(terra):
+        with span("sign", None, "send"):
+            tx = await terra.wallet(sender.key).create_and_sign_tx(
+                CreateTxOptions(
+                    msgs=[send_msg],
+                    gas_adjustment="1.5"
+                )
+            )
+        with span("broadcast", None, "send") as s:
+            result = await terra.tx.broadcast(tx)
+            describe_broadcast(s, sender, result)
+    return result
+
+#============================ Contract Wrapper ============================#
+
+
+class AsyncContract:
+    """
+    I'm the asyncio twin of `Contract`.
+    After instantiation, I receive an address `self.address`
+    Without a `terra` client, I use the one of the running loop.
+    """
+
+    def __init__(self, name: str = "contract", address: str = None, terra: AsyncLCDClient = None) -> None:
+        self.name = name
+        self.address = address
+        self.terra = terra
+
+    def _terra(self) -> AsyncLCDClient:
+        return self.terra or get_async_terra()
+
+    async def query(self, query_msg):
+        """
+        Query a message on the contract.
+        Nees to be instantiated first.
+        """
+        if self.address:
+            terra = self._terra()
+            async with limit(terra):
+                with span("query", self.address, query_msg):
+                    query_res = await terra.wasm.contract_query(self.address, to_msg(query_msg))
+            return query_res
+        else:
+            raise Exception("Not instantiated yet")
+
+    async def execute(self, sender: Wallet, execute_msg):
+        """
+        Execute a message on the contract
+        Nees to be instantiated first.
+        """
+        if self.address:
+            execute_result = await async_execute_contract(
+                self._terra(), sender, self.address, execute_msg)
+            return execute_result
+        else:
+            raise Exception("Not instantiated yet")
+
+    async def instantiate(self, sender: Wallet, contract_id: str, init_msg):
+        """
+        Instantiates the contract, providing a new address
+        """
+        if self.address:
+            raise Exception("Already instantiated")
+        else:
+            self.address = await async_instantiate_contract(
+                self._terra(), sender, contract_id, init_msg)
+            return self.address
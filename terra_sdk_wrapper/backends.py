@@ -0,0 +1,377 @@
+"""
+Backends are what `Contract` and the tx helpers talk to, instead of an LCD client:
+- Backend: the interface
+- MockBackend: in memory chain answering from python handlers, no node needed
+- MockContract: base class of the handlers
+
+    class Counter(MockContract):
+        def instantiate(self, env, msg):
+            self.count = msg["count"]
+        def execute_increment(self, env):
+            self.count += 1
+        def query_count(self, env):
+            return {"count": self.count}
+
+    mock = MockBackend()
+    mock.register_code("counter", Counter)
+    configure(client=mock)  # `terra` is now the mock
+
+    code_id = store_contract(terra, terra.wallets['test1'], "artifacts/counter.wasm")
+    counter = Contract()
+    counter.instantiate(terra.wallets['test1'], code_id, {"count": 0})
+    counter.execute(terra.wallets['test1'], {"increment": {}})
+    counter.query({"count": {}})  # {'count': 1}
+"""
+
+from abc import ABC, abstractmethod
+import copy
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Tuple
+
+#============================ Interface ============================#
+
+
+class Backend(ABC):
+    """
+    What the wrapper needs from a chain.
+    Pass a backend wherever a `terra` client is expected, or `configure(client=backend)`.
+    `height` is the last block, `QueryCache` keys its entries with it.
+    Transactions of several messages (`TxBatch`) need an LCD client.
+    """
+    height: int = 0
+
+    @abstractmethod
+    def store_code(self, sender, wasm_path: str) -> int:
+        ...
+
+    @abstractmethod
+    def instantiate(self, sender, code_id: int, init_msg: dict, coins=None) -> str:
+        ...
+
+    @abstractmethod
+    def execute(self, sender, contract_address: str, execute_msg: dict, coins=None):
+        ...
+
+    @abstractmethod
+    def query(self, contract_address: str, query_msg: dict):
+        ...
+
+    @abstractmethod
+    def send(self, sender, to_address: str, amount=None):
+        ...
+
+
+def is_backend(terra) -> bool:
+    return isinstance(terra, Backend)
+
+#============================ Mock chain objects ============================#
+
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+
+def bech32_polymod(values: List[int]) -> int:
+    generator = (0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3)
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for i in range(5):
+            checksum ^= generator[i] if (top >> i) & 1 else 0
+    return checksum
+
+
+def bech32_expand(prefix: str) -> List[int]:
+    return [ord(c) >> 5 for c in prefix] + [0] + [ord(c) & 31 for c in prefix]
+
+
+def convert_bits(data, from_bits: int, to_bits: int, pad: bool) -> List[int]:
+    accumulator, bits, res = 0, 0, []
+    for value in data:
+        accumulator = (accumulator << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            res.append((accumulator >> bits) & ((1 << to_bits) - 1))
+    if pad and bits:
+        res.append((accumulator << (to_bits - bits)) & ((1 << to_bits) - 1))
+    elif not pad and (bits >= from_bits or (accumulator << (to_bits - bits)) & ((1 << to_bits) - 1)):
+        raise Exception("Invalid padding")
+    return res
+
+
+def bech32_encode(prefix: str, data: bytes) -> str:
+    """Address of the raw (canonical) bytes `data`"""
+    words = convert_bits(data, 8, 5, True)
+    polymod = bech32_polymod(bech32_expand(prefix) + words + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return f"{prefix}1" + "".join(BECH32_CHARSET[w] for w in words + checksum)
+
+
+def bech32_decode(address: str) -> Tuple[str, bytes]:
+    """(prefix, raw bytes) of a lowercase address, raises if it isn't bech32"""
+    prefix, separator, body = address.rpartition("1")
+    if not separator or not prefix or len(body) < 6 or address != address.lower():
+        raise Exception(f"Invalid address {address!r}: not bech32")
+    if any(c not in BECH32_CHARSET for c in body):
+        raise Exception(f"Invalid address {address!r}: not bech32")
+    words = [BECH32_CHARSET.index(c) for c in body]
+    if bech32_polymod(bech32_expand(prefix) + words) != 1:
+        raise Exception(f"Invalid address {address!r}: wrong checksum")
+    return prefix, bytes(convert_bits(words[:-6], 5, 8, False))
+
+
+def mock_address(seed: str, prefix: str = "terra") -> str:
+    """Deterministic bech32 address of 20 bytes"""
+    return bech32_encode(prefix, hashlib.sha512(seed.encode()).digest()[:20])
+
+
+class MockKey():
+    def __init__(self, acc_address: str) -> None:
+        self.acc_address = acc_address
+
+
+class MockWallet():
+    """Only the key address is used by the wrapper"""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.key = MockKey(mock_address(f"wallet:{name}"))
+
+
+class MockTxLog():
+    def __init__(self, msg_index: int, events_by_type: dict) -> None:
+        self.msg_index = msg_index
+        self.events_by_type = events_by_type
+
+
+class MockTxResult():
+    """Looks like a block mode broadcast result"""
+
+    def __init__(self, height: int, txhash: str, code: int = 0, raw_log: str = "", logs: List = None) -> None:
+        self.height = height
+        self.txhash = txhash
+        self.code = code
+        self.raw_log = raw_log
+        self.logs = logs or []
+        self.gas_wanted = 0
+        self.gas_used = 0
+
+    def is_tx_error(self) -> bool:
+        return bool(self.code)
+
+    def __repr__(self) -> str:
+        return f"MockTxResult(height={self.height}, code={self.code}, raw_log={self.raw_log!r})"
+
+
+class MockEnv():
+    """What a handler knows about the call: sender, contract, funds and the chain"""
+
+    def __init__(self, backend, sender: str, contract: str, funds=None) -> None:
+        self.backend = backend
+        self.sender = sender
+        self.contract = contract
+        self.funds = funds
+        self.height = backend.height
+        self.events: Dict[str, Dict[str, List[str]]] = {}
+
+    def add_attribute(self, key: str, value) -> None:
+        """Shows up in the tx logs under the `wasm` event, like a contract attribute"""
+        self.events.setdefault("wasm", {}).setdefault(key, []).append(str(value))
+
+    def query(self, contract_address: str, query_msg: dict):
+        """Query another mocked contract"""
+        return self.backend.query(contract_address, query_msg)
+
+
+class MockContract():
+    """
+    I dispatch messages to methods: `{'transfer': {'amount': .., 'recipient': ..}}`
+    calls `self.execute_transfer(env, amount=.., recipient=..)`, queries call `query_<variant>`.
+    Override `instantiate(env, msg)` to initialize the state.
+    """
+
+    def instantiate(self, env: MockEnv, msg: dict):
+        pass
+
+    def dispatch(self, prefix: str, env: MockEnv, msg: dict):
+        if not isinstance(msg, dict) or len(msg) != 1:
+            raise Exception(f"Unknown {prefix} message: {msg}")
+        variant, params = next(iter(msg.items()))
+        handler = getattr(self, f"{prefix}_{variant}", None)
+        if handler is None:
+            raise Exception(f"Unknown {prefix} message: {variant}")
+        return handler(env, **(params or {}))
+
+    def execute(self, env: MockEnv, msg: dict):
+        return self.dispatch("execute", env, msg)
+
+    def query(self, env: MockEnv, msg: dict):
+        return self.dispatch("query", env, msg)
+
+#============================ Mock backend ============================#
+
+
+def parse_coins(amount) -> Dict[str, int]:
+    """`"1000uluna,5uusd"`, terra_sdk Coins or a dict, to {denom: amount}"""
+    if amount is None:
+        return {}
+    if isinstance(amount, dict):
+        return {k: int(v) for k, v in amount.items()}
+    if hasattr(amount, "to_list"):
+        return {c.denom: int(c.amount) for c in amount.to_list()}
+    return {denom: int(value) for value, denom in re.findall(r"(\d+)([a-zA-Z/]+)", str(amount))}
+
+
+class MockBackend(Backend):
+    """
+    I'm a chain living in memory:
+    - code ids are given in order, addresses are derived from (code id, instance number)
+    - every execute is its own block, failed executes don't change the state (`rollback`)
+    - every message is recorded in `self.messages`
+    Handlers are registered per wasm name with `register_code`.
+    """
+
+    def __init__(self, rollback: bool = True, wallet_count: int = 10) -> None:
+        self.rollback = rollback
+        self.height = 1
+        self.factories: Dict[str, Callable] = {}
+        self.codes: Dict[int, Callable] = {}
+        self.contracts: Dict[str, MockContract] = {}
+        self.contract_codes: Dict[str, int] = {}
+        self.balances: Dict[str, Dict[str, int]] = {}
+        self.messages: List[dict] = []
+        self.wallets = {f"test{i}": MockWallet(f"test{i}") for i in range(1, wallet_count + 1)}
+        self.lock = threading.RLock()
+
+    def register_code(self, name: str, factory: Callable) -> None:
+        """`name` is the wasm file name, without directory nor `.wasm`"""
+        self.factories[name] = factory
+
+    def _record(self, kind: str, sender, **data) -> None:
+        sender_address = sender.key.acc_address if hasattr(sender, "key") else sender
+        self.messages.append(dict(kind=kind, sender=sender_address, height=self.height, **data))
+
+    def _next_block(self) -> int:
+        self.height += 1
+        return self.height
+
+    def _txhash(self) -> str:
+        return hashlib.sha256(f"tx:{len(self.messages)}".encode()).hexdigest().upper()
+
+    def store_code(self, sender, wasm_path: str) -> int:
+        name = os.path.basename(wasm_path)
+        if name.endswith(".wasm"):
+            name = name[:-len(".wasm")]
+        if name not in self.factories:
+            raise Exception(f"No mock handler registered for {name}")
+        with self.lock:
+            code_id = len(self.codes) + 1
+            self.codes[code_id] = self.factories[name]
+            self._record("store_code", sender, code_id=code_id, wasm_path=wasm_path)
+            self._next_block()
+        return code_id
+
+    def instantiate(self, sender, code_id: int, init_msg: dict, coins=None) -> str:
+        code_id = int(code_id)
+        if code_id not in self.codes:
+            raise Exception(f"Unknown code id {code_id}")
+        with self.lock:
+            address = mock_address(f"contract:{code_id}:{len(self.contracts)}")
+            handler = self.codes[code_id]()
+            env = MockEnv(self, sender.key.acc_address, address, parse_coins(coins))
+            handler.instantiate(env, init_msg)
+            self.contracts[address] = handler
+            self.contract_codes[address] = code_id
+            self._record("instantiate", sender, code_id=code_id, contract=address, msg=init_msg)
+            self._next_block()
+        return address
+
+    def execute(self, sender, contract_address: str, execute_msg: dict, coins=None) -> MockTxResult:
+        if contract_address not in self.contracts:
+            raise Exception(f"Unknown contract {contract_address}")
+        with self.lock:
+            handler = self.contracts[contract_address]
+            backup = copy.deepcopy(handler.__dict__) if self.rollback else None
+            env = MockEnv(self, sender.key.acc_address, contract_address, parse_coins(coins))
+            self._record("execute", sender, contract=contract_address, msg=execute_msg)
+            txhash = self._txhash()
+            height = self._next_block()
+            try:
+                handler.execute(env, execute_msg)
+            except Exception as e:
+                if backup is not None:
+                    handler.__dict__ = backup
+                return MockTxResult(height, txhash, 1, f"failed to execute message; message index: 0: {e}")
+            env.events.setdefault("execute_contract", {})["contract_address"] = [contract_address]
+            return MockTxResult(height, txhash, logs=[MockTxLog(0, env.events)])
+
+    def query(self, contract_address: str, query_msg: dict):
+        if contract_address not in self.contracts:
+            raise Exception(f"Unknown contract {contract_address}")
+        # Not in the middle of another thread's execute
+        with self.lock:
+            handler = self.contracts[contract_address]
+            env = MockEnv(self, None, contract_address)
+            # Answer a copy, the caller must not touch the state
+            return json.loads(json.dumps(handler.query(env, query_msg)))
+
+    def send(self, sender, to_address: str, amount=None) -> MockTxResult:
+        coins = parse_coins(amount)
+        with self.lock:
+            from_balance = self.balances.setdefault(sender.key.acc_address, {})
+            to_balance = self.balances.setdefault(to_address, {})
+            for denom, value in coins.items():
+                from_balance[denom] = from_balance.get(denom, 0) - value
+                to_balance[denom] = to_balance.get(denom, 0) + value
+            self._record("send", sender, to_address=to_address, amount=coins)
+            return MockTxResult(self._next_block(), self._txhash())
+
+
+def test_mock_backend():
+    class Counter(MockContract):
+        def instantiate(self, env, msg):
+            self.count = msg["count"]
+            self.owner = env.sender
+
+        def execute_increment(self, env, by: int = 1):
+            if env.sender != self.owner:
+                raise Exception("Unauthorized")
+            self.count += by
+
+        def query_count(self, env):
+            return {"count": self.count}
+
+    mock = MockBackend()
+    mock.register_code("counter", Counter)
+    owner, other = mock.wallets["test1"], mock.wallets["test2"]
+    code_id = mock.store_code(owner, "../artifacts/counter.wasm")
+    address = mock.instantiate(owner, code_id, {"count": 0})
+    assert(address.startswith("terra1"))
+
+    for _ in range(1000):
+        assert(not mock.execute(owner, address, {"increment": {"by": 2}}).code)
+    result = mock.execute(other, address, {"increment": {}})
+    assert(result.code == 1 and "Unauthorized" in result.raw_log)
+    assert(mock.query(address, {"count": {}}) == {"count": 2000})
+    assert(len(mock.messages) == 1003)
+
+    try:
+        Backend()
+        assert(False)
+    except TypeError:
+        pass
+
+    # Same history, same addresses
+    mock2 = MockBackend()
+    mock2.register_code("counter", Counter)
+    assert(mock2.instantiate(owner, mock2.store_code(owner, "counter"), {"count": 0}) == address)
+
+    print("[+] Test mock backend passed")
+
+
+if __name__ == "__main__":
+    test_mock_backend()
@@ -0,0 +1,234 @@
+"""
+Batch several messages into as few transactions as possible:
+- TxBatch: context manager accumulating execute / send / instantiate messages
+- BatchResult: what happened to each message once flushed
+
+    with TxBatch(terra, deployer) as batch:
+        for wallet in wallets:
+            batch.execute(token_contract, Cw20.execute_mint("1000", wallet.key.acc_address))
+    print(batch.results)
+"""
+
+#============================ Imports ============================#
+
+from typing import List
+from terra_sdk.client.localterra import LCDClient
+from terra_sdk.client.localterra import Wallet
+from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.core.bank import MsgSend
+from terra_sdk.core.coins import Coins
+from terra_sdk.util.contract import get_contract_address
+from .messages import execute_message, instantiate_message
+from .instrument import span, enabled, msg_variant, describe_broadcast
+from .backends import is_backend
+import chalk
+
+#============================ Batch results ============================#
+
+# A LocalTerra block accepts a bit more, keep some room for the adjustment
+DEFAULT_MAX_GAS = 6_000_000
+DEFAULT_MAX_MSGS = 100
+
+
+class BatchResult():
+    """
+    I'm the outcome of one message of the batch.
+    `index` is the position of the message in the batch, `tx_result` the broadcast
+    result of the transaction that carried it, and `log` its own entry in the tx logs.
+    """
+    index: int
+    msg = None
+    tx_result = None
+    log = None
+    error = None
+    contract = None  # Contract to bind on instantiation
+    variant = None  # Label of the message in the measures (see `instrument`)
+
+    def __init__(self, index: int, msg, contract=None, variant=None) -> None:
+        self.index = index
+        self.msg = msg
+        self.contract = contract
+        self.variant = variant
+
+    @property
+    def success(self) -> bool:
+        return self.tx_result is not None and self.error is None
+
+    @property
+    def txhash(self) -> str:
+        if self.tx_result is None:
+            return None
+        return self.tx_result.txhash
+
+    def __repr__(self) -> str:
+        status = "ok" if self.success else f"error: {self.error}"
+        return f"BatchResult({self.index}, {type(self.msg).__name__}, {status})"
+
+
+#============================ Transaction builder ============================#
+
+
+class TxBatch():
+    """
+    I accumulate messages signed by the same `sender` and flush them into as few
+    transactions as the gas limit allows.
+    Each transaction is simulated once; when the estimate exceeds `max_gas`, or when
+    the simulation or the delivery fails, the messages are split in two halves and
+    retried, so a bad message ends up alone in its own failed result.
+    A failed transaction applies none of its messages, retrying them is safe.
+    Backends (see `backends`) have no multi message txs, I refuse them.
+    """
+
+    def __init__(self, terra: LCDClient, sender: Wallet, max_gas: int = DEFAULT_MAX_GAS,
+                 max_msgs: int = DEFAULT_MAX_MSGS, gas_adjustment: float = 1.5) -> None:
+        if is_backend(terra):
+            raise Exception("TxBatch needs an LCD client, execute the messages one by one on a backend")
+        self.terra = terra
+        self.sender = sender
+        self.max_gas = max_gas
+        self.max_msgs = max_msgs
+        self.gas_adjustment = gas_adjustment
+        self.pending: List[BatchResult] = []
+        self.results: List[BatchResult] = []
+        self.tx_count = 0
+        self.caches = []  # QueryCaches of the executed Contracts, invalidated on flush
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Don't broadcast half a batch if the caller crashed
+        if exc_type is None:
+            self.flush()
+        return False
+
+    def add(self, msg, contract=None, variant=None) -> BatchResult:
+        """Queue any terra_sdk message, returns its (pending) result"""
+        result = BatchResult(len(self.results) + len(self.pending), msg, contract, variant)
+        self.pending.append(result)
+        return result
+
+    def execute(self, contract, execute_msg: dict, coins: Coins = None) -> BatchResult:
+        """Queue an execute message, `contract` is a Contract or an address"""
+        contract_address = getattr(contract, "address", contract)
+        if not contract_address:
+            raise Exception("Not instantiated yet")
+        cache = getattr(contract, "cache", None)
+        if cache is not None and all(cache is not c for c in self.caches):
+            self.caches.append(cache)
+        execute = execute_message(self.sender.key.acc_address, contract_address, execute_msg, coins)
+        return self.add(execute, variant=execute_msg)
+
+    def send(self, to_address: str, amount=None) -> BatchResult:
+        """Queue a bank send"""
+        send_msg = MsgSend(from_address=self.sender.key.acc_address,
+                           to_address=to_address, amount=amount)
+        return self.add(send_msg, variant="send")
+
+    def instantiate(self, contract_id: str, init_msg: dict, contract=None) -> BatchResult:
+        """
+        Queue an instantiation. If a Contract is given, it receives its address
+        once the batch is flushed.
+        """
+        if contract is not None and contract.address:
+            raise Exception("Already instantiated")
+        instantiate = instantiate_message(self.sender.key.acc_address, contract_id, init_msg)
+        return self.add(instantiate, contract, "instantiate")
+
+    def flush(self) -> List[BatchResult]:
+        """Broadcast every pending message, returns their results"""
+        pending = self.pending
+        self.pending = []
+        try:
+            for start in range(0, len(pending), self.max_msgs):
+                self._broadcast(pending[start:start + self.max_msgs])
+        finally:
+            # Chunks already on chain are reported and invalidated whatever happened next
+            self.results.extend(pending)
+            self._invalidate(pending)
+        return pending
+
+    def _invalidate(self, results: List[BatchResult]) -> None:
+        """Cached queries of the executed contracts are stale once broadcast"""
+        broadcast = [r for r in results if r.tx_result is not None]
+        addresses = {getattr(r.msg, "contract", None) for r in broadcast} - {None}
+        for cache in self.caches:
+            for address in addresses:
+                cache.invalidate(address)
+            for r in broadcast:
+                cache.observe_height(getattr(r.tx_result, "height", None))
+
+    def _labels(self, chunk: List[BatchResult]):
+        """Contract and variant of a chunk's measures, shared by its messages or a mix"""
+        contracts = {getattr(r.msg, "contract", None) for r in chunk}
+        variants = {msg_variant(r.variant if r.variant is not None else type(r.msg).__name__) for r in chunk}
+        return (contracts.pop() if len(contracts) == 1 else None,
+                variants.pop() if len(variants) == 1 else "batch")
+
+    def _sign(self, chunk: List[BatchResult], contract: str = None, variant: str = None):
+        # Simulation gives us the gas estimate and the signed tx in one go
+        with span("simulate", contract, variant) as s:
+            if s:
+                s.set(sender=self.sender.key.acc_address, msgs=len(chunk))
+            return self.sender.create_and_sign_tx(
+                CreateTxOptions(
+                    msgs=[r.msg for r in chunk],
+                    gas_adjustment=self.gas_adjustment
+                )
+            )
+
+    def _split(self, chunk: List[BatchResult]) -> None:
+        middle = len(chunk) // 2
+        self._broadcast(chunk[:middle])
+        self._broadcast(chunk[middle:])
+
+    def _broadcast(self, chunk: List[BatchResult]) -> None:
+        if not chunk:
+            return
+        contract, variant = self._labels(chunk) if enabled() else (None, None)
+        try:
+            tx = self._sign(chunk, contract, variant)
+        except Exception as e:
+            if len(chunk) > 1:
+                return self._split(chunk)
+            chunk[0].error = e
+            print(chalk.red(f"[!] Error simulating {chunk[0].msg}"))
+            print(e)
+            return
+
+        if tx.auth_info.fee.gas_limit > self.max_gas and len(chunk) > 1:
+            return self._split(chunk)
+
+        try:
+            with span("broadcast", contract, variant) as s:
+                if s:
+                    s.set(msgs=len(chunk))
+                result = self.terra.tx.broadcast(tx)
+                describe_broadcast(s, self.sender, result)
+        except Exception as e:
+            # LCD down, timeout: this chunk failed, the next ones still get their chance
+            for r in chunk:
+                r.error = e
+            print(chalk.red(f"[!] Error broadcasting {len(chunk)} messages"))
+            print(e)
+            return
+        self.tx_count += 1
+        if result.code and len(chunk) > 1:
+            print(chalk.yellow(f"[~] {len(chunk)} messages failed together, splitting them"))
+            return self._split(chunk)
+        for i, r in enumerate(chunk):
+            r.tx_result = result
+            if result.code:
+                r.error = result.raw_log
+                continue
+            # Logs are indexed like the messages of the transaction
+            if result.logs and i < len(result.logs):
+                r.log = result.logs[i]
+            if r.contract is not None:
+                r.contract.address = get_contract_address(result, i)
+
+        if result.code:
+            print(chalk.red(f"[!] Error broadcasting {len(chunk)} messages"))
+            print(result.raw_log)
+        else:
+            print(chalk.green(f"[+] Success broadcasting {len(chunk)} messages in {result.txhash}"))
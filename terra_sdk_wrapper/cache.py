@@ -0,0 +1,129 @@
+"""
+Opt-in cache for contract queries:
+- QueryCache: LRU of query results, keyed by (contract address, query msg, block height)
+
+    cache = QueryCache(terra)
+    token = Contract("token", cache=cache)
+    token.query(Cw20.query_balance(bob.key.acc_address))  # LCD
+    token.query(Cw20.query_balance(bob.key.acc_address))  # cache, same block
+    print(cache.stats())
+"""
+
+#============================ Imports ============================#
+
+from collections import OrderedDict
+from typing import Dict, Tuple
+import copy
+import threading
+import time
+import json
+from terra_sdk.client.localterra import LCDClient
+from .backends import is_backend
+
+#============================ Query cache ============================#
+
+
+def canonical_json(msg) -> str:
+    """Same message, same string, whatever the order of the keys"""
+    return json.dumps(msg, sort_keys=True, separators=(",", ":"))
+
+
+class QueryCache():
+    """
+    I remember query results until a new block is observed.
+    The block height is asked to the LCD at most once per `height_refresh` seconds,
+    so a burst of queries costs one height request. Broadcast results also
+    tell me about new blocks through `observe_height`.
+    Results of a contract are dropped as soon as a tx is executed against it.
+    A query answered after its contract was invalidated is returned but not kept,
+    its result may predate the tx. Callers get copies, mutating one is harmless.
+    `terra` may be a `Backend`, its own height is used then.
+    """
+
+    def __init__(self, terra: LCDClient, maxsize: int = 1024, height_refresh: float = 1.0) -> None:
+        self.terra = terra
+        self.maxsize = maxsize
+        self.height_refresh = height_refresh
+        self.entries = OrderedDict()
+        self.height: int = None
+        self.height_checked_at: float = 0
+        # Bumped on every invalidation, an answer read before it is not stored
+        self.generation = 0
+        self.generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def current_height(self) -> int:
+        """Latest known block height, refreshed from the LCD when too old"""
+        if is_backend(self.terra):
+            self.observe_height(self.terra.height)
+            return self.height
+        now = time.monotonic()
+        if self.height is None or now - self.height_checked_at >= self.height_refresh:
+            block = self.terra.tendermint.block_info()
+            self.observe_height(int(block["block"]["header"]["height"]))
+            self.height_checked_at = now
+        return self.height
+
+    def observe_height(self, height) -> None:
+        """Everything cached before block `height` is stale"""
+        if height is None:
+            return
+        height = int(height)
+        with self.lock:
+            if self.height is None or height > self.height:
+                self.height = height
+                self.generation += 1
+                self.entries.clear()
+
+    def invalidate(self, contract_address: str) -> None:
+        """Forget every result of `contract_address`"""
+        with self.lock:
+            self.generations[contract_address] = self.generations.get(contract_address, 0) + 1
+            for key in [k for k in self.entries if k[0] == contract_address]:
+                del self.entries[key]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def _key(self, contract_address: str, query_msg) -> Tuple[str, str, int]:
+        return (contract_address, canonical_json(query_msg), self.current_height())
+
+    def query(self, contract_address: str, query_msg):
+        """Query through the cache"""
+        key = self._key(contract_address, query_msg)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(self.entries[key])
+            self.misses += 1
+            generation = (self.generation, self.generations.get(contract_address, 0))
+
+        if is_backend(self.terra):
+            result = self.terra.query(contract_address, query_msg)
+        else:
+            result = self.terra.wasm.contract_query(contract_address, query_msg)
+
+        with self.lock:
+            # A new block or a tx may have been seen meanwhile
+            if generation == (self.generation, self.generations.get(contract_address, 0)):
+                self.entries[key] = copy.deepcopy(result)
+                if len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return result
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.entries),
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,89 @@
+"""
+The Terra client, created on first use instead of at import time:
+- configure: endpoint, chain id, or a ready made client (eg. a mock in tests)
+- get_terra: the client, LocalTerra() by default
+
+The endpoint can also come from the TERRA_LCD_URL and TERRA_CHAIN_ID environment variables.
+Several endpoints (a list, or comma separated) make an `LCDPool`.
+"""
+
+import os
+import threading
+
+_config = {"url": None, "chain_id": None, "client": None}
+_terra = None
+_lock = threading.Lock()
+
+
+def configure(url=None, chain_id: str = None, client=None) -> None:
+    """
+    Choose the client used by `Contract` and `terra`.
+    Takes effect on next use, the previous client is dropped.
+    """
+    global _terra
+    with _lock:
+        _config["url"] = url
+        _config["chain_id"] = chain_id
+        _config["client"] = client
+        _terra = None
+
+
+def endpoint():
+    """
+    The configured (urls, chain id), else from the environment.
+    Urls are None for LocalTerra, the chain id None when not given.
+    """
+    url = _config["url"] or os.environ.get("TERRA_LCD_URL")
+    chain_id = _config["chain_id"] or os.environ.get("TERRA_CHAIN_ID")
+    if url is None:
+        return None, chain_id
+    urls = url.split(",") if isinstance(url, str) else list(url)
+    return [u.strip() for u in urls], chain_id
+
+
+def create_terra():
+    if _config["client"] is not None:
+        return _config["client"]
+    urls, chain_id = endpoint()
+    # terra_sdk is only imported once a client is needed
+    if urls is None:
+        from terra_sdk.client.localterra import LocalTerra
+        return LocalTerra()
+    if len(urls) > 1:
+        from .lcdpool import LCDPool
+        return LCDPool(urls).client(chain_id or "localterra")
+    from terra_sdk.client.lcd import LCDClient
+    return LCDClient(urls[0], chain_id or "localterra")
+
+
+def get_terra():
+    """Returns the configured client, created on first use"""
+    global _terra
+    if _terra is None:
+        with _lock:
+            if _terra is None:
+                _terra = create_terra()
+    return _terra
+
+
+def test_import_budget(budget_ms: float = 150):
+    """
+    Importing the package and encoding a message must not load terra_sdk nor need a node
+    """
+    import subprocess
+    import sys
+    code = ("import sys, time; start = time.perf_counter(); "
+            "import terra_sdk_wrapper; terra_sdk_wrapper.to_binary({'a': 1}); "
+            "print((time.perf_counter() - start) * 1000, 'terra_sdk' in sys.modules, 'chalk' in sys.modules)")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", code], cwd=root,
+                            capture_output=True, text=True, check=True).stdout.split()
+    elapsed, sdk_loaded, chalk_loaded = float(output[0]), output[1] == "True", output[2] == "True"
+    assert(not sdk_loaded and not chalk_loaded)
+    assert(elapsed < budget_ms), f"import took {elapsed:.1f}ms, budget is {budget_ms}ms"
+
+    print(f"[+] Test import budget passed ({elapsed:.1f}ms)")
+
+
+if __name__ == "__main__":
+    test_import_budget()
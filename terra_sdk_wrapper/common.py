@@ -1,10 +1,13 @@
 """
-This loads LocalTerra(), define a few utilities:
+This gets the Terra client on first use (see `client.configure`), define a few utilities:
 - execute
 - send
 - store_contract
 - instantiate
 - to_binary
+- to_msg
+
+Every sign, simulate, broadcast and query is measured when an `instrument` sink is added.
 
 It also provides a Contract interface to handle all messages for you:
 - instantiate
@@ -19,39 +22,86 @@ from terra_sdk.client.localterra import Wallet
 from terra_sdk.util.contract import read_file_as_b64, get_code_id
 from terra_sdk.core.wasm import MsgStoreCode
 from terra_sdk.core.fee import Fee
-from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.client.lcd.api.tx import CreateTxOptions, SignerOptions
 from terra_sdk.core.wasm import MsgInstantiateContract
 from terra_sdk.util.contract import get_contract_address
 from terra_sdk.core.wasm import MsgExecuteContract
 from terra_sdk.core.coins import Coins
 from terra_sdk.core.bank import MsgSend
 from terra_sdk.core.coins import Coins
-import base64
-import json
+from .client import get_terra, configure
+from .encoding import to_binary, to_msg
+from .messages import execute_message, instantiate_message
+from .backends import is_backend
+from .instrument import span, enabled, msg_variant, describe_broadcast
 import chalk
 
 #============================ Get Terra and accounts ============================#
 
-terra = LocalTerra()
+
+def __getattr__(name):
+    # `terra` is created on first access, not at import
+    if name == "terra":
+        return get_terra()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 #============================ SDK wrappers ============================#
 
 
-def store_contract(terra: LCDClient, sender: Wallet, wasm_path: str) -> str:
-    """Uploads contract, returns code ID"""
+def sign_and_broadcast(terra: LCDClient, sender: Wallet, msgs: list, fee: Fee = None, gas_adjustment=None,
+                       fees=None, contract: str = None, variant=None):
+    """
+    Signs and broadcasts `msgs`, simulated unless a `fee` is given.
+    Each phase is measured (see `instrument`), labelled with `contract` and `variant`.
+    The account and the fee are fetched here rather than inside `create_and_sign_tx`,
+    sinks or not, so what is measured is what runs without them.
+    """
+    if fees is not None:
+        # The strategy signs, simulates when it must, and broadcasts
+        with span("broadcast", contract, variant) as s:
+            result = fees.broadcast(sender, msgs)
+            describe_broadcast(s, sender, result)
+        return result
+    options = CreateTxOptions(msgs=msgs, fee=fee, gas_adjustment=gas_adjustment)
+    if fee is None:
+        # Simulate apart from the signature, to time each of them
+        with span("simulate", contract, variant) as s:
+            if s:
+                s.set(sender=sender.key.acc_address)
+            info = sender.account_number_and_sequence()
+            options.account_number = int(info["account_number"])
+            options.sequence = int(info["sequence"])
+            options.fee = terra.tx.estimate_fee(
+                [SignerOptions(address=sender.key.acc_address,
+                               sequence=options.sequence, public_key=sender.key.public_key)],
+                options
+            )
+            if s:
+                s.set(gas_wanted=options.fee.gas_limit)
+    with span("sign", contract, variant):
+        tx = sender.create_and_sign_tx(options)
+    # Serialized for the measure only, outside of the timed broadcast
+    size = len(bytes(tx.to_proto())) if enabled() else None
+    with span("broadcast", contract, variant) as s:
+        if s:
+            s.set(bytes=size)
+        result = terra.tx.broadcast(tx)
+        describe_broadcast(s, sender, result)
+    return result
+
+
+def store_contract(terra: LCDClient, sender: Wallet, wasm_path: str, fees=None) -> str:
+    """Uploads contract, returns code ID. With a `FeeStrategy`, the fee is learned"""
+    if is_backend(terra):
+        return terra.store_code(sender, wasm_path)
     contract_bytes = read_file_as_b64(wasm_path)
     # Don't forget `.key.acc_address``
     store_code = MsgStoreCode(
         sender=sender.key.acc_address, 
         wasm_byte_code=contract_bytes
     )
-    tx = sender.create_and_sign_tx(
-        CreateTxOptions(
-            msgs=[store_code],
-            fee=Fee(10_000_000, "10000000uluna")
-        )
-    )
-    result = terra.tx.broadcast(tx)
+    result = sign_and_broadcast(terra, sender, [store_code], fee=Fee(10_000_000, "10000000uluna"),
+                                fees=fees, variant="store_code")
     try:
         code_id = get_code_id(result)
         print(chalk.green(f"[+] Code ID of {wasm_path}: {code_id}"))
@@ -62,18 +112,13 @@ def store_contract(terra: LCDClient, sender: Wallet, wasm_path: str) -> str:
     return code_id
 
 
-def instantiate_contract(terra: LCDClient, sender: Wallet, contract_id: str, init_msg: dict) -> str:
-    """Instantiate contract, returns the contract address"""
-    # Admin must be deployer or tx returns Unauthorized
-    instantiate = MsgInstantiateContract(
-        sender=sender.key.acc_address, admin=sender.key.acc_address, code_id=contract_id, init_msg=init_msg)
-    tx = sender.create_and_sign_tx(
-        CreateTxOptions(
-            msgs=[instantiate],
-            fee=Fee(10_000_000, "10000000uluna")
-        )
-    )
-    result = terra.tx.broadcast(tx)
+def instantiate_contract(terra: LCDClient, sender: Wallet, contract_id: str, init_msg: dict, fees=None) -> str:
+    """Instantiate contract, returns the contract address. With a `FeeStrategy`, the fee is learned"""
+    if is_backend(terra):
+        return terra.instantiate(sender, contract_id, to_msg(init_msg))
+    instantiate = instantiate_message(sender.key.acc_address, contract_id, init_msg)
+    result = sign_and_broadcast(terra, sender, [instantiate], fee=Fee(10_000_000, "10000000uluna"),
+                                fees=fees, variant="instantiate")
     try:
         contract_address = get_contract_address(result)
         print(chalk.green(
@@ -85,44 +130,47 @@ def instantiate_contract(terra: LCDClient, sender: Wallet, contract_id: str, ini
     return contract_address
 
 
-def execute_contract(terra: LCDClient, sender: Wallet, contract_address: str, execute_msg: dict, init_coins: Coins = None) -> str:
-    """Execute a message"""
-    execute = MsgExecuteContract(sender=sender.key.acc_address,
-                                 contract=contract_address, execute_msg=execute_msg, coins=init_coins)
+def execute_contract(terra: LCDClient, sender: Wallet, contract_address: str, execute_msg: dict, init_coins: Coins = None, fees=None) -> str:
+    """
+    Execute a message. With a `FeeStrategy`, the simulation is skipped once the fee is learned.
+    A tx that can't be built or broadcast raises, a failed one is returned with its `code`.
+    """
+    if is_backend(terra):
+        with span("broadcast", contract_address, execute_msg) as s:
+            result = terra.execute(sender, contract_address, to_msg(execute_msg), init_coins)
+            describe_broadcast(s, sender, result)
+        return result
+    execute = execute_message(sender.key.acc_address, contract_address, execute_msg, init_coins)
     # tx = sender.create_and_sign_tx(
     #     msgs=[execute], fee=StdFee(10_000_000, "10000000uluna"))
     try:
-        tx = sender.create_and_sign_tx(
-            CreateTxOptions(
-                msgs=[execute])
-            )
-        result = terra.tx.broadcast(tx)
-        print(chalk.green(f"[+] Success executing {execute_msg}"))
-        return result
+        result = sign_and_broadcast(terra, sender, [execute], fees=fees,
+                                    contract=contract_address, variant=execute_msg)
     except Exception as e:
         print(chalk.red(f"[!] Error executing {execute_msg}"))
-        print(e)
+        raise e
+    if result.code:
+        print(chalk.red(f"[!] Error executing {execute_msg}"))
+        print(result.raw_log)
+    else:
+        print(chalk.green(f"[+] Success executing {execute_msg}"))
+    return result
 
 
-def send(terra: LCDClient, sender: Wallet, to_address: str, amount=None) -> str:
-    """Send coins"""
+def send(terra: LCDClient, sender: Wallet, to_address: str, amount=None, fees=None) -> str:
+    """Send coins. With a `FeeStrategy`, the simulation is skipped once the fee is learned"""
+    if is_backend(terra):
+        with span("broadcast", None, "send") as s:
+            result = terra.send(sender, to_address, amount)
+            describe_broadcast(s, sender, result)
+        return result
     send_msg = MsgSend(from_address=sender.key.acc_address,
                        to_address=to_address, amount=amount)
     # tx = sender.create_and_sign_tx(msgs=[send_msg], fee=StdFee(
     #     1000000, "1000000uusd"), fee_denoms=['uusd', 'uluna', 'ukrw'])
-    tx = sender.create_and_sign_tx(
-        CreateTxOptions(
-            msgs=[send_msg],
-            gas_adjustment="1.5"
-        )
-    )
-    result = terra.tx.broadcast(tx)
-    return result
+    return sign_and_broadcast(terra, sender, [send_msg], gas_adjustment="1.5", fees=fees, variant="send")
 
 
-def to_binary(o: dict):
-    return base64.b64encode(json.dumps(o).encode()).decode()
-
 #============================ Contract Wrapper ============================#
 
 
@@ -130,31 +178,69 @@ class Contract:
     """
     I'm a wrapper around every contract messages.
     After instantiation, I receive an address `self.address`
+    I talk to the configured client, which may be a `Backend` like `MockBackend`.
+    With a `QueryCache`, queries are answered from it while no new block is seen.
+    With a `FeeStrategy`, executions and instantiation use learned fees.
+    With a `ContractValidator`, messages not matching the schemas are rejected before signing.
+    With `responses`, a generated slots class (or its `responses` dict), query results
+    are decoded to its response classes.
     """
 
-    def __init__(self, name: str = "contract") -> None:
+    def __init__(self, name: str = "contract", cache=None, fees=None, validator=None, responses=None) -> None:
         self.name = name
         self.address = None
+        self.cache = cache
+        self.fees = fees
+        self.validator = validator
+        self.responses = getattr(responses, "responses", responses)
 
     def query(self, query_msg):
         """
         Query a message on the contract.
         Nees to be instantiated first.
         """
-        if self.address:
-            query_res = terra.wasm.contract_query(self.address, query_msg)
-            return query_res
+        if self.validator is not None:
+            self.validator.validate("query", to_msg(query_msg))
+        if self.address and self.cache is not None:
+            query_res = self.cache.query(self.address, to_msg(query_msg))
+        elif self.address and is_backend(get_terra()):
+            with span("query", self.address, query_msg):
+                query_res = get_terra().query(self.address, to_msg(query_msg))
+        elif self.address:
+            with span("query", self.address, query_msg):
+                query_res = get_terra().wasm.contract_query(self.address, to_msg(query_msg))
         else:
             raise Exception("Not instantiated yet")
+        if self.responses:
+            return self.decode(query_msg, query_res)
+        return query_res
+
+    def decode(self, query_msg, query_res):
+        """The result as its response class, when the query has one"""
+        response_class = self.responses.get(msg_variant(query_msg))
+        if response_class is None or not isinstance(query_res, dict):
+            return query_res
+        return response_class.decode(query_res)
 
-    def execute(self, sender: Wallet, execute_msg):
+    def execute(self, sender: Wallet, execute_msg, batch=None):
         """
         Execute a message on the contract
         Nees to be instantiated first.
+        With a `TxBatch`, the message is only queued and its pending result returned,
+        `sender` must then be the batch's sender.
         """
-        if self.address:
+        if self.validator is not None:
+            self.validator.validate("execute", to_msg(execute_msg))
+        if self.address and batch is not None:
+            if sender.key.acc_address != batch.sender.key.acc_address:
+                raise Exception(f"{sender.key.acc_address} can't execute in a batch signed by {batch.sender.key.acc_address}")
+            return batch.execute(self, execute_msg)
+        elif self.address:
             execute_result = execute_contract(
-                terra, sender, self.address, execute_msg)
+                get_terra(), sender, self.address, execute_msg, fees=self.fees)
+            if self.cache is not None:
+                self.cache.invalidate(self.address)
+                self.cache.observe_height(getattr(execute_result, "height", None))
             return execute_result
         else:
             raise Exception("Not instantiated yet")
@@ -166,6 +252,8 @@ class Contract:
         if self.address:
             raise Exception("Already instantiated")
         else:
+            if self.validator is not None:
+                self.validator.validate("instantiate", to_msg(init_msg))
             self.address = instantiate_contract(
-                terra, sender, contract_id, init_msg)
+                get_terra(), sender, contract_id, init_msg, fees=self.fees)
             return self.address
\ No newline at end of file
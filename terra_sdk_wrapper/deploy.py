@@ -0,0 +1,198 @@
+"""
+Contract code upload, deduplicated and in parallel:
+- wasm_checksum: sha256 of a wasm file, read through a memory map
+- CodeRegistry: persisted checksum -> code id, per chain
+- store_contracts: uploads what the registry doesn't know, spread over several deployers
+
+    registry = CodeRegistry("deployments/code_ids.json")
+    code_ids = store_contracts(terra, glob.glob("artifacts/*.wasm"), [deployer, alice, bob], registry)
+    # {'artifacts/terraswap_token.wasm': 12, ...}
+"""
+
+#============================ Imports ============================#
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import base64
+import binascii
+import hashlib
+import json
+import mmap
+import os
+import threading
+from terra_sdk.client.localterra import LCDClient
+from terra_sdk.client.localterra import Wallet
+from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.core.wasm import MsgStoreCode
+from terra_sdk.core.fee import Fee
+from terra_sdk.util.contract import get_code_id
+from .backends import is_backend
+import chalk
+
+#============================ Wasm files ============================#
+
+CHUNK_SIZE = 1 << 20
+STORE_GAS = 10_000_000
+
+
+def wasm_checksum(wasm_path: str) -> str:
+    """Hex sha256 of the file, hashed by chunks of the memory map"""
+    digest = hashlib.sha256()
+    with open(wasm_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        for start in range(0, len(m), CHUNK_SIZE):
+            digest.update(m[start:start + CHUNK_SIZE])
+    return digest.hexdigest()
+
+
+def wasm_b64(wasm_path: str) -> str:
+    """
+    Base64 of the file, encoded straight from the memory map.
+    `read_file_as_b64` keeps the bytes and the base64 string in memory at once.
+    """
+    with open(wasm_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        return base64.b64encode(m).decode()
+
+
+def normalize_hash(value: str) -> str:
+    """Code hashes come in hex or base64 depending on the chain"""
+    if not value:
+        return None
+    try:
+        return bytes.fromhex(value).hex()
+    except ValueError:
+        pass
+    try:
+        return base64.b64decode(value).hex()
+    except (ValueError, binascii.Error):
+        return None
+
+#============================ Code registry ============================#
+
+
+class CodeRegistry():
+    """
+    I remember which code id each wasm checksum got, per chain id,
+    in a JSON file so the next deploys reuse them. Without `path`, I'm only in memory.
+    """
+
+    def __init__(self, path: str = ".code_ids.json") -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict[str, int]] = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def get(self, chain_id: str, checksum: str) -> int:
+        return self.entries.get(chain_id, {}).get(checksum)
+
+    def set(self, chain_id: str, checksum: str, code_id: int) -> None:
+        with self.lock:
+            self.entries.setdefault(chain_id, {})[checksum] = int(code_id)
+            self.save()
+
+    def forget(self, chain_id: str, checksum: str) -> None:
+        with self.lock:
+            self.entries.get(chain_id, {}).pop(checksum, None)
+            self.save()
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+def code_exists(terra: LCDClient, code_id: int, checksum: str) -> bool:
+    """
+    The chain may have been reset since the registry was written (LocalTerra restart)
+    """
+    try:
+        info = terra.wasm.code_info(code_id)
+    except Exception:
+        return False
+    code_hash = normalize_hash(info.get("code_hash") or info.get("data_hash"))
+    return code_hash is None or code_hash == checksum
+
+#============================ Parallel upload ============================#
+
+
+def store_batch(terra: LCDClient, sender: Wallet, wasm_paths: List[str]) -> List[int]:
+    """Uploads several codes in one tx, returns their code ids in order"""
+    msgs = [MsgStoreCode(sender=sender.key.acc_address, wasm_byte_code=wasm_b64(path))
+            for path in wasm_paths]
+    gas = STORE_GAS * len(msgs)
+    tx = sender.create_and_sign_tx(
+        CreateTxOptions(
+            msgs=msgs,
+            fee=Fee(gas, f"{gas}uluna")
+        )
+    )
+    result = terra.tx.broadcast(tx)
+    try:
+        return [int(get_code_id(result, i)) for i in range(len(msgs))]
+    except (ValueError, KeyError, IndexError) as e:
+        print(chalk.red(f"[!] Error storing contracts {wasm_paths}"))
+        print(result)
+        raise e
+
+
+def store_contracts(terra: LCDClient, wasm_paths: List[str], deployers: List[Wallet],
+                    registry: CodeRegistry = None, per_tx: int = 1, verify: bool = True) -> Dict[str, int]:
+    """
+    Uploads `wasm_paths`, returns their code ids.
+    Identical bytecode is uploaded once, and not at all if the registry knows it.
+    The rest is spread round robin over `deployers`, which upload concurrently,
+    `per_tx` codes per transaction.
+    With a `Backend`, codes are always uploaded: its code ids die with it,
+    they are neither read from nor written to the registry.
+    """
+    if is_backend(terra):
+        registry, chain_id = CodeRegistry(None), "mock"
+    else:
+        registry, chain_id = registry or CodeRegistry(), terra.chain_id
+    checksums = {path: wasm_checksum(path) for path in wasm_paths}
+
+    code_ids_by_checksum: Dict[str, int] = {}
+    to_upload: Dict[str, str] = {}  # checksum -> first path with it
+    for path, checksum in checksums.items():
+        if checksum in code_ids_by_checksum or checksum in to_upload:
+            continue
+        code_id = registry.get(chain_id, checksum)
+        if code_id is not None and (not verify or code_exists(terra, code_id, checksum)):
+            code_ids_by_checksum[checksum] = code_id
+            print(chalk.green(f"[+] Code ID of {path}: {code_id} (already stored)"))
+            continue
+        if code_id is not None:
+            registry.forget(chain_id, checksum)
+        to_upload[checksum] = path
+
+    # Each deployer gets its own share, its txs stay in sequence order
+    shares: List[List[str]] = [[] for _ in deployers]
+    for i, path in enumerate(to_upload.values()):
+        shares[i % len(deployers)].append(path)
+
+    def upload(deployer: Wallet, paths: List[str]) -> None:
+        for start in range(0, len(paths), per_tx):
+            batch = paths[start:start + per_tx]
+            if is_backend(terra):
+                code_ids = [terra.store_code(deployer, path) for path in batch]
+            else:
+                code_ids = store_batch(terra, deployer, batch)
+            for path, code_id in zip(batch, code_ids):
+                registry.set(chain_id, checksums[path], code_id)
+                code_ids_by_checksum[checksums[path]] = code_id
+                print(chalk.green(f"[+] Code ID of {path}: {code_id}"))
+
+    with ThreadPoolExecutor(max_workers=len(deployers)) as executor:
+        futures = [executor.submit(upload, deployer, paths)
+                   for deployer, paths in zip(deployers, shares) if paths]
+        for future in futures:
+            future.result()
+
+    return {path: code_ids_by_checksum[checksum] for path, checksum in checksums.items()}
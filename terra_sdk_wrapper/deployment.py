@@ -0,0 +1,243 @@
+"""
+Declarative deployments: describe the contracts, get them stored and instantiated.
+- load_spec: reads a JSON deployment spec
+- Deployment: turns the spec into a graph and runs it in waves, resuming from its state file
+
+    {
+        "deployer": "test1",
+        "contracts": {
+            "token": {"code": "artifacts/terraswap_token.wasm", "init_msg": {"name": "Token", ...}},
+            "factory": {"code": "artifacts/terraswap_factory.wasm", "init_msg": {"token_code_id": {"$ref": "token.code_id"}}},
+            "pair": {"code": "artifacts/terraswap_pair.wasm", "init_msg": {"token": {"$ref": "token"}}, "deployer": "test2"}
+        }
+    }
+
+`{"$ref": "name"}` anywhere in an init msg is replaced by the address of `name`,
+`{"$ref": "name.code_id"}` by its code id; `"depends_on": [...]` adds other dependencies.
+Any other string, `"$"` prefixed or not, is sent as is.
+
+    deployment = Deployment(load_spec("deploy.json"), state_path="deployments/localterra.json")
+    deployment.run()
+    deployment.contracts["pair"].query({"pair": {}})
+"""
+
+#============================ Imports ============================#
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+import hashlib
+import json
+import os
+import threading
+from .client import get_terra
+from .common import Contract, instantiate_contract
+from .deploy import CodeRegistry, store_contracts, wasm_checksum
+from .cache import canonical_json
+import chalk
+
+#============================ Spec ============================#
+
+
+def load_spec(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+REF = "$ref"
+
+
+def is_reference(value) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and isinstance(value.get(REF), str)
+
+
+def references(value) -> List[str]:
+    """Names of the contracts referenced in an init msg"""
+    if is_reference(value):
+        return [value[REF].split(".")[0]]
+    if isinstance(value, dict):
+        return [name for v in value.values() for name in references(v)]
+    if isinstance(value, list):
+        return [name for v in value for name in references(v)]
+    return []
+
+
+def resolve(value, state: dict):
+    """Replaces references by the address or code id of the instantiated contracts"""
+    if is_reference(value):
+        name, _, field = value[REF].partition(".")
+        if name not in state["contracts"]:
+            raise Exception(f"Reference to {name} which is not deployed yet")
+        if (field or "address") not in ("address", "code_id"):
+            raise Exception(f"Unknown reference {value[REF]}, expected {name} or {name}.code_id")
+        return state["contracts"][name][field or "address"]
+    if isinstance(value, dict):
+        return {k: resolve(v, state) for k, v in value.items()}
+    if isinstance(value, list):
+        return [resolve(v, state) for v in value]
+    return value
+
+
+def node_hash(checksum: str, code_id: int, init_msg) -> str:
+    """What a contract was instantiated from, so a changed spec or wasm redeploys it"""
+    return hashlib.sha256(f"{checksum}:{code_id}:{canonical_json(init_msg)}".encode()).hexdigest()
+
+#============================ Deployment ============================#
+
+
+class Deployment():
+    """
+    I deploy a spec as a graph: every code is stored first (deduplicated, in parallel),
+    then contracts are instantiated in waves, each wave holding the contracts whose
+    dependencies are all deployed. Within a wave, deployers run concurrently and each
+    deployer sends its own instantiations one after the other.
+    The state is written after every node, a re-run skips what is already deployed.
+    Code ids are kept by wasm checksum, a rebuilt wasm is stored again.
+    """
+
+    def __init__(self, spec: dict, terra=None, state_path: str = None,
+                 registry: CodeRegistry = None, wallets: dict = None) -> None:
+        self.spec = spec
+        self.terra = terra
+        self.state_path = state_path
+        self.registry = registry or CodeRegistry(
+            os.path.join(os.path.dirname(state_path), ".code_ids.json") if state_path else ".code_ids.json")
+        self.wallets = wallets
+        self.lock = threading.Lock()
+        self.checksums: Dict[str, str] = {}  # wasm path -> checksum, hashed once per run
+        self.state = {"code_ids": {}, "contracts": {}}
+        if state_path and os.path.exists(state_path):
+            with open(state_path) as f:
+                self.state = json.load(f)
+        self.contracts: Dict[str, Contract] = {}
+        for name, node in self.state["contracts"].items():
+            self.contracts[name] = self._bind(name, node["address"])
+
+    @property
+    def nodes(self) -> dict:
+        return self.spec["contracts"]
+
+    def dependencies(self, name: str) -> List[str]:
+        node = self.nodes[name]
+        names = references(node.get("init_msg", {})) + list(node.get("depends_on", []))
+        for dependency in names:
+            if dependency not in self.nodes:
+                raise Exception(f"{name} depends on unknown contract {dependency}")
+        return sorted(set(names))
+
+    def waves(self) -> List[List[str]]:
+        """Instantiation order: each wave only depends on the previous ones"""
+        remaining = {name: set(self.dependencies(name)) for name in self.nodes}
+        done = set()
+        waves = []
+        while remaining:
+            wave = sorted(name for name, deps in remaining.items() if deps <= done)
+            if not wave:
+                raise Exception(f"Dependency cycle between {sorted(remaining)}")
+            waves.append(wave)
+            done.update(wave)
+            for name in wave:
+                del remaining[name]
+        return waves
+
+    def wallet(self, name: str):
+        deployer = self.nodes[name].get("deployer") or self.spec.get("deployer", "test1")
+        wallets = self.wallets if self.wallets is not None else self._terra().wallets
+        return wallets[deployer]
+
+    def _terra(self):
+        return self.terra if self.terra is not None else get_terra()
+
+    def _bind(self, name: str, address: str) -> Contract:
+        contract = Contract(name)
+        contract.address = address
+        return contract
+
+    def save(self) -> None:
+        if not self.state_path:
+            return
+        directory = os.path.dirname(self.state_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def checksum(self, name: str) -> str:
+        path = self.nodes[name]["code"]
+        if path not in self.checksums:
+            self.checksums[path] = wasm_checksum(path)
+        return self.checksums[path]
+
+    def code_id(self, name: str) -> int:
+        return self.state["code_ids"].get(self.checksum(name))
+
+    def store(self) -> None:
+        """First wave: every code of the spec, spread over the deployers"""
+        missing = sorted({self.nodes[name]["code"] for name in self.nodes if self.code_id(name) is None})
+        if not missing:
+            return
+        deployers = []
+        for name in self.nodes:
+            wallet = self.wallet(name)
+            if all(wallet is not d for d in deployers):
+                deployers.append(wallet)
+        code_ids = store_contracts(self._terra(), missing, deployers, self.registry)
+        with self.lock:
+            self.state["code_ids"].update({self.checksums[path]: code_id for path, code_id in code_ids.items()})
+            self.save()
+
+    def is_deployed(self, name: str) -> bool:
+        node = self.state["contracts"].get(name)
+        if node is None:
+            return False
+        code_id = self.code_id(name)
+        init_msg = resolve(self.nodes[name].get("init_msg", {}), self.state)
+        return code_id is not None and node["hash"] == node_hash(self.checksum(name), code_id, init_msg)
+
+    def instantiate(self, name: str) -> None:
+        node = self.nodes[name]
+        code_id = self.code_id(name)
+        with self.lock:
+            init_msg = resolve(node.get("init_msg", {}), self.state)
+        address = instantiate_contract(self._terra(), self.wallet(name), code_id, init_msg)
+        with self.lock:
+            self.contracts[name] = self._bind(name, address)
+            self.state["contracts"][name] = {
+                "code_id": code_id,
+                "address": address,
+                "hash": node_hash(self.checksum(name), code_id, init_msg),
+            }
+            self.save()
+
+    def run_wave(self, wave: List[str]) -> None:
+        # One thread per deployer keeps its txs in sequence order
+        by_deployer: Dict[int, List[str]] = {}
+        for name in wave:
+            by_deployer.setdefault(id(self.wallet(name)), []).append(name)
+
+        def deploy(names: List[str]) -> None:
+            for name in names:
+                self.instantiate(name)
+
+        with ThreadPoolExecutor(max_workers=len(by_deployer)) as executor:
+            futures = [executor.submit(deploy, names) for names in by_deployer.values()]
+            errors = [f.exception() for f in futures if f.exception() is not None]
+        if errors:
+            # What succeeded is saved, a re-run starts from there
+            raise errors[0]
+
+    def run(self) -> Dict[str, Contract]:
+        """Deploys what is missing, returns every contract of the spec"""
+        waves = self.waves()
+        self.store()
+        for i, wave in enumerate(waves):
+            todo = [name for name in wave if not self.is_deployed(name)]
+            for name in wave:
+                if name not in todo:
+                    print(chalk.green(f"[+] {name} already deployed at {self.state['contracts'][name]['address']}"))
+            if not todo:
+                continue
+            print(chalk.blue(f"[*] Wave {i + 1}/{len(waves)}: {', '.join(todo)}"))
+            self.run_wave(todo)
+        return self.contracts
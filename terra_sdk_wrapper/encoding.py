@@ -0,0 +1,21 @@
+"""
+Message encoding utilities, importable without terra_sdk:
+- to_binary
+- to_msg
+"""
+
+import base64
+import json
+
+
+def to_binary(o: dict):
+    if hasattr(o, "to_binary"):
+        return o.to_binary()
+    return base64.b64encode(json.dumps(o).encode()).decode()
+
+
+def to_msg(o) -> dict:
+    """Messages generated with the `slots` target are converted to what terra_sdk expects"""
+    if hasattr(o, "to_dict"):
+        return o.to_dict()
+    return o
@@ -0,0 +1,481 @@
+"""
+Stream of wasm events, instead of polling `Contract.query` after every tx:
+- EventStream: one Tendermint websocket subscription for any number of contracts,
+  with a polling fallback on the LCD
+- WasmEvent: one decoded wasm event (contract address, action, attributes)
+- FakeTendermintServer: local websocket server pushing made up txs, for tests
+
+    stream = EventStream(contracts=[token.address, pair.address], actions=["transfer"])
+    for height, events in stream.blocks():
+        for event in events:
+            print(height, event.contract_address, event.attributes)
+
+The websocket client is a small RFC 6455 implementation on the standard library.
+"""
+
+#============================ Imports ============================#
+
+from typing import Dict, Iterable, Iterator, List, Tuple
+import base64
+import hashlib
+import json
+import os
+import re
+import socket
+import socketserver
+import ssl
+import threading
+import time
+from urllib.parse import urlparse
+from .client import get_terra
+
+#============================ Wasm events ============================#
+
+CONTRACT_ADDRESS_KEYS = ("contract_address", "_contract_address")
+
+
+class WasmEvent():
+    """
+    I'm the attributes a contract emitted in one message.
+    `attributes` keeps the last value of each key, `attribute_list` all of them in order.
+    """
+
+    def __init__(self, height: int, txhash: str, contract_address: str, event_type: str = "wasm") -> None:
+        self.height = height
+        self.txhash = txhash
+        self.contract_address = contract_address
+        self.event_type = event_type
+        self.attribute_list: List[Tuple[str, str]] = []
+        self.attributes: Dict[str, str] = {}
+
+    def add(self, key: str, value: str) -> None:
+        self.attribute_list.append((key, value))
+        self.attributes[key] = value
+
+    @property
+    def action(self) -> str:
+        return self.attributes.get("action")
+
+    def __repr__(self) -> str:
+        return f"WasmEvent({self.height}, {self.contract_address}, {self.attributes})"
+
+
+_identifier = re.compile(r"^[\w.\-]+$")
+
+
+def maybe_b64decode(attributes: List[dict]) -> List[Tuple[str, str]]:
+    """
+    Tendermint 0.34 sends attribute keys and values in base64, newer ones in clear.
+    Decoded only if every key decodes to an identifier.
+    """
+    pairs = [(a.get("key") or "", a.get("value") or "") for a in attributes]
+    try:
+        decoded = [(base64.b64decode(k, validate=True).decode(), base64.b64decode(v, validate=True).decode())
+                   for k, v in pairs]
+    except (ValueError, UnicodeDecodeError):
+        return pairs
+    if decoded and all(_identifier.match(k) for k, _ in decoded):
+        return decoded
+    return pairs
+
+
+def decode_wasm_events(height: int, txhash: str, events: List[dict]) -> List[WasmEvent]:
+    """
+    Splits the `wasm` (and custom `wasm-*`) events of a tx per contract.
+    Older wasmd put every contract of a message in one event, each section
+    starting with its `contract_address` attribute.
+    """
+    res = []
+    for event in events:
+        event_type = event.get("type", "")
+        if event_type != "wasm" and not event_type.startswith("wasm-"):
+            continue
+        current = None
+        for key, value in maybe_b64decode(event.get("attributes") or []):
+            if key in CONTRACT_ADDRESS_KEYS:
+                current = WasmEvent(height, txhash, value, event_type)
+                res.append(current)
+                continue
+            if current is None:
+                current = WasmEvent(height, txhash, None, event_type)
+                res.append(current)
+            current.add(key, value)
+    return res
+
+
+class EventFilter():
+    """Keeps events of `contracts` and/or `actions`, everything if both are empty"""
+
+    def __init__(self, contracts: Iterable[str] = None, actions: Iterable[str] = None) -> None:
+        self.contracts = set(contracts or [])
+        self.actions = set(actions or [])
+
+    def matches(self, event: WasmEvent) -> bool:
+        if self.contracts and event.contract_address not in self.contracts:
+            return False
+        if self.actions and event.action not in self.actions:
+            return False
+        return True
+
+#============================ Minimal websocket ============================#
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+
+def encode_frame(payload: bytes, opcode: int = 0x1, mask: bool = True) -> bytes:
+    """Clients must mask their frames, servers must not"""
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 65536:
+        header.append(mask_bit | 126)
+        header += length.to_bytes(2, "big")
+    else:
+        header.append(mask_bit | 127)
+        header += length.to_bytes(8, "big")
+    if mask:
+        key = os.urandom(4)
+        header += key
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return bytes(header) + payload
+
+
+def read_exact(f, n: int) -> bytes:
+    data = f.read(n)
+    if len(data) < n:
+        raise ConnectionError("Websocket closed")
+    return data
+
+
+def read_frame(f) -> Tuple[bool, int, bytes]:
+    """Returns (fin, opcode, payload)"""
+    first, second = read_exact(f, 2)
+    length = second & 0x7F
+    if length == 126:
+        length = int.from_bytes(read_exact(f, 2), "big")
+    elif length == 127:
+        length = int.from_bytes(read_exact(f, 8), "big")
+    key = read_exact(f, 4) if second & 0x80 else None
+    payload = read_exact(f, length)
+    if key:
+        payload = bytes(b ^ key[i % 4] for i, b in enumerate(payload))
+    return bool(first & 0x80), first & 0x0F, payload
+
+
+class WebsocketClient():
+    """Just what a Tendermint subscription needs: text messages, ping/pong and close"""
+
+    def __init__(self, url: str, timeout: float = 10) -> None:
+        parsed = urlparse(url)
+        secure = parsed.scheme == "wss"
+        self.host = parsed.hostname
+        self.port = parsed.port or (443 if secure else 80)
+        self.path = parsed.path or "/"
+        self.sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        if secure:
+            self.sock = ssl.create_default_context().wrap_socket(self.sock, server_hostname=self.host)
+        self.file = self.sock.makefile("rb")
+        self.handshake()
+        # `timeout` is for connecting, a quiet chain may not send anything for a while
+        self.sock.settimeout(None)
+
+    def handshake(self) -> None:
+        key = base64.b64encode(os.urandom(16)).decode()
+        request = (f"GET {self.path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                   "Upgrade: websocket\r\nConnection: Upgrade\r\n"
+                   f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n")
+        self.sock.sendall(request.encode())
+        status = self.file.readline()
+        if b" 101 " not in status:
+            raise ConnectionError(f"Websocket handshake failed: {status!r}")
+        while self.file.readline() not in (b"\r\n", b""):
+            pass
+
+    def send(self, message: str) -> None:
+        self.sock.sendall(encode_frame(message.encode()))
+
+    def recv(self) -> str:
+        chunks = []
+        while True:
+            fin, opcode, payload = read_frame(self.file)
+            if opcode == 0x8:
+                raise ConnectionError("Websocket closed by server")
+            if opcode == 0x9:
+                self.sock.sendall(encode_frame(payload, 0xA))
+                continue
+            if opcode == 0xA:
+                continue
+            chunks.append(payload)
+            if fin:
+                return b"".join(chunks).decode()
+
+    def close(self) -> None:
+        try:
+            self.sock.sendall(encode_frame(b"", 0x8))
+        except OSError:
+            pass
+        self.sock.close()
+
+#============================ Event stream ============================#
+
+
+class EventStream():
+    """
+    I yield the wasm events of new blocks matching `contracts` / `actions`.
+    `mode` is "websocket", "poll", or "auto" (websocket, polling if it can't connect).
+    The websocket receives every tx of the chain on one connection and filters locally,
+    polling asks the LCD for the txs of each new height.
+    Both sources also yield the height of each new block (an int) between the events,
+    so that `blocks` knows when the previous one is complete.
+    """
+
+    def __init__(self, contracts: Iterable[str] = None, actions: Iterable[str] = None,
+                 ws_url: str = "ws://localhost:26657/websocket", mode: str = "auto",
+                 poll_interval: float = 1.0, terra=None) -> None:
+        self.filter = EventFilter(contracts, actions)
+        self.ws_url = ws_url
+        self.mode = mode
+        self.poll_interval = poll_interval
+        self.terra = terra
+        self.ws: WebsocketClient = None
+        self.stopped = False
+
+    def stop(self) -> None:
+        self.stopped = True
+        if self.ws is not None:
+            self.ws.close()
+
+    def stream(self) -> Iterator:
+        """Events, and the height of each new block"""
+        if self.mode == "poll":
+            yield from self.poll_events()
+            return
+        try:
+            self.ws = WebsocketClient(self.ws_url)
+        except OSError as e:
+            if self.mode == "websocket":
+                raise e
+            yield from self.poll_events()
+            return
+        yield from self.websocket_events()
+
+    def events(self) -> Iterator[WasmEvent]:
+        for item in self.stream():
+            if isinstance(item, WasmEvent):
+                yield item
+
+    def blocks(self) -> Iterator[Tuple[int, List[WasmEvent]]]:
+        """
+        Events grouped by height. A block is yielded as soon as a later block starts,
+        blocks without matching events are skipped.
+        """
+        height, events = None, []
+        for item in self.stream():
+            if isinstance(item, int):
+                if events and item > height:
+                    yield height, events
+                    events = []
+                continue
+            if events and item.height != height:
+                yield height, events
+                events = []
+            height = item.height
+            events.append(item)
+        if events:
+            yield height, events
+
+    def websocket_events(self) -> Iterator:
+        # Tendermint fires NewBlock before the txs of that block
+        for i, query in enumerate(("tm.event='Tx'", "tm.event='NewBlock'")):
+            self.ws.send(json.dumps({"jsonrpc": "2.0", "method": "subscribe", "id": i + 1,
+                                     "params": {"query": query}}))
+        try:
+            while not self.stopped:
+                message = json.loads(self.ws.recv())
+                result = message.get("result") or {}
+                data = result.get("data")
+                if not data:
+                    # Subscription acknowledgement
+                    continue
+                if "block" in data["value"]:
+                    yield int(data["value"]["block"]["header"]["height"])
+                    continue
+                tx_result = data["value"]["TxResult"]
+                txhash = (result.get("events") or {}).get("tx.hash", [None])[0]
+                height = int(tx_result["height"])
+                for event in decode_wasm_events(height, txhash, tx_result["result"].get("events") or []):
+                    if self.filter.matches(event):
+                        yield event
+        except OSError:
+            # Also raised by the socket `stop` closed
+            if not self.stopped:
+                raise
+
+    def poll_events(self) -> Iterator:
+        terra = self.terra or get_terra()
+        height = None
+        while not self.stopped:
+            latest = int(terra.tendermint.block_info()["block"]["header"]["height"])
+            if height is None:
+                height = latest
+            while height < latest:
+                height += 1
+                for tx_info in terra.tx.tx_infos_by_height(height):
+                    events = [e for log in (tx_info.logs or []) for e in (log.events or [])]
+                    for event in decode_wasm_events(height, tx_info.txhash, events):
+                        if self.filter.matches(event):
+                            yield event
+                yield height + 1
+            time.sleep(self.poll_interval)
+
+#============================ Fake server ============================#
+
+
+class FakeTendermintServer():
+    """
+    Local websocket server speaking enough Tendermint RPC for EventStream:
+    it acknowledges subscriptions and pushes the txs given to `push_tx`,
+    and the blocks given to `push_block`.
+
+        with FakeTendermintServer() as server:
+            stream = EventStream(ws_url=server.url, mode="websocket")
+            server.push_tx(12, [{"type": "wasm", "attributes": [...]}])
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        self.clients = []
+        self.subscribed = threading.Event()
+        fake = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                key = None
+                while True:
+                    line = self.rfile.readline()
+                    if line in (b"\r\n", b""):
+                        break
+                    if line.lower().startswith(b"sec-websocket-key:"):
+                        key = line.split(b":", 1)[1].strip().decode()
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.wfile.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\n"
+                                  f"Connection: Upgrade\r\nSec-WebSocket-Accept: {accept}\r\n\r\n").encode())
+                try:
+                    while True:
+                        _, opcode, payload = read_frame(self.rfile)
+                        if opcode == 0x8:
+                            return
+                        request = json.loads(payload)
+                        fake.send(self.request, {"jsonrpc": "2.0", "id": request.get("id"), "result": {}})
+                        if self.request not in fake.clients:
+                            fake.clients.append(self.request)
+                        fake.subscribed.set()
+                except (ConnectionError, OSError):
+                    return
+                finally:
+                    if self.request in fake.clients:
+                        fake.clients.remove(self.request)
+
+        self.server = socketserver.ThreadingTCPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.url = f"ws://{host}:{self.server.server_address[1]}/websocket"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send(self, sock, message: dict) -> None:
+        sock.sendall(encode_frame(json.dumps(message).encode(), mask=False))
+
+    def push_tx(self, height: int, events: List[dict], txhash: str = None) -> None:
+        """Sends a Tx event to every subscribed client"""
+        txhash = txhash or hashlib.sha256(f"{height}:{json.dumps(events)}".encode()).hexdigest().upper()
+        message = {"jsonrpc": "2.0", "id": 1, "result": {
+            "query": "tm.event='Tx'",
+            "data": {"type": "tendermint/event/Tx", "value": {"TxResult": {
+                "height": str(height), "index": 0, "result": {"events": events}}}},
+            "events": {"tx.hash": [txhash], "tx.height": [str(height)]},
+        }}
+        for sock in list(self.clients):
+            self.send(sock, message)
+
+    def push_block(self, height: int) -> None:
+        """Sends a NewBlock event to every subscribed client"""
+        message = {"jsonrpc": "2.0", "id": 2, "result": {
+            "query": "tm.event='NewBlock'",
+            "data": {"type": "tendermint/event/NewBlock", "value": {"block": {"header": {"height": str(height)}}}},
+        }}
+        for sock in list(self.clients):
+            self.send(sock, message)
+
+
+def wasm_event(contract_address: str, encode: bool = False, **attributes) -> dict:
+    """Builds a raw `wasm` event, base64 encoded like Tendermint 0.34 if `encode`"""
+    pairs = [("_contract_address", contract_address)] + list(attributes.items())
+    if encode:
+        pairs = [(base64.b64encode(k.encode()).decode(), base64.b64encode(str(v).encode()).decode())
+                 for k, v in pairs]
+    return {"type": "wasm", "attributes": [{"key": k, "value": str(v)} for k, v in pairs]}
+
+
+def test_event_stream():
+    with FakeTendermintServer() as server:
+        stream = EventStream(contracts=["terra1token"], ws_url=server.url, mode="websocket")
+        received = []
+
+        def consume():
+            for block in stream.blocks():
+                received.append(block)
+
+        consumer = threading.Thread(target=consume, daemon=True)
+        consumer.start()
+        assert(server.subscribed.wait(5))
+
+        server.push_tx(10, [wasm_event("terra1token", action="transfer", amount="10")])
+        server.push_tx(10, [wasm_event("terra1other", action="transfer")])
+        server.push_tx(11, [wasm_event("terra1token", encode=True, action="mint", amount="5"),
+                            {"type": "message", "attributes": []}])
+        # Block 11 is complete once block 12 starts, even without txs
+        server.push_block(12)
+        deadline = time.time() + 5
+        while len(received) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        stream.stop()
+
+        assert([h for h, _ in received] == [10, 11])
+        assert([e.action for _, events in received for e in events] == ["transfer", "mint"])
+        assert(received[1][1][0].attributes == {"action": "mint", "amount": "5"})
+
+        # The connect timeout doesn't apply to a quiet subscription
+        client = WebsocketClient(server.url, timeout=0.05)
+        client.send(json.dumps({"jsonrpc": "2.0", "method": "subscribe", "id": 1, "params": {"query": "tm.event='Tx'"}}))
+        assert(json.loads(client.recv())["result"] == {})
+        time.sleep(0.2)
+        server.push_tx(13, [wasm_event("terra1token", action="burn")])
+        assert(json.loads(client.recv())["result"]["events"]["tx.height"] == ["13"])
+        client.close()
+
+    print("[+] Test event stream passed")
+
+
+def test_decode_sections():
+    # One event, two contracts (older wasmd)
+    event = {"type": "wasm", "attributes": [
+        {"key": "contract_address", "value": "terra1a"}, {"key": "action", "value": "send"},
+        {"key": "contract_address", "value": "terra1b"}, {"key": "action", "value": "receive"}]}
+    events = decode_wasm_events(1, "H", [event])
+    assert([(e.contract_address, e.action) for e in events] == [("terra1a", "send"), ("terra1b", "receive")])
+    assert(EventFilter(actions=["receive"]).matches(events[1]) and not EventFilter(["terra1b"]).matches(events[0]))
+
+    print("[+] Test decode sections passed")
+
+
+if __name__ == "__main__":
+    test_decode_sections()
+    test_event_stream()
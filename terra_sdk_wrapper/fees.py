@@ -0,0 +1,161 @@
+"""
+Learned fees instead of a simulation (or a fixed 10M gas fee) per transaction:
+- GasStats: rolling gas usage of one kind of message
+- FeeStrategy: signs with a learned estimate when it knows the message, simulates otherwise
+
+    fees = FeeStrategy(terra)
+    token = Contract("token", fees=fees)
+    token.execute(deployer, Cw20.execute_mint("1000", bob.key.acc_address))  # simulated
+    token.execute(deployer, Cw20.execute_mint("1000", alice.key.acc_address))  # learned
+
+Messages are grouped by (contract code id, message variant), eg. (12, "mint").
+"""
+
+#============================ Imports ============================#
+
+from collections import deque
+from typing import Dict, List, Tuple
+import math
+from terra_sdk.client.localterra import LCDClient
+from terra_sdk.client.localterra import Wallet
+from terra_sdk.client.lcd.api.tx import CreateTxOptions
+from terra_sdk.core.fee import Fee
+from terra_sdk.core.coins import Coins
+from terra_sdk.core.wasm import MsgStoreCode
+from terra_sdk.core.wasm import MsgInstantiateContract
+from terra_sdk.core.wasm import MsgExecuteContract
+from terra_sdk.core.bank import MsgSend
+import chalk
+
+#============================ Gas statistics ============================#
+
+# Bucket store gas by wasm size, it grows with the bytecode
+STORE_SIZE_BUCKET = 64 * 1024
+
+
+class GasStats():
+    """I keep the last `window` gas measures of one kind of message"""
+
+    def __init__(self, window: int = 20) -> None:
+        self.samples = deque(maxlen=window)
+
+    def record(self, gas: int) -> None:
+        self.samples.append(int(gas))
+
+    def estimate(self, margin: float, min_samples: int) -> int:
+        """Highest recent gas with a safety margin, or None if not enough samples"""
+        if len(self.samples) < min_samples:
+            return None
+        return int(math.ceil(max(self.samples) * margin))
+
+
+def is_out_of_gas(result) -> bool:
+    """Code 11 of the sdk codespace, other modules use 11 for their own errors"""
+    if getattr(result, "code", None) != 11:
+        return False
+    codespace = getattr(result, "codespace", None)
+    if codespace is None:
+        # Nothing to tell the module apart, the sdk's message does
+        return "out of gas" in (getattr(result, "raw_log", None) or "")
+    return codespace == "sdk"
+
+#============================ Fee strategy ============================#
+
+
+class FeeStrategy():
+    """
+    I learn how much gas each kind of message uses, from simulations and receipts.
+    Once a kind has `min_samples` measures, its transactions are signed with
+    max(recent gas) * `margin` and skip the simulate round trip.
+    If such a tx runs out of gas, its measures are dropped and it is simulated again.
+    """
+
+    def __init__(self, terra: LCDClient, margin: float = 1.2, window: int = 20,
+                 min_samples: int = 2, gas_adjustment: float = 1.5, gas_prices: Coins = None) -> None:
+        self.terra = terra
+        self.margin = margin
+        self.window = window
+        self.min_samples = min_samples
+        self.gas_adjustment = gas_adjustment
+        self.gas_prices = Coins(gas_prices or terra.gas_prices)
+        self.stats: Dict[Tuple, GasStats] = {}
+        self.code_ids: Dict[str, int] = {}
+        self.simulations = 0
+        self.skipped_simulations = 0
+
+    def code_id(self, contract_address: str) -> int:
+        if contract_address not in self.code_ids:
+            info = self.terra.wasm.contract_info(contract_address)
+            self.code_ids[contract_address] = int(info["code_id"])
+        return self.code_ids[contract_address]
+
+    def key(self, msg) -> Tuple:
+        """What makes two messages cost the same"""
+        if isinstance(msg, MsgExecuteContract):
+            variant = next(iter(msg.execute_msg), None) if isinstance(msg.execute_msg, dict) else None
+            return (self.code_id(msg.contract), variant)
+        if isinstance(msg, MsgInstantiateContract):
+            return (int(msg.code_id), "instantiate")
+        if isinstance(msg, MsgStoreCode):
+            return ("store", len(msg.wasm_byte_code) // STORE_SIZE_BUCKET)
+        if isinstance(msg, MsgSend):
+            return ("send", None)
+        return (type(msg).__name__, None)
+
+    def estimate(self, msgs: List) -> int:
+        """Learned gas for `msgs`, or None if one of them is unknown"""
+        total = 0
+        for msg in msgs:
+            stats = self.stats.get(self.key(msg))
+            gas = stats.estimate(self.margin, self.min_samples) if stats else None
+            if gas is None:
+                return None
+            total += gas
+        return total
+
+    def fee(self, gas: int) -> Fee:
+        return Fee(gas, self.gas_prices.mul(gas).to_int_ceil_coins())
+
+    def record(self, msgs: List, gas: int) -> None:
+        """Only single message txs tell how much one message costs"""
+        if len(msgs) != 1 or not gas:
+            return
+        key = self.key(msgs[0])
+        if key not in self.stats:
+            self.stats[key] = GasStats(self.window)
+        self.stats[key].record(gas)
+
+    def forget(self, msgs: List) -> None:
+        for msg in msgs:
+            self.stats.pop(self.key(msg), None)
+
+    def sign(self, sender: Wallet, msgs: List, simulate: bool = False):
+        """Sign with a learned fee, or simulate and learn from it"""
+        gas = None if simulate else self.estimate(msgs)
+        if gas is not None:
+            self.skipped_simulations += 1
+            return sender.create_and_sign_tx(CreateTxOptions(msgs=msgs, fee=self.fee(gas)))
+        self.simulations += 1
+        tx = sender.create_and_sign_tx(CreateTxOptions(msgs=msgs, gas_adjustment=self.gas_adjustment))
+        # The simulated gas, without the adjustment
+        self.record(msgs, tx.auth_info.fee.gas_limit / self.gas_adjustment)
+        return tx
+
+    def broadcast(self, sender: Wallet, msgs: List):
+        """Sign and broadcast `msgs`, simulating again if the learned fee was too low"""
+        learned = self.estimate(msgs) is not None
+        result = self.terra.tx.broadcast(self.sign(sender, msgs))
+        if learned and is_out_of_gas(result):
+            print(chalk.yellow("[~] Out of gas with a learned fee, simulating again"))
+            self.forget(msgs)
+            result = self.terra.tx.broadcast(self.sign(sender, msgs, simulate=True))
+        if not getattr(result, "code", None):
+            self.record(msgs, getattr(result, "gas_used", None))
+        return result
+
+    def summary(self) -> dict:
+        return {
+            "simulations": self.simulations,
+            "skipped_simulations": self.skipped_simulations,
+            "estimates": {str(k): s.estimate(self.margin, self.min_samples) for k, s in self.stats.items()},
+        }
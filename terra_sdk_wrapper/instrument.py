@@ -0,0 +1,301 @@
+"""
+Timings and metrics of the calls made by the wrapper (sign, simulate, broadcast, query):
+- span: measures one phase of a call, does nothing while no sink is added
+- add_sink / remove_sink: where the measures go
+- HistogramSink: in memory histograms and totals per phase, contract and message variant
+- JsonlSink: one JSON line per measure
+- PrometheusSink: HistogramSink exposed in the Prometheus text format
+
+    sink = add_sink(HistogramSink())
+    token.execute(deployer, Cw20.execute_mint("1000", bob.key.acc_address))
+    print(sink.summary())
+    # {('simulate', 'terra1...', 'mint'): {'count': 1, 'seconds': 0.21, ...}, ('sign', ...), ('broadcast', ...)}
+"""
+
+import bisect
+import json
+import threading
+import time
+from typing import Dict, List, Tuple
+from .encoding import to_msg
+
+#============================ Spans ============================#
+
+_sinks: List = []
+
+
+def add_sink(sink):
+    """Measures are sent to `sink.emit(record)` from now on, returns the sink"""
+    _sinks.append(sink)
+    return sink
+
+
+def remove_sink(sink) -> None:
+    if sink in _sinks:
+        _sinks.remove(sink)
+
+
+def clear_sinks() -> None:
+    del _sinks[:]
+
+
+def enabled() -> bool:
+    return bool(_sinks)
+
+
+def msg_variant(msg) -> str:
+    """`{'transfer': {...}}` -> 'transfer'"""
+    if isinstance(msg, str):
+        return msg
+    msg = to_msg(msg)
+    if isinstance(msg, dict) and len(msg) == 1:
+        return next(iter(msg))
+    return type(msg).__name__
+
+
+class Span():
+    """
+    I time one phase. `variant` is a label or the message itself.
+    Extra fields (gas_wanted, gas_used, bytes) are given with `set`.
+    An exception leaving the block marks the measure as failed and goes on.
+    """
+    __slots__ = ("record", "start")
+
+    def __init__(self, phase: str, contract: str = None, variant=None) -> None:
+        if variant is not None:
+            variant = msg_variant(variant)
+        self.record = {"phase": phase, "contract": contract, "variant": variant, "ok": True}
+        self.start = 0.0
+
+    def __bool__(self) -> bool:
+        return True
+
+    def set(self, **fields) -> None:
+        self.record.update(fields)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.record["seconds"] = time.perf_counter() - self.start
+        self.record["time"] = time.time()
+        if exc_type is not None:
+            self.record["ok"] = False
+            self.record["error"] = str(exc_value)
+        for sink in list(_sinks):
+            sink.emit(self.record)
+        return False
+
+
+class NoopSpan():
+    """
+    What `span` returns while disabled: one shared object, nothing measured.
+    It is falsy, so costly fields can be skipped with `if s: s.set(...)`.
+    """
+    __slots__ = ()
+
+    def __bool__(self) -> bool:
+        return False
+
+    def set(self, **fields) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_noop = NoopSpan()
+
+
+def span(phase: str, contract: str = None, variant=None):
+    """
+    Measure a phase: `with span("broadcast", address, execute_msg) as s: ...`
+    The variant of the message is only computed when enabled.
+    """
+    if not _sinks:
+        return _noop
+    return Span(phase, contract, variant)
+
+
+def describe_broadcast(s, sender, result) -> None:
+    """Adds the outcome of a tx to its broadcast span: hash, height, gas, events, error"""
+    if not s:
+        return
+    code = getattr(result, "code", None)
+    s.set(txhash=getattr(result, "txhash", None), height=getattr(result, "height", None),
+          sender=sender.key.acc_address, gas_wanted=getattr(result, "gas_wanted", None),
+          gas_used=getattr(result, "gas_used", None), ok=not code,
+          events=[log.events_by_type for log in getattr(result, "logs", None) or []])
+    if code:
+        s.set(error=result.raw_log)
+
+#============================ Sinks ============================#
+
+# Seconds, like the Prometheus client defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram():
+    """Counts per bucket (upper bounds), sum and count"""
+
+    def __init__(self, buckets: Tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class HistogramSink():
+    """
+    I aggregate the measures in memory per (phase, contract, variant):
+    a histogram of the durations, failures, gas wanted and used, bytes sent.
+    """
+
+    def __init__(self, buckets: Tuple = DEFAULT_BUCKETS) -> None:
+        self.buckets = buckets
+        self.histograms: Dict[Tuple, Histogram] = {}
+        self.totals: Dict[Tuple, Dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def emit(self, record: dict) -> None:
+        key = (record["phase"], record["contract"], record["variant"])
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(self.buckets)
+                self.totals[key] = {"errors": 0, "gas_wanted": 0, "gas_used": 0, "bytes": 0}
+            self.histograms[key].observe(record["seconds"])
+            totals = self.totals[key]
+            if not record["ok"]:
+                totals["errors"] += 1
+            for field in ("gas_wanted", "gas_used", "bytes"):
+                if record.get(field):
+                    totals[field] += int(record[field])
+
+    def summary(self) -> dict:
+        with self.lock:
+            return {
+                key: {
+                    "count": histogram.count,
+                    "seconds": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p99": histogram.quantile(0.99),
+                    **self.totals[key],
+                }
+                for key, histogram in self.histograms.items()
+            }
+
+
+class JsonlSink():
+    """I append every measure to `path`, one JSON object per line"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "a")
+        self.lock = threading.Lock()
+
+    def emit(self, record: dict) -> None:
+        line = json.dumps(record)
+        with self.lock:
+            self.file.write(line + "\n")
+
+    def flush(self) -> None:
+        with self.lock:
+            self.file.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            self.file.close()
+
+
+def prometheus_labels(key: Tuple, **extra) -> str:
+    phase, contract, variant = key
+    labels = {"phase": phase, "contract": contract or "", "variant": variant or "", **extra}
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in labels.values())
+    return ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped))
+
+
+class PrometheusSink(HistogramSink):
+    """I'm a HistogramSink readable by Prometheus, serve `exposition()` on /metrics"""
+
+    prefix = "terra_wrapper"
+
+    def exposition(self) -> str:
+        lines = [
+            f"# HELP {self.prefix}_phase_seconds Duration of the wrapper calls per phase",
+            f"# TYPE {self.prefix}_phase_seconds histogram",
+        ]
+        with self.lock:
+            for key, histogram in sorted(self.histograms.items(), key=lambda kv: str(kv[0])):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{self.prefix}_phase_seconds_bucket{{{prometheus_labels(key, le=le)}}} {cumulative}")
+                lines.append(f"{self.prefix}_phase_seconds_sum{{{prometheus_labels(key)}}} {histogram.sum}")
+                lines.append(f"{self.prefix}_phase_seconds_count{{{prometheus_labels(key)}}} {histogram.count}")
+            for field in ("errors", "gas_wanted", "gas_used", "bytes"):
+                lines.append(f"# TYPE {self.prefix}_{field}_total counter")
+                for key, totals in sorted(self.totals.items(), key=lambda kv: str(kv[0])):
+                    lines.append(f"{self.prefix}_{field}_total{{{prometheus_labels(key)}}} {totals[field]}")
+        return "\n".join(lines) + "\n"
+
+
+def test_sinks():
+    clear_sinks()
+    with span("query") as s:
+        assert(not s)
+    histograms = add_sink(PrometheusSink())
+    for i in range(10):
+        with span("broadcast", "terra1abc", "mint") as s:
+            s.set(gas_wanted=200_000, gas_used=150_000, bytes=300)
+    try:
+        with span("query", "terra1abc", {"balance": {"address": "x"}}):
+            raise Exception("not found")
+    except Exception:
+        pass
+    summary = histograms.summary()
+    assert(summary[("broadcast", "terra1abc", "mint")]["gas_used"] == 1_500_000)
+    assert(summary[("query", "terra1abc", "balance")]["errors"] == 1)
+    text = histograms.exposition()
+    assert('terra_wrapper_phase_seconds_count{phase="broadcast",contract="terra1abc",variant="mint"} 10' in text)
+    assert('le="+Inf"} 10' in text)
+    clear_sinks()
+    print("[+] Test sinks passed")
+
+
+def test_disabled_overhead(calls: int = 200_000):
+    clear_sinks()
+    start = time.perf_counter()
+    for _ in range(calls):
+        with span("query", "terra1abc", "balance"):
+            pass
+    per_call = (time.perf_counter() - start) / calls
+    # A query round trip takes milliseconds
+    assert(per_call < 2e-6)
+    print(f"[+] Test disabled overhead passed ({per_call * 1e9:.0f}ns per span)")
+
+
+if __name__ == "__main__":
+    test_sinks()
+    test_disabled_overhead()
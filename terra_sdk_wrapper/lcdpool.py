@@ -0,0 +1,550 @@
+"""
+Many LCD endpoints behind one client:
+- LCDPool: persistent connections to every endpoint, reads routed to the fastest healthy one,
+  broadcasts pinned per wallet, retries and failover with a circuit breaker per endpoint
+- FakeLCDServer: a local stand-in LCD, slow or failing on demand, for tests
+
+    pool = LCDPool(["https://lcd-1.example", "https://lcd-2.example", "https://lcd-3.example"])
+    configure(client=pool.client("phoenix-1"))  # `terra` and every Contract now use the pool
+    print(pool.stats())
+
+Or TERRA_LCD_URL="https://lcd-1.example,https://lcd-2.example" (comma separated).
+"""
+
+import base64
+import http.client
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Tuple
+from terra_sdk.exceptions import LCDResponseError
+
+#============================ Endpoint ============================#
+
+# gRPC codes of a node failing, not of a failing request
+UNAVAILABLE_CODES = (4, 14)
+# Cheap read probing an endpoint whose breaker cooled down
+PROBE_PATH = "/cosmos/base/tendermint/v1beta1/node_info"
+
+
+class LCDResponse():
+    """What `LCDResponseError.response` gives to read, aiohttp's response otherwise"""
+
+    def __init__(self, status: int, url: str) -> None:
+        self.status = status
+        self.reason = http.client.responses.get(status, "")
+        self.url = url
+
+
+class LCDError(LCDResponseError):
+    """
+    The LCD answered, with an error: `status` and `message`.
+    Caught like the errors of terra_sdk's own client.
+    """
+
+    def __init__(self, status: int, message: str, url: str) -> None:
+        super().__init__(message, LCDResponse(status, url))
+        self.status = status
+        self.url = url
+
+    def __str__(self) -> str:
+        return f"{self.status} from {self.url}: {self.message}"
+
+
+class Endpoint():
+    """
+    I'm one LCD: a keep-alive connection per thread, the EWMA of my latency,
+    and a circuit breaker, open after `failure_threshold` failures in a row.
+    Once `cooldown` seconds are over, one probe request tells if I'm back (half-open).
+    """
+
+    def __init__(self, url: str, timeout: float, alpha: float, failure_threshold: int, cooldown: float) -> None:
+        parsed = urllib.parse.urlsplit(url)
+        self.url = url
+        self.scheme = parsed.scheme or "http"
+        self.netloc = parsed.netloc
+        self.base_path = parsed.path.rstrip("/")
+        self.timeout = timeout
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.ewma = None
+        self.last_used = 0.0
+        self.in_flight = 0
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+        self.local = threading.local()
+
+    def state(self, now: float) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if now - self.opened_at >= self.cooldown and not self.probing:
+            return "half-open"
+        return "open"
+
+    def connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            factory = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            connection = factory(self.netloc, timeout=self.timeout)
+            self.local.connection = connection
+        return connection
+
+    def drop_connection(self) -> None:
+        connection = getattr(self.local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self.local.connection = None
+
+    def request(self, method: str, path: str, body: bytes = None) -> Tuple[int, bytes]:
+        headers = {"Accept": "application/json"}
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        # A kept-alive connection may have been closed by the server meanwhile: one reconnection
+        for attempt in range(2):
+            connection = self.connection()
+            reused = connection.sock is not None
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                response = connection.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                self.drop_connection()
+                if not reused or attempt == 1:
+                    raise e
+            except Exception as e:
+                self.drop_connection()
+                raise e
+
+    def observe(self, seconds: float) -> None:
+        self.ewma = seconds if self.ewma is None else self.alpha * seconds + (1 - self.alpha) * self.ewma
+
+    def score(self, now: float, refresh: float) -> float:
+        """Expected latency, 0 when unknown or too old to trust: measure it again"""
+        if self.ewma is None or now - self.last_used > refresh:
+            return 0.0
+        return self.ewma * (1 + self.in_flight)
+
+#============================ Pool ============================#
+
+
+def read_proto_fields(data: bytes):
+    """(field number, value) of a protobuf message, length delimited values as bytes"""
+    index = 0
+    while index < len(data):
+        key, index = read_varint(data, index)
+        number, wire_type = key >> 3, key & 7
+        if wire_type == 0:
+            value, index = read_varint(data, index)
+        elif wire_type == 1:
+            value, index = data[index:index + 8], index + 8
+        elif wire_type == 2:
+            length, index = read_varint(data, index)
+            value, index = data[index:index + length], index + length
+        elif wire_type == 5:
+            value, index = data[index:index + 4], index + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        yield number, value
+
+
+def read_varint(data: bytes, index: int) -> Tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[index]
+        index += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, index
+        shift += 7
+
+
+def broadcast_signer(body: dict) -> str:
+    """
+    The first signer public key of a broadcast `{"tx_bytes": ...}`, as a pin key.
+    TxRaw.auth_info_bytes (2) -> AuthInfo.signer_infos (1) -> SignerInfo.public_key (1)
+    """
+    try:
+        tx_raw = dict(read_proto_fields(base64.b64decode(body["tx_bytes"])))
+        auth_info = dict(read_proto_fields(tx_raw[2]))
+        signer_info = dict(read_proto_fields(auth_info[1]))
+        return base64.b64encode(signer_info[1]).decode()
+    except (KeyError, TypeError, ValueError, IndexError):
+        return None
+
+
+class LCDPool():
+    """
+    I route LCD requests over several endpoints:
+    - reads go to the healthy endpoint with the lowest latency EWMA (times its requests in flight),
+      endpoints not used for `refresh` seconds are measured again
+    - broadcasts of a wallet always go to the same endpoint (its mempool knows the sequences),
+      another one is pinned when it fails
+    - a connection error, a timeout or a 5xx without gRPC error is retried on another endpoint,
+      up to `retries` times; the LCD answering an error (4xx, failed contract query) is not
+    - an endpoint whose breaker cooled down is probed in the background with `probe_path`,
+      requests only go to it when no endpoint is healthy
+    Errors are `LCDError`, a terra_sdk `LCDResponseError`.
+    """
+
+    def __init__(self, urls: List[str], timeout: float = 10.0, retries: int = 2, alpha: float = 0.3,
+                 failure_threshold: int = 3, cooldown: float = 5.0, refresh: float = 30.0,
+                 probe_path: str = PROBE_PATH) -> None:
+        if not urls:
+            raise Exception("LCDPool needs endpoints")
+        self.endpoints = [Endpoint(url, timeout, alpha, failure_threshold, cooldown) for url in urls]
+        self.retries = retries
+        self.refresh = refresh
+        self.probe_path = probe_path
+        self.pins: Dict[str, Endpoint] = {}
+        self.lock = threading.Lock()
+
+    def pick(self, exclude: List[Endpoint] = ()) -> Endpoint:
+        with self.lock:
+            now = time.monotonic()
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            probes = [e for e in candidates if e.state(now) == "half-open"]
+            healthy = [e for e in candidates if e.state(now) == "closed"]
+            if healthy:
+                # Cooled down endpoints are probed aside, not with a live request
+                for probe in probes:
+                    self._start_probe(probe)
+                endpoint = min(healthy, key=lambda e: e.score(now, self.refresh))
+            elif probes:
+                # Nothing healthy: this request tells if it's back, a retry covers it otherwise
+                endpoint = probes[0]
+                endpoint.probing = True
+            else:
+                # Every breaker open: the one open for the longest, rather than nothing
+                endpoint = min(candidates, key=lambda e: e.opened_at)
+            endpoint.in_flight += 1
+            return endpoint
+
+    def pinned(self, key: str, exclude: List[Endpoint] = ()) -> Endpoint:
+        """The endpoint of `key`, pinned again if it's failing"""
+        with self.lock:
+            endpoint = self.pins.get(key)
+            if endpoint is not None and endpoint not in exclude and endpoint.state(time.monotonic()) == "closed":
+                endpoint.in_flight += 1
+                return endpoint
+        endpoint = self.pick(exclude)
+        if endpoint is not None:
+            with self.lock:
+                self.pins[key] = endpoint
+        return endpoint
+
+    def _start_probe(self, endpoint: Endpoint) -> None:
+        """Called with the lock held"""
+        endpoint.probing = True
+        endpoint.in_flight += 1
+        threading.Thread(target=self._probe, args=(endpoint,), daemon=True).start()
+
+    def _probe(self, endpoint: Endpoint) -> None:
+        start = time.perf_counter()
+        try:
+            status, _ = endpoint.request("GET", self.probe_path)
+        except Exception:
+            return self._failed(endpoint)
+        finally:
+            # The thread ends here, its connection with it
+            endpoint.drop_connection()
+        if status >= 500:
+            return self._failed(endpoint)
+        self._succeeded(endpoint, time.perf_counter() - start)
+
+    def _release(self, endpoint: Endpoint) -> None:
+        """The request stopped without telling anything about the endpoint"""
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.probing = False
+
+    def _succeeded(self, endpoint: Endpoint, seconds: float) -> None:
+        with self.lock:
+            endpoint.in_flight -= 1
+            endpoint.requests += 1
+            endpoint.last_used = time.monotonic()
+            endpoint.observe(seconds)
+            endpoint.failures = 0
+            endpoint.opened_at = None
+            endpoint.probing = False
+
+    def _failed(self, endpoint: Endpoint) -> None:
+        with self.lock:
+            now = time.monotonic()
+            endpoint.in_flight -= 1
+            endpoint.requests += 1
+            endpoint.errors += 1
+            endpoint.failures += 1
+            if endpoint.probing or endpoint.failures >= endpoint.failure_threshold:
+                endpoint.opened_at = now
+            endpoint.probing = False
+
+    def call(self, method: str, path: str, params=None, body: dict = None, pin: str = None) -> dict:
+        """One request, retried on other endpoints when the endpoint fails. Returns the JSON answer"""
+        if params:
+            path += "?" + urllib.parse.urlencode(params, doseq=True)
+        data = json.dumps(body).encode() if body is not None else None
+        tried = []
+        error = None
+        for _ in range(self.retries + 1):
+            endpoint = self.pinned(pin, tried) if pin is not None else self.pick(tried)
+            if endpoint is None:
+                break
+            start = time.perf_counter()
+            try:
+                status, raw = endpoint.request(method, path, data)
+            except (OSError, http.client.HTTPException) as e:
+                self._failed(endpoint)
+                tried.append(endpoint)
+                error = e
+                continue
+            except BaseException:
+                # Interrupted, or a bug of ours: the endpoint is given back as is
+                self._release(endpoint)
+                raise
+            seconds = time.perf_counter() - start
+            try:
+                answer = json.loads(raw) if raw else {}
+            except ValueError:
+                answer = None
+            grpc_code = answer.get("code") if isinstance(answer, dict) else None
+            if status >= 500 and (grpc_code is None or grpc_code in UNAVAILABLE_CODES):
+                self._failed(endpoint)
+                tried.append(endpoint)
+                error = LCDError(status, raw[:200].decode(errors="replace"), endpoint.url)
+                continue
+            self._succeeded(endpoint, seconds)
+            if not 200 <= status < 300:
+                message = answer.get("message", answer) if isinstance(answer, dict) else raw.decode(errors="replace")
+                raise LCDError(status, str(message), endpoint.url)
+            if answer is None:
+                raise LCDError(status, f"not JSON: {raw[:200]!r}", endpoint.url)
+            return answer
+        raise LCDError(getattr(error, "status", 503), f"{method} {path} failed on {len(tried)} endpoints: {error}",
+                       tried[-1].url if tried else None)
+
+    def get(self, path: str, params=None) -> dict:
+        return self.call("GET", path, params=params)
+
+    def post(self, path: str, body: dict = None, pin: str = None) -> dict:
+        """
+        Broadcasts (`{"tx_bytes": ...}`) are pinned to their signer's endpoint, other posts
+        are routed like reads. A broadcast retried elsewhere may have been received:
+        the duplicate is then refused by the chain (same sequence).
+        """
+        if pin is None and isinstance(body, dict) and "tx_bytes" in body:
+            pin = broadcast_signer(body)
+        return self.call("POST", path, body=body, pin=pin)
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            pinned = {}
+            for endpoint in self.pins.values():
+                pinned[endpoint.url] = pinned.get(endpoint.url, 0) + 1
+            return {
+                endpoint.url: {
+                    "state": endpoint.state(now),
+                    "ewma_ms": None if endpoint.ewma is None else endpoint.ewma * 1000,
+                    "requests": endpoint.requests,
+                    "errors": endpoint.errors,
+                    "in_flight": endpoint.in_flight,
+                    "pinned_wallets": pinned.get(endpoint.url, 0),
+                }
+                for endpoint in self.endpoints
+            }
+
+    def client(self, chain_id: str = "localterra", **kwargs):
+        """A terra_sdk LCDClient whose requests go through the pool"""
+        from terra_sdk.client.lcd import LCDClient
+        from terra_sdk.util.json import dict_to_data
+        pool = self
+
+        class PooledLCDClient(LCDClient):
+            # Same signatures as AsyncLCDClient, run on the pool connections instead of a new session
+            async def _get(self, endpoint: str, params=None, raw: bool = False):
+                if params is not None and hasattr(params, "to_dict"):
+                    params = params.to_dict()
+                return pool.get(endpoint, params)
+
+            async def _post(self, endpoint: str, data: dict = None, raw: bool = False):
+                return pool.post(endpoint, dict_to_data(data) if data else data)
+
+        return PooledLCDClient(self.endpoints[0].url, chain_id, **kwargs)
+
+#============================ Stand-in LCD ============================#
+
+
+class FakeLCDServer():
+    """
+    Local HTTP server answering like an LCD, with keep-alive:
+    - GET .../smart/{base64 query}: `{"data": {"query": query, "server": port}}`
+    - POST /cosmos/tx/v1beta1/txs: a tx response, the bodies are kept in `broadcasts`
+    - any other GET: `{"path": path, "server": port}`
+    `delay` slows every answer, `fail` makes it "close" the connection or answer "503",
+    `contract_error` answers smart queries with a failed contract query (500, gRPC code 2).
+
+        with FakeLCDServer(delay=0.01) as slow, FakeLCDServer() as fast:
+            pool = LCDPool([slow.url, fast.url])
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, delay: float = 0.0) -> None:
+        self.delay = delay
+        self.fail = None
+        self.contract_error = False
+        self.requests = 0
+        self.connections = 0
+        self.broadcasts: List[dict] = []
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Headers and body are written apart, Nagle would delay the body
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                fake.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def answer(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def handle_request(self, body: dict = None) -> None:
+                fake.requests += 1
+                if fake.delay:
+                    time.sleep(fake.delay)
+                if fake.fail == "close":
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if fake.fail == "503":
+                    return self.answer(503, {"error": "unavailable"})
+                path = urllib.parse.urlsplit(self.path).path
+                server = fake.port
+                if body is not None and path == "/cosmos/tx/v1beta1/txs":
+                    fake.broadcasts.append(body)
+                    return self.answer(200, {"tx_response": {
+                        "txhash": f"{len(fake.broadcasts):064X}", "code": 0, "height": str(len(fake.broadcasts)),
+                        "raw_log": "", "server": server}})
+                if "/smart/" in path:
+                    if fake.contract_error:
+                        return self.answer(500, {"code": 2, "message": "query wasm contract failed: Unauthorized",
+                                                 "details": []})
+                    query = json.loads(base64.b64decode(urllib.parse.unquote(path.rsplit("/", 1)[1])))
+                    return self.answer(200, {"data": {"query": query, "server": server}})
+                self.answer(200, {"path": path, "server": server})
+
+            def do_GET(self):
+                self.handle_request()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.handle_request(json.loads(self.rfile.read(length) or b"{}"))
+
+        self.server = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.url = f"http://{host}:{self.port}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def smart_path(contract: str, query: dict) -> str:
+    encoded = base64.b64encode(json.dumps(query).encode()).decode()
+    return f"/cosmwasm/wasm/v1/contract/{contract}/smart/{urllib.parse.quote(encoded, safe='')}"
+
+
+def encode_proto_bytes(number: int, value: bytes) -> bytes:
+    """One length delimited field (lengths under 128 bytes)"""
+    return bytes([number << 3 | 2, len(value)]) + value
+
+
+def test_lcd_pool():
+    with FakeLCDServer() as fast, FakeLCDServer(delay=0.02) as slow, FakeLCDServer(delay=0.005) as medium:
+        pool = LCDPool([slow.url, medium.url, fast.url], cooldown=0.2, refresh=60)
+
+        # Reads go to the fastest, over a few connections
+        for i in range(60):
+            assert(pool.get(smart_path("terra1token", {"balance": {"i": i}}))["data"]["query"] == {"balance": {"i": i}})
+        assert(fast.requests > 50 and slow.requests < 5), (fast.requests, medium.requests, slow.requests)
+        assert(fast.connections == 1)
+
+        # A contract error is an answer: raised, the endpoint stays healthy
+        fast.contract_error = True
+        try:
+            pool.get(smart_path("terra1token", {"balance": {}}))
+            assert(False)
+        except LCDError as e:
+            assert(e.status == 500 and "Unauthorized" in e.message)
+        fast.contract_error = False
+        assert(pool.stats()[fast.url]["state"] == "closed")
+
+        # The fastest dies: failover, then its breaker opens
+        fast.fail = "close"
+        for _ in range(10):
+            assert(pool.get("/cosmos/base/tendermint/v1beta1/blocks/latest")["server"] != fast.port)
+        stats = pool.stats()
+        assert(stats[fast.url]["state"] == "open" and stats[fast.url]["errors"] == 3)
+        before = fast.requests
+        pool.get("/node_info")
+        assert(fast.requests == before)
+
+        # Back after the cooldown, through a probe aside from the live reads
+        fast.fail = None
+        time.sleep(0.25)
+        assert(pool.get("/node_info")["server"] != fast.port)
+        for _ in range(100):
+            if pool.stats()[fast.url]["state"] == "closed":
+                break
+            time.sleep(0.01)
+        assert(pool.stats()[fast.url]["state"] == "closed")
+
+        # Broadcasts stick to the endpoint of their signer, until it fails
+        public_key = encode_proto_bytes(1, b"/cosmos.crypto.secp256k1.PubKey") + encode_proto_bytes(2, b"\x02" * 33)
+        auth_info = encode_proto_bytes(1, encode_proto_bytes(1, public_key))
+        tx_bytes = base64.b64encode(encode_proto_bytes(1, b"body") + encode_proto_bytes(2, auth_info)).decode()
+        body = {"tx_bytes": tx_bytes, "mode": "BROADCAST_MODE_SYNC"}
+        assert(broadcast_signer(body) == base64.b64encode(public_key).decode())
+        servers = {pool.post("/cosmos/tx/v1beta1/txs", body)["tx_response"]["server"] for _ in range(20)}
+        assert(len(servers) == 1)
+        pinned = {fast.port: fast, slow.port: slow, medium.port: medium}[servers.pop()]
+        pinned.fail = "503"
+        servers = {pool.post("/cosmos/tx/v1beta1/txs", body)["tx_response"]["server"] for _ in range(5)}
+        assert(len(servers) == 1 and pinned.port not in servers)
+        pinned.fail = None
+
+        # Everything down
+        for server in (fast, slow, medium):
+            server.fail = "503"
+        try:
+            pool.get("/node_info")
+            assert(False)
+        except LCDResponseError as e:
+            assert(e.response.status == 503 and "failed on 3 endpoints" in str(e))
+    print("[+] Test LCD pool passed")
+
+
+if __name__ == "__main__":
+    test_lcd_pool()
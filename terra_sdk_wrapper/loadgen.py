@@ -0,0 +1,259 @@
+"""
+Load generation against a contract, to see how it behaves under sustained traffic:
+- Operation: one kind of execute or query, with its weight in the mix
+- Scenario: wallets, operations, target TPS and duration
+- run_scenario: drives the scenario and returns the report (throughput, latencies, gas, failures)
+
+    scenario = Scenario("mint", token_contract, list(terra.wallets.values()), tps=20, duration=60)
+    scenario.add_execute("mint", lambda wallet, i: Cw20.execute_mint("1", wallet.key.acc_address))
+    scenario.add_query("balance", lambda wallet, i: Cw20.query_balance(wallet.key.acc_address), weight=4)
+    print(report_json(run_scenario(scenario)))
+
+It runs against the configured client: LocalTerra, or offline with `configure(client=MockBackend())`.
+"""
+
+#============================ Imports ============================#
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List
+import json
+import math
+import random
+import threading
+import time
+from terra_sdk.client.localterra import Wallet
+import chalk
+
+#============================ Scenario ============================#
+
+
+class Operation():
+    """
+    `build(wallet, i)` returns the message of the i-th call.
+    `kind` is "execute" or "query", `variant` labels the report.
+    """
+    kind: str
+    variant: str
+    weight: float
+    build: Callable
+
+    def __init__(self, kind: str, variant: str, build: Callable, weight: float = 1) -> None:
+        self.kind = kind
+        self.variant = variant
+        self.build = build
+        self.weight = weight
+
+
+class Scenario():
+    """
+    I describe the traffic: `tps` calls per second during `duration` seconds,
+    spread over `wallets`, picking operations by weight.
+    Each wallet signs its executes one after the other (sequence ordering),
+    so executes scale with the number of wallets.
+    """
+
+    def __init__(self, name: str, contract, wallets: List[Wallet], tps: float = 10,
+                 duration: float = 30, query_workers: int = 16, seed: int = 0) -> None:
+        self.name = name
+        self.contract = contract
+        self.wallets = wallets
+        self.tps = tps
+        self.duration = duration
+        self.query_workers = query_workers
+        self.seed = seed
+        self.operations: List[Operation] = []
+
+    def add_execute(self, variant: str, build: Callable, weight: float = 1) -> None:
+        self.operations.append(Operation("execute", variant, build, weight))
+
+    def add_query(self, variant: str, build: Callable, weight: float = 1) -> None:
+        self.operations.append(Operation("query", variant, build, weight))
+
+#============================ Measures ============================#
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class Recorder():
+    """I collect the outcome of every call, from many threads"""
+
+    def __init__(self) -> None:
+        self.latencies: Dict[str, List[float]] = {}
+        self.gas: Dict[str, List[int]] = {}
+        self.calls: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, label: str, seconds: float, failed: bool, gas_used: int = None) -> None:
+        with self.lock:
+            self.calls[label] = self.calls.get(label, 0) + 1
+            if failed:
+                self.failures[label] = self.failures.get(label, 0) + 1
+                return
+            self.latencies.setdefault(label, []).append(seconds)
+            if gas_used:
+                self.gas.setdefault(label, []).append(int(gas_used))
+
+    def report(self) -> dict:
+        report = {}
+        for label, calls in sorted(self.calls.items()):
+            latencies = sorted(self.latencies.get(label, []))
+            gas = self.gas.get(label, [])
+            report[label] = {
+                "calls": calls,
+                "failure_rate": self.failures.get(label, 0) / calls,
+                "latency_ms": {f"p{p}": (percentile(latencies, p) or 0) * 1000 for p in (50, 95, 99)},
+                "gas_used": {"mean": sum(gas) / len(gas), "max": max(gas)} if gas else None,
+            }
+        return report
+
+#============================ Runner ============================#
+
+
+def is_failed(kind: str, result) -> bool:
+    # A tx that couldn't be built or broadcast raised already
+    if kind == "query":
+        return False
+    return result is None or bool(getattr(result, "code", None))
+
+
+def run_operation(scenario: Scenario, recorder: Recorder, operation: Operation, wallet: Wallet, i: int,
+                  scheduled: float) -> None:
+    """
+    Latency counts from `scheduled`, the time the call was due, not from when a worker
+    got to it: time spent queued behind a slow call is part of what a user would see.
+    """
+    label = f"{operation.kind}_{operation.variant}"
+    try:
+        msg = operation.build(wallet, i)
+        if operation.kind == "execute":
+            # Block broadcast mode: returns once the tx is included
+            result = scenario.contract.execute(wallet, msg)
+        else:
+            result = scenario.contract.query(msg)
+        failed = is_failed(operation.kind, result)
+    except Exception:
+        result = None
+        failed = True
+    recorder.record(label, time.perf_counter() - scheduled, failed, getattr(result, "gas_used", None))
+
+
+def run_scenario(scenario: Scenario) -> dict:
+    """
+    Submits calls at the target rate and waits for all of them, returns the report
+    """
+    if not scenario.operations or not scenario.wallets:
+        raise Exception("Scenario needs operations and wallets")
+    rng = random.Random(scenario.seed)
+    weights = [op.weight for op in scenario.operations]
+    recorder = Recorder()
+
+    # One single thread executor per wallet keeps its txs in sequence order
+    wallet_executors = [ThreadPoolExecutor(max_workers=1) for _ in scenario.wallets]
+    query_executor = ThreadPoolExecutor(max_workers=scenario.query_workers)
+
+    total = int(scenario.tps * scenario.duration)
+    print(chalk.blue(f"[*] Running {scenario.name}: {total} calls at {scenario.tps} TPS "
+                     f"over {len(scenario.wallets)} wallets"))
+    start = time.perf_counter()
+    futures = []
+    for i in range(total):
+        # Open loop: calls are submitted on schedule, whatever the latency
+        scheduled = start + i / scenario.tps
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        operation = rng.choices(scenario.operations, weights)[0]
+        index = i % len(scenario.wallets)
+        executor = wallet_executors[index] if operation.kind == "execute" else query_executor
+        futures.append(executor.submit(run_operation, scenario, recorder, operation,
+                                       scenario.wallets[index], i, scheduled))
+
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    for executor in wallet_executors + [query_executor]:
+        executor.shutdown()
+
+    completed = sum(recorder.calls.values()) - sum(recorder.failures.values())
+    return {
+        "scenario": scenario.name,
+        "target_tps": scenario.tps,
+        "wallets": len(scenario.wallets),
+        "submitted": total,
+        "completed": completed,
+        "seconds": elapsed,
+        "throughput_tps": completed / elapsed if elapsed else 0.0,
+        "operations": recorder.report(),
+    }
+
+
+def report_json(report: dict, path: str = None) -> str:
+    """Report as JSON, also written to `path` if given"""
+    data = json.dumps(report, indent=2)
+    if path:
+        with open(path, "w") as f:
+            f.write(data)
+    return data
+
+
+def test_run_scenario():
+    from .backends import MockBackend, MockContract
+    from .client import configure
+    from .common import Contract
+
+    assert(percentile([1, 2, 3, 4, 5], 50) == 3)
+    assert(percentile([1, 2, 3, 4, 5], 20) == 1 and percentile([1, 2, 3, 4, 5], 21) == 2)
+    assert(percentile([1, 2, 3, 4, 5], 0) == 1 and percentile([1, 2, 3, 4, 5], 100) == 5)
+    assert(percentile(list(range(1, 101)), 99) == 99 and percentile([], 50) is None)
+
+    class Counter(MockContract):
+        def instantiate(self, env, msg):
+            self.count = 0
+
+        def execute_increment(self, env):
+            self.count += 1
+
+        def execute_fail(self, env):
+            raise Exception("Nope")
+
+        def query_count(self, env):
+            return {"count": self.count}
+
+    mock = MockBackend()
+    mock.register_code("counter", Counter)
+    configure(client=mock)
+    wallets = list(mock.wallets.values())
+    counter = Contract("counter")
+    counter.instantiate(wallets[0], mock.store_code(wallets[0], "counter"), {})
+
+    scenario = Scenario("counter", counter, wallets[:4], tps=200, duration=0.5)
+    scenario.add_execute("increment", lambda wallet, i: {"increment": {}}, weight=2)
+    scenario.add_execute("fail", lambda wallet, i: {"fail": {}})
+    scenario.add_query("count", lambda wallet, i: {"count": {}})
+    report = run_scenario(scenario)
+
+    operations = report["operations"]
+    assert(report["submitted"] == 100 and sum(o["calls"] for o in operations.values()) == 100)
+    assert(set(operations) == {"execute_increment", "execute_fail", "query_count"})
+    assert(operations["execute_fail"]["failure_rate"] == 1.0)
+    assert(operations["execute_increment"]["failure_rate"] == 0.0)
+    assert(report["completed"] == 100 - operations["execute_fail"]["calls"])
+    assert(counter.query({"count": {}}) == {"count": operations["execute_increment"]["calls"]})
+    for label in ("execute_increment", "query_count"):
+        latency = operations[label]["latency_ms"]
+        assert(0 < latency["p50"] <= latency["p95"] <= latency["p99"])
+    assert(0 < report["throughput_tps"] and report["seconds"] >= 0.49)
+    json.loads(report_json(report))
+    configure()
+    print("[+] Test run scenario passed")
+
+
+if __name__ == "__main__":
+    test_run_scenario()
@@ -0,0 +1,71 @@
+"""
+terra_sdk wasm messages for both plain dicts and `slots` messages:
+- execute_message: a MsgExecuteContract
+- instantiate_message: a MsgInstantiateContract
+
+A `slots` message already knows its JSON (`to_json()`), its proto carries these bytes
+instead of a `json.dumps` of the dict rebuilt by `to_msg`.
+
+    execute = execute_message(sender.key.acc_address, token_address, Cw20.ExecuteMint("1000", bob))
+"""
+
+#============================ Imports ============================#
+
+from terra_sdk.core.wasm import MsgExecuteContract
+from terra_sdk.core.wasm import MsgInstantiateContract
+from terra_sdk.core.coins import Coins
+
+#============================ Precompiled messages ============================#
+
+
+class PrecompiledExecuteContract(MsgExecuteContract):
+    """
+    I'm a MsgExecuteContract of a `slots` message, my proto holds `raw_msg`.
+    `execute_msg` is still a dict for the amino and JSON views of the tx.
+    """
+
+    def __init__(self, sender: str, contract: str, msg, coins: Coins = None) -> None:
+        super().__init__(sender=sender, contract=contract, execute_msg=msg.to_dict(), coins=coins)
+        self.raw_msg = msg.to_json()
+
+    def to_proto(self):
+        # Nothing to serialize, the bytes are set right after
+        execute_msg, self.execute_msg = self.execute_msg, {}
+        try:
+            proto = super().to_proto()
+        finally:
+            self.execute_msg = execute_msg
+        proto.execute_msg = self.raw_msg
+        return proto
+
+
+class PrecompiledInstantiateContract(MsgInstantiateContract):
+    """
+    I'm a MsgInstantiateContract of a `slots` message, my proto holds `raw_msg`.
+    """
+
+    def __init__(self, sender: str, admin: str, code_id: str, msg, init_coins: Coins = None) -> None:
+        super().__init__(sender=sender, admin=admin, code_id=code_id, init_msg=msg.to_dict(), init_coins=init_coins)
+        self.raw_msg = msg.to_json()
+
+    def to_proto(self):
+        init_msg, self.init_msg = self.init_msg, {}
+        try:
+            proto = super().to_proto()
+        finally:
+            self.init_msg = init_msg
+        proto.init_msg = self.raw_msg
+        return proto
+
+
+def execute_message(sender: str, contract: str, execute_msg, coins: Coins = None) -> MsgExecuteContract:
+    if hasattr(execute_msg, "to_json"):
+        return PrecompiledExecuteContract(sender, contract, execute_msg, coins)
+    return MsgExecuteContract(sender=sender, contract=contract, execute_msg=execute_msg, coins=coins)
+
+
+def instantiate_message(sender: str, code_id: str, init_msg) -> MsgInstantiateContract:
+    # Admin must be deployer or tx returns Unauthorized
+    if hasattr(init_msg, "to_json"):
+        return PrecompiledInstantiateContract(sender, sender, code_id, init_msg)
+    return MsgInstantiateContract(sender=sender, admin=sender, code_id=code_id, init_msg=init_msg)
@@ -0,0 +1,262 @@
+"""
+Executes spread over many signers, when it doesn't matter who sends them:
+- WalletPool: schedules messages over its wallets, keeps their fee balance up, returns futures
+
+    pool = WalletPool(list(terra.wallets.values())[1:], funder=terra.wallets["test1"])
+    futures = [pool.submit(token_contract, Cw20.execute_mint("1", alice.key.acc_address)) for _ in range(1000)]
+    results = [f.result() for f in futures]
+    pool.shutdown()
+
+Each wallet sends its txs one after the other (sequence ordering),
+so throughput grows with the number of wallets.
+"""
+
+#============================ Imports ============================#
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+import threading
+from .client import get_terra
+from .common import execute_contract, send
+from .backends import is_backend, parse_coins
+import chalk
+
+#============================ Wallet pool ============================#
+
+STRATEGIES = ("round_robin", "least_in_flight")
+
+
+def check_result(result, action: str):
+    """Raises when the tx failed, so the future carries the error"""
+    if result is None:
+        raise Exception(f"Error {action}: no result")
+    if getattr(result, "code", None):
+        raise Exception(f"Error {action}: {getattr(result, 'raw_log', result)}")
+    return result
+
+
+class WalletPool():
+    """
+    I own a single thread executor per wallet, and pick the wallet of each message:
+    - `round_robin`: one after the other
+    - `least_in_flight`: the one with the fewest queued or running messages
+    Every `check_every` messages, a wallet's balance is checked before sending; below
+    `min_balance`, `funder` sends it `top_up`. Both default to the denom fees are paid in,
+    the first of the client's gas prices. Backends don't charge fees, no check there.
+    The funder can't be one of my wallets, its sequence would be used by two threads.
+    A failed tx raises, its future holds the exception.
+    """
+
+    def __init__(self, wallets: List, strategy: str = "least_in_flight", funder=None,
+                 min_balance: str = None, top_up: str = None, check_every: int = 50) -> None:
+        if not wallets:
+            raise Exception("WalletPool needs wallets")
+        if strategy not in STRATEGIES:
+            raise Exception(f"Unknown strategy {strategy}, expected one of {STRATEGIES}")
+        if funder is not None and any(w.key.acc_address == funder.key.acc_address for w in wallets):
+            raise Exception(f"Funder {funder.key.acc_address} is one of the pool's wallets")
+        self.wallets = wallets
+        self.strategy = strategy
+        self.funder = funder
+        self.min_balance = parse_coins(min_balance) if min_balance else None
+        self.top_up = top_up
+        self.check_every = check_every
+        self.executors = [ThreadPoolExecutor(max_workers=1) for _ in wallets]
+        self.in_flight = [0] * len(wallets)
+        self.sent = [0] * len(wallets)
+        self.top_ups = 0
+        self.next_index = 0
+        self.lock = threading.Lock()
+        self.funder_lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+        return False
+
+    def pick(self) -> int:
+        with self.lock:
+            if self.strategy == "round_robin":
+                index = self.next_index
+                self.next_index = (index + 1) % len(self.wallets)
+            else:
+                index = min(range(len(self.wallets)), key=lambda i: self.in_flight[i])
+            self.in_flight[index] += 1
+            return index
+
+    def submit(self, contract, execute_msg, coins=None) -> Future:
+        """
+        Queue an execute on `contract` (a Contract or an address), returns the future of its result.
+        A Contract executes it itself (validation, cache), except with `coins` that it doesn't take.
+        """
+        index = self.pick()
+        return self.executors[index].submit(self._execute, index, contract, execute_msg, coins)
+
+    def submit_send(self, to_address: str, amount=None) -> Future:
+        index = self.pick()
+        return self.executors[index].submit(self._send, index, to_address, amount)
+
+    def _execute(self, index: int, contract, execute_msg, coins):
+        try:
+            wallet = self._prepare(index)
+            if hasattr(contract, "execute") and coins is None:
+                result = contract.execute(wallet, execute_msg)
+            else:
+                result = execute_contract(get_terra(), wallet, getattr(contract, "address", contract), execute_msg, coins)
+            return check_result(result, f"executing {execute_msg}")
+        finally:
+            self._done(index)
+
+    def _send(self, index: int, to_address: str, amount):
+        try:
+            result = send(get_terra(), self._prepare(index), to_address, amount)
+            return check_result(result, f"sending {amount} to {to_address}")
+        finally:
+            self._done(index)
+
+    def _done(self, index: int) -> None:
+        with self.lock:
+            self.in_flight[index] -= 1
+            self.sent[index] += 1
+
+    def _prepare(self, index: int):
+        wallet = self.wallets[index]
+        if self.funder is not None and self.sent[index] % self.check_every == 0:
+            self.ensure_balance(wallet)
+        return wallet
+
+    def balance(self, address: str) -> Dict[str, int]:
+        terra = get_terra()
+        result = terra.bank.balance(address)
+        # terra_sdk 2 returns (Coins, pagination)
+        coins = result[0] if isinstance(result, tuple) else result
+        return parse_coins(coins)
+
+    def ensure_balance(self, wallet) -> None:
+        """Tops `wallet` up from the funder when under `min_balance`"""
+        if is_backend(get_terra()):
+            return
+        if self.min_balance is None or self.top_up is None:
+            self.default_amounts()
+        balance = self.balance(wallet.key.acc_address)
+        if all(balance.get(denom, 0) >= amount for denom, amount in self.min_balance.items()):
+            return
+        # The funder is shared by every wallet thread
+        with self.funder_lock:
+            check_result(send(get_terra(), self.funder, wallet.key.acc_address, self.top_up),
+                         f"topping up {wallet.key.acc_address}")
+            self.top_ups += 1
+        print(chalk.yellow(f"[~] Topped up {wallet.key.acc_address} with {self.top_up}"))
+
+    def default_amounts(self) -> None:
+        """`min_balance` and `top_up` not given, in the fee denom of the client"""
+        gas_prices = get_terra().gas_prices
+        denoms = gas_prices.denoms() if hasattr(gas_prices, "denoms") else list(parse_coins(gas_prices))
+        if not denoms:
+            raise Exception("No gas prices to pick the fee denom from, give min_balance and top_up")
+        with self.lock:
+            if self.min_balance is None:
+                self.min_balance = {denoms[0]: 1_000_000}
+            if self.top_up is None:
+                self.top_up = f"10000000{denoms[0]}"
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "wallets": len(self.wallets),
+                "strategy": self.strategy,
+                "sent": sum(self.sent),
+                "in_flight": sum(self.in_flight),
+                "per_wallet": {w.key.acc_address: n for w, n in zip(self.wallets, self.sent)},
+                "top_ups": self.top_ups,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        for executor in self.executors:
+            executor.shutdown(wait=wait)
+
+
+def test_wallet_pool():
+    import time
+    from .backends import MockBackend, MockContract
+    from .client import configure
+    from .common import Contract
+
+    class Counter(MockContract):
+        def instantiate(self, env, msg):
+            self.count = 0
+            self.senders = set()
+
+        def execute_increment(self, env):
+            self.count += 1
+            self.senders.add(env.sender)
+
+        def execute_fail(self, env):
+            raise Exception("Nope")
+
+        def query_count(self, env):
+            return {"count": self.count, "senders": len(self.senders)}
+
+    mock = MockBackend()
+    mock.register_code("counter", Counter)
+    configure(client=mock)
+    wallets = list(mock.wallets.values())
+    counter = Contract("counter")
+    counter.instantiate(wallets[0], mock.store_code(wallets[0], "counter"), {})
+
+    for strategy in STRATEGIES:
+        with WalletPool(wallets, strategy=strategy) as pool:
+            futures = [pool.submit(counter, {"increment": {}}) for _ in range(1000)]
+            assert(all(not f.result().code for f in futures))
+            stats = pool.stats()
+        assert(stats["sent"] == 1000 and stats["in_flight"] == 0)
+        assert(all(n > 0 for n in stats["per_wallet"].values()))
+    assert(counter.query({"count": {}}) == {"count": 2000, "senders": 10})
+
+    # Failures are raised through the future
+    with WalletPool(wallets) as pool:
+        future = pool.submit(counter, {"fail": {}})
+        assert(isinstance(future.exception(), Exception))
+    try:
+        WalletPool(wallets[1:], funder=wallets[1])
+        assert(False)
+    except Exception as e:
+        assert("Funder" in str(e))
+
+    # A slow wallet gets less work with least_in_flight
+    slow = wallets[0]
+    original = mock.execute
+
+    def execute(sender, *args, **kwargs):
+        if sender is slow:
+            time.sleep(0.01)
+        return original(sender, *args, **kwargs)
+    mock.execute = execute
+    with WalletPool(wallets[:2], strategy="least_in_flight") as pool:
+        futures = []
+        for _ in range(200):
+            futures.append(pool.submit(counter, {"increment": {}}))
+            time.sleep(0.001)
+        for f in futures:
+            f.result()
+        per_wallet = pool.stats()["per_wallet"]
+    assert(per_wallet[slow.key.acc_address] < per_wallet[wallets[1].key.acc_address])
+
+    # Top ups default to the denom of the gas prices
+    class Client():
+        gas_prices = "0.15uusd"
+    configure(client=Client())
+    with WalletPool(wallets[1:], funder=wallets[0]) as pool:
+        pool.default_amounts()
+        assert(pool.min_balance == {"uusd": 1_000_000} and pool.top_up == "10000000uusd")
+    with WalletPool(wallets[1:], funder=wallets[0], min_balance="5uluna", top_up="50uluna") as pool:
+        pool.default_amounts()
+        assert(pool.min_balance == {"uluna": 5} and pool.top_up == "50uluna")
+    configure()
+    print("[+] Test wallet pool passed")
+
+
+if __name__ == "__main__":
+    test_wallet_pool()
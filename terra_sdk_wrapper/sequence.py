@@ -0,0 +1,182 @@
+"""
+Local account sequence handling, to push many transactions per block with one wallet:
+- SequenceManager: signs with a locally incremented sequence and broadcasts without waiting
+- sequence_manager: one shared manager per wallet
+
+    manager = sequence_manager(deployer)
+    for wallet in wallets:
+        manager.execute(token_contract.address, Cw20.execute_mint("1000", wallet.key.acc_address))
+"""
+
+#============================ Imports ============================#
+
+from typing import Dict, List
+import threading
+from terra_sdk.client.localterra import Wallet
+from terra_sdk.client.lcd.api.tx import CreateTxOptions, SignerOptions
+from terra_sdk.key.key import SignOptions
+from terra_sdk.core.tx import SignMode
+from terra_sdk.core.fee import Fee
+from terra_sdk.core.bank import MsgSend
+from terra_sdk.core.coins import Coins
+from .messages import execute_message
+import chalk
+
+#============================ Sequence manager ============================#
+
+BROADCAST_MODES = ("sync", "async", "block")
+
+
+def is_sequence_mismatch(result) -> bool:
+    """Cosmos SDK returns `account sequence mismatch, expected X, got Y` (code 32)"""
+    raw_log = getattr(result, "raw_log", None) or str(result)
+    return "account sequence mismatch" in raw_log or "incorrect account sequence" in raw_log
+
+
+def is_check_tx_failure(result, mode: str) -> bool:
+    """
+    Rejected before the mempool, the sequence isn't used: any error in `sync` mode,
+    an error without height in `block` mode. `async` doesn't wait for CheckTx.
+    """
+    if isinstance(result, Exception) or not getattr(result, "code", None):
+        return False
+    return mode == "sync" or (mode == "block" and not int(getattr(result, "height", 0) or 0))
+
+
+class SequenceManager():
+    """
+    I keep the account number and sequence of a wallet in memory.
+    They are fetched once from the LCD, then every signed tx takes the next sequence.
+    If the node answers with a sequence mismatch (another process used the wallet,
+    or a tx was rejected by CheckTx), I resync from the LCD and sign again.
+    A tx rejected by CheckTx for another reason gives its sequence back.
+    Simulations run outside of my lock, other txs are signed meanwhile.
+    """
+
+    def __init__(self, wallet: Wallet) -> None:
+        self.wallet = wallet
+        self.account_number: int = None
+        self.sequence: int = None
+        self.lock = threading.Lock()
+
+    def sync(self) -> None:
+        """Fetch account number and sequence from the LCD"""
+        with self.lock:
+            self._sync()
+
+    def _sync(self) -> None:
+        info = self.wallet.account_number_and_sequence()
+        self.account_number = int(info["account_number"])
+        self.sequence = int(info["sequence"])
+
+    def estimate_fee(self, msgs: List, memo: str = None, gas_adjustment: float = 1.5) -> Fee:
+        """Simulate `msgs` at the next local sequence, without holding the lock"""
+        with self.lock:
+            if self.sequence is None:
+                self._sync()
+            account_number, sequence = self.account_number, self.sequence
+        options = CreateTxOptions(msgs=msgs, memo=memo, gas_adjustment=gas_adjustment,
+                                  account_number=account_number, sequence=sequence)
+        return self.wallet.lcd.tx.estimate_fee(
+            [SignerOptions(address=self.wallet.key.acc_address,
+                           sequence=sequence, public_key=self.wallet.key.public_key)],
+            options
+        )
+
+    def sign(self, msgs: List, fee: Fee = None, memo: str = None, gas_adjustment: float = 1.5):
+        """
+        Sign `msgs` with the next local sequence.
+        With a `fee`, no request is made to the LCD at all, otherwise the tx is simulated first.
+        """
+        return self._sign(msgs, fee, memo, gas_adjustment)[0]
+
+    def _sign(self, msgs: List, fee: Fee = None, memo: str = None, gas_adjustment: float = 1.5):
+        """The signed tx and its sequence"""
+        if fee is None:
+            fee = self.estimate_fee(msgs, memo, gas_adjustment)
+        with self.lock:
+            if self.sequence is None:
+                self._sync()
+            sequence = self.sequence
+            options = CreateTxOptions(msgs=msgs, fee=fee, memo=memo, gas_adjustment=gas_adjustment,
+                                      account_number=self.account_number, sequence=sequence)
+            tx = self.wallet.lcd.tx.create(
+                [SignerOptions(address=self.wallet.key.acc_address,
+                               sequence=sequence, public_key=self.wallet.key.public_key)],
+                options
+            )
+            tx = self.wallet.key.sign_tx(
+                tx=tx,
+                options=SignOptions(
+                    account_number=self.account_number,
+                    sequence=sequence,
+                    chain_id=self.wallet.lcd.chain_id,
+                    sign_mode=SignMode.SIGN_MODE_DIRECT,
+                )
+            )
+            # Only consume the sequence once the tx is signed
+            self.sequence = sequence + 1
+            return tx, sequence
+
+    def release(self, sequence: int) -> None:
+        """The tx of `sequence` never made it to the mempool"""
+        with self.lock:
+            if self.sequence == sequence + 1:
+                self.sequence = sequence
+            else:
+                # Later txs were signed over the gap, they fail with a mismatch: start over
+                self.sequence = None
+
+    def broadcast(self, msgs: List, mode: str = "sync", fee: Fee = None, memo: str = None, retries: int = 1):
+        """
+        Sign and broadcast `msgs`.
+        `sync` returns after CheckTx, `async` right away and `block` after inclusion.
+        """
+        if mode not in BROADCAST_MODES:
+            raise Exception(f"Unknown broadcast mode {mode}, expected one of {BROADCAST_MODES}")
+        tx, sequence = self._sign(msgs, fee, memo)
+        try:
+            result = self._broadcast(tx, mode)
+        except Exception as e:
+            if not is_sequence_mismatch(e) or retries <= 0:
+                raise e
+            result = e
+        if is_sequence_mismatch(result) and retries > 0:
+            print(chalk.yellow(f"[~] Sequence mismatch for {self.wallet.key.acc_address}, resyncing"))
+            self.sync()
+            return self.broadcast(msgs, mode, fee, memo, retries - 1)
+        if is_check_tx_failure(result, mode) and not is_sequence_mismatch(result):
+            self.release(sequence)
+        return result
+
+    def _broadcast(self, tx, mode: str):
+        tx_api = self.wallet.lcd.tx
+        if mode == "sync":
+            return tx_api.broadcast_sync(tx)
+        if mode == "async":
+            return tx_api.broadcast_async(tx)
+        return tx_api.broadcast(tx)
+
+    def execute(self, contract_address: str, execute_msg: dict, coins: Coins = None, mode: str = "sync", fee: Fee = None):
+        """Execute a message without waiting for the block"""
+        execute = execute_message(self.wallet.key.acc_address, contract_address, execute_msg, coins)
+        return self.broadcast([execute], mode, fee)
+
+    def send(self, to_address: str, amount=None, mode: str = "sync", fee: Fee = None):
+        """Send coins without waiting for the block"""
+        send_msg = MsgSend(from_address=self.wallet.key.acc_address,
+                           to_address=to_address, amount=amount)
+        return self.broadcast([send_msg], mode, fee)
+
+
+_managers: Dict[str, SequenceManager] = {}
+_managers_lock = threading.Lock()
+
+
+def sequence_manager(wallet: Wallet) -> SequenceManager:
+    """Returns the shared SequenceManager of `wallet`"""
+    address = wallet.key.acc_address
+    with _managers_lock:
+        if address not in _managers:
+            _managers[address] = SequenceManager(wallet)
+        return _managers[address]
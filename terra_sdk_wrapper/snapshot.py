@@ -0,0 +1,301 @@
+"""
+Snapshots of the state of several contracts, to compare them between two steps of an audit:
+- Snapshot: what to capture (queries, paginated queries, queries per item, raw state), captured concurrently
+- read_snapshot: iterates a snapshot file
+- diff_snapshots: what changed between two snapshot files, read side by side
+
+    snapshot = Snapshot()
+    snapshot.add_generated(token_contract, Cw20)  # every query without parameter, paginated ones walked
+    snapshot.add_fan_out(token_contract, "balance", "all_accounts", lambda address: Cw20.query_balance(address))
+    snapshot.capture("snapshots/step1.jsonl.gz")
+    ...
+    for change in diff_snapshots("snapshots/step1.jsonl.gz", "snapshots/step2.jsonl.gz"):
+        print(change)  # ('changed', 'token', 'balance', 'terra1...', {'balance': '10'}, {'balance': '0'})
+
+A snapshot is one compact JSON row `[contract, query, key, value]` per line, sorted,
+so two snapshots are diffed in one pass without loading them.
+Contracts are told apart by their `name`.
+"""
+
+#============================ Imports ============================#
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple
+import base64
+import gzip
+import inspect
+import json
+import os
+import threading
+import urllib.parse
+import urllib.request
+
+#============================ Raw state ============================#
+
+
+def raw_state(lcd_url: str, contract_address: str, page_size: int = 100) -> Iterator[Tuple[str, object]]:
+    """
+    Every (hex key, value) stored by the contract, through the wasmd LCD endpoint.
+    Values are decoded as JSON when they are, left in base64 otherwise.
+    """
+    next_key = None
+    while True:
+        params = {"pagination.limit": page_size}
+        if next_key:
+            params["pagination.key"] = next_key
+        url = f"{lcd_url.rstrip('/')}/cosmwasm/wasm/v1/contract/{contract_address}/state?{urllib.parse.urlencode(params)}"
+        with urllib.request.urlopen(url) as response:
+            page = json.load(response)
+        for model in page.get("models", []):
+            yield model["key"], decode_raw_value(model["value"])
+        next_key = (page.get("pagination") or {}).get("next_key")
+        if not next_key:
+            return
+
+
+def decode_raw_value(value: str):
+    raw = base64.b64decode(value)
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return value
+
+#============================ Snapshot ============================#
+
+
+def list_field(response: dict) -> str:
+    """The items of a paginated response: its only list field"""
+    fields = [k for k, v in response.items() if isinstance(v, list)]
+    if len(fields) != 1:
+        raise Exception(f"Can't tell the items of {list(response)}, give `items_key`")
+    return fields[0]
+
+
+def item_cursor(item, cursor) -> str:
+    if callable(cursor):
+        return cursor(item)
+    if cursor is not None:
+        return item[cursor]
+    if isinstance(item, str):
+        return item
+    raise Exception(f"Can't tell the cursor of {item}, give `cursor`")
+
+
+class Snapshot():
+    """
+    I capture a list of queries over several contracts:
+    - plain queries, one row each
+    - paginated queries (`start_after` / `limit`), walked page by page, one row per item
+    - fan-out queries, one per item of a paginated query (eg. the balance of every account)
+    - raw state, one row per stored key
+    Plain, paginated and raw walks run concurrently, then all the fan-out queries.
+    """
+
+    def __init__(self, workers: int = 16, page_size: int = 30) -> None:
+        self.workers = workers
+        self.page_size = page_size
+        self.queries: List[Tuple] = []
+        self.paginated: List[Tuple] = []
+        self.fan_outs: List[Tuple] = []
+        self.raw: List[Tuple] = []
+
+    def add_query(self, contract, name: str, msg) -> None:
+        self.queries.append((contract, name, msg))
+
+    def add_paginated(self, contract, name: str, build: Callable, items_key: str = None, cursor=None) -> None:
+        """`build(start_after, limit)` returns the query msg, `cursor` is the item field to start after"""
+        self.paginated.append((contract, name, build, items_key, cursor))
+
+    def add_fan_out(self, contract, name: str, source: str, build: Callable) -> None:
+        """`build(key)` returns the query msg for each item key of the paginated query `source`"""
+        self.fan_outs.append((contract, name, source, build))
+
+    def add_raw_state(self, contract, lcd_url: str = None) -> None:
+        self.raw.append((contract, lcd_url))
+
+    def add_generated(self, contract, msg_class) -> None:
+        """
+        Every `query_*` of a schema_to_class generated class: without required parameter
+        it is a plain query, with only `start_after` and `limit` it is walked.
+        """
+        for attribute, method in vars(msg_class).items():
+            if not attribute.startswith("query_") or not callable(method):
+                continue
+            name = attribute[len("query_"):]
+            parameters = inspect.signature(method).parameters
+            required = [p for p in parameters.values() if p.default is inspect.Parameter.empty]
+            if not required and {"start_after", "limit"} <= set(parameters):
+                self.add_paginated(contract, name,
+                                   lambda start_after, limit, method=method: method(start_after=start_after, limit=limit))
+            elif not required:
+                self.add_query(contract, name, method())
+
+    def _query(self, contract, msg):
+        return contract.query(msg)
+
+    def _walk(self, contract, name: str, build: Callable, items_key: str, cursor) -> List[Tuple]:
+        rows = []
+        start_after = None
+        while True:
+            response = self._query(contract, build(start_after, self.page_size))
+            items = response[items_key or list_field(response)]
+            for item in items:
+                rows.append((contract.name, name, str(item_cursor(item, cursor)), item))
+            # Contracts cap `limit` (often at 30), a short page isn't the last one
+            if not items or item_cursor(items[-1], cursor) == start_after:
+                return rows
+            start_after = item_cursor(items[-1], cursor)
+
+    def _raw(self, contract, lcd_url: str) -> List[Tuple]:
+        if lcd_url is None:
+            from .client import get_terra
+            lcd_url = get_terra().url
+        return [(contract.name, "raw", key, value) for key, value in raw_state(lcd_url, contract.address)]
+
+    def rows(self) -> List[Tuple]:
+        """Captures everything, returns the sorted rows"""
+        rows: List[Tuple] = []
+        keys: Dict[Tuple[str, str], List[str]] = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            plain = [(c, name, executor.submit(self._query, c, msg)) for c, name, msg in self.queries]
+            walks = [(c, name, executor.submit(self._walk, c, name, build, items_key, cursor))
+                     for c, name, build, items_key, cursor in self.paginated]
+            raws = [executor.submit(self._raw, c, lcd_url) for c, lcd_url in self.raw]
+            for c, name, future in plain:
+                rows.append((c.name, name, "", future.result()))
+            for c, name, future in walks:
+                walked = future.result()
+                keys[(c.name, name)] = [key for _, _, key, _ in walked]
+                rows.extend(walked)
+            for future in raws:
+                rows.extend(future.result())
+
+            fanned = []
+            for c, name, source, build in self.fan_outs:
+                if (c.name, source) not in keys:
+                    raise Exception(f"Fan-out {name} needs the paginated query {source} of {c.name}")
+                for key in keys[(c.name, source)]:
+                    fanned.append((c.name, name, key, executor.submit(self._query, c, build(key))))
+            for contract_name, name, key, future in fanned:
+                rows.append((contract_name, name, key, future.result()))
+
+        rows.sort(key=lambda row: row[:3])
+        return rows
+
+    def capture(self, path: str) -> int:
+        """Writes the snapshot to `path` (gzipped if it ends with .gz), returns the row count"""
+        rows = self.rows()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open_snapshot(path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row, separators=(",", ":"), sort_keys=True) + "\n")
+        return len(rows)
+
+#============================ Reading and diffing ============================#
+
+
+def open_snapshot(path: str, mode: str = "r"):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t")
+    return open(path, mode)
+
+
+def read_snapshot(path: str) -> Iterator[Tuple]:
+    """Rows (contract, query, key, value) in file order, one at a time"""
+    with open_snapshot(path) as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def diff_snapshots(before_path: str, after_path: str) -> Iterator[Tuple]:
+    """
+    Yields (change, contract, query, key, before, after), change being
+    'added', 'removed' or 'changed'. Both files are read side by side, as they are sorted.
+    """
+    before_rows = read_snapshot(before_path)
+    after_rows = read_snapshot(after_path)
+    before = next(before_rows, None)
+    after = next(after_rows, None)
+    while before is not None or after is not None:
+        if after is None or (before is not None and before[:3] < after[:3]):
+            yield ("removed", *before[:3], before[3], None)
+            before = next(before_rows, None)
+        elif before is None or after[:3] < before[:3]:
+            yield ("added", *after[:3], None, after[3])
+            after = next(after_rows, None)
+        else:
+            if before[3] != after[3]:
+                yield ("changed", *before[:3], before[3], after[3])
+            before = next(before_rows, None)
+            after = next(after_rows, None)
+
+
+def test_snapshot_diff():
+    import tempfile
+
+    class Token():
+        def query_token_info():
+            return {"token_info": {}}
+
+        def query_all_accounts(limit: int = None, start_after: str = None):
+            return {"all_accounts": {"limit": limit, "start_after": start_after}}
+
+        def query_balance(address: str):
+            return {"balance": {"address": address}}
+
+    class FakeToken():
+        name = "token"
+        address = "terra1token"
+
+        def __init__(self, balances: dict, max_limit: int = 30) -> None:
+            self.balances = balances
+            self.max_limit = max_limit
+            self.calls = 0
+            self.lock = threading.Lock()
+
+        def query(self, msg):
+            with self.lock:
+                self.calls += 1
+            variant, params = next(iter(msg.items()))
+            if variant == "token_info":
+                return {"name": "Token", "total_supply": str(sum(self.balances.values()))}
+            if variant == "all_accounts":
+                accounts = sorted(a for a in self.balances if params["start_after"] is None or a > params["start_after"])
+                return {"accounts": accounts[:min(params["limit"], self.max_limit)]}
+            return {"balance": str(self.balances.get(params["address"], 0))}
+
+    def capture(balances: dict, path: str, max_limit: int = 30) -> int:
+        snapshot = Snapshot(page_size=30)
+        contract = FakeToken(balances, max_limit)
+        snapshot.add_generated(contract, Token)
+        snapshot.add_fan_out(contract, "balance", "all_accounts", Token.query_balance)
+        return snapshot.capture(path), contract.calls
+
+    balances = {f"terra1account{i:03}": i for i in range(100)}
+    with tempfile.TemporaryDirectory() as directory:
+        before, after = os.path.join(directory, "before.jsonl.gz"), os.path.join(directory, "after.jsonl")
+        rows, calls = capture(balances, before)
+        # token_info, 100 accounts, 100 balances / 4 pages and an empty one + 1 info + 100 balances
+        assert(rows == 201 and calls == 106)
+        # A contract capping `limit` below the page size is still walked to the end
+        assert(capture(balances, os.path.join(directory, "capped.jsonl"), max_limit=7) == (201, 117))
+        balances["terra1account005"] = 0
+        del balances["terra1account010"]
+        balances["terra1account100"] = 7
+        capture(balances, after)
+        changes = {(change, query, key) for change, _, query, key, _, _ in diff_snapshots(before, after)}
+        assert(changes == {
+            ("changed", "balance", "terra1account005"),
+            ("removed", "balance", "terra1account010"),
+            ("removed", "all_accounts", "terra1account010"),
+            ("added", "balance", "terra1account100"),
+            ("added", "all_accounts", "terra1account100"),
+            ("changed", "token_info", ""),
+        })
+    print("[+] Test snapshot diff passed")
+
+
+if __name__ == "__main__":
+    test_snapshot_diff()
@@ -0,0 +1,301 @@
+"""
+A local index of every tx the wrapper broadcasts, in SQLite:
+- TxIndex: an `instrument` sink writing the broadcasts (and failed simulations) in batches
+
+    index = add_sink(TxIndex(".txindex.sqlite"))
+    token.execute(deployer, Cw20.execute_mint("1000", bob.key.acc_address))
+    ...
+    index.flush()
+    index.find(contract=token.address, variant="mint", ok=False)
+    # [{'txhash': '...', 'height': 1234, 'sender': 'terra1...', 'error': 'Unauthorized', 'events': [...], ...}]
+
+Rows are queued by the calling thread and written by a background thread,
+one transaction per batch. Contract, variant, sender, height and failures are indexed.
+"""
+
+import json
+import queue
+import sqlite3
+import threading
+from typing import List
+import chalk
+
+#============================ Schema ============================#
+
+COLUMNS = ("txhash", "height", "time", "sender", "contract", "variant", "phase",
+           "ok", "gas_wanted", "gas_used", "seconds", "error", "events")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS txs (
+    id INTEGER PRIMARY KEY,
+    txhash TEXT,
+    height INTEGER,
+    time REAL,
+    sender TEXT,
+    contract TEXT,
+    variant TEXT,
+    phase TEXT,
+    ok INTEGER,
+    gas_wanted INTEGER,
+    gas_used INTEGER,
+    seconds REAL,
+    error TEXT,
+    events TEXT
+);
+CREATE INDEX IF NOT EXISTS txs_contract_variant ON txs (contract, variant, height);
+CREATE INDEX IF NOT EXISTS txs_variant ON txs (variant, height);
+CREATE INDEX IF NOT EXISTS txs_height ON txs (height);
+CREATE INDEX IF NOT EXISTS txs_sender ON txs (sender, height);
+CREATE INDEX IF NOT EXISTS txs_txhash ON txs (txhash);
+CREATE INDEX IF NOT EXISTS txs_failed ON txs (contract, variant, height) WHERE ok = 0;
+"""
+
+# Filters of `find` and `count`: name -> SQL condition
+FILTERS = {
+    "contract": "contract = ?",
+    "variant": "variant = ?",
+    "sender": "sender = ?",
+    "txhash": "txhash = ?",
+    "ok": "ok = ?",  # inlined by `_where`
+    "since": "height >= ?",
+    "until": "height <= ?",
+}
+
+#============================ Index ============================#
+
+
+class TxIndex():
+    """
+    I'm a sink (see `instrument.add_sink`) keeping the broadcast records, and the simulations
+    that failed (no tx hash then). `emit` only queues a row, a writer thread inserts them
+    by `batch_size`, or every `flush_every` seconds. `flush` waits for the queued rows.
+    """
+
+    def __init__(self, path: str = ".txindex.sqlite", batch_size: int = 1000, flush_every: float = 1.0) -> None:
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.queue = queue.Queue()
+        self.written = 0
+        self.dropped = 0
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self.read_lock = threading.Lock()
+        self.reader = self.connect()
+        self.closed = False
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    def connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        # Readers don't block the writer
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def emit(self, record: dict) -> None:
+        phase = record["phase"]
+        if phase != "broadcast" and (phase != "simulate" or record["ok"]):
+            return
+        # Rows are built here, encoded by the writer
+        self.queue.put(tuple(record.get(column) for column in COLUMNS))
+
+    def _write_loop(self) -> None:
+        connection = self.connect()
+        stop = False
+        while not stop:
+            try:
+                rows = [self.queue.get(timeout=self.flush_every)]
+            except queue.Empty:
+                continue
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            # None is the closing mark
+            if None in rows:
+                stop = True
+                marks = rows.count(None)
+                rows = [row for row in rows if row is not None]
+            else:
+                marks = 0
+            self._insert(connection, rows)
+            for _ in range(len(rows) + marks):
+                self.queue.task_done()
+        connection.close()
+
+    def _insert(self, connection: sqlite3.Connection, rows: List[tuple]) -> None:
+        if not rows:
+            return
+        events_at = COLUMNS.index("events")
+        ok_at = COLUMNS.index("ok")
+        try:
+            encoded = []
+            for row in rows:
+                row = list(row)
+                row[ok_at] = int(bool(row[ok_at]))
+                if row[events_at] is not None:
+                    row[events_at] = json.dumps(row[events_at], separators=(",", ":"))
+                encoded.append(row)
+            with connection:
+                connection.executemany(
+                    f"INSERT INTO txs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", encoded)
+            self.written += len(rows)
+        except Exception as e:
+            # The index must never break the calls it records, nor its writer stop
+            self.dropped += len(rows)
+            print(chalk.red(f"[!] TxIndex dropped {len(rows)} rows: {e}"))
+
+    def flush(self) -> None:
+        """Returns once every queued row is written"""
+        self.queue.join()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join()
+        self.reader.close()
+
+    def _where(self, filters: dict):
+        conditions, values = [], []
+        for name, value in filters.items():
+            if value is None:
+                continue
+            if name not in FILTERS:
+                raise Exception(f"Unknown filter {name}, expected one of {list(FILTERS)}")
+            if name == "ok":
+                # A literal, so that failures use the partial index
+                conditions.append(f"ok = {int(bool(value))}")
+                continue
+            conditions.append(FILTERS[name])
+            values.append(value)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), values
+
+    def find(self, limit: int = None, newest_first: bool = True, **filters) -> List[dict]:
+        """
+        Rows matching every filter: contract, variant, sender, txhash, ok, since / until (heights).
+        Queued rows are only seen once written, `flush` first to see everything.
+        """
+        where, values = self._where(filters)
+        sql = f"SELECT {', '.join(COLUMNS)} FROM txs{where} ORDER BY id {'DESC' if newest_first else 'ASC'}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            values.append(limit)
+        with self.read_lock:
+            rows = self.reader.execute(sql, values).fetchall()
+        found = []
+        for row in rows:
+            found.append(dict(zip(COLUMNS, row)))
+            found[-1]["ok"] = bool(found[-1]["ok"])
+            if found[-1]["events"] is not None:
+                found[-1]["events"] = json.loads(found[-1]["events"])
+        return found
+
+    def count(self, **filters) -> int:
+        where, values = self._where(filters)
+        with self.read_lock:
+            return self.reader.execute(f"SELECT COUNT(*) FROM txs{where}", values).fetchone()[0]
+
+    def failures(self, contract: str = None) -> dict:
+        """Failed txs per (contract, variant, error)"""
+        where, values = self._where({"contract": contract, "ok": False})
+        sql = f"SELECT contract, variant, error, COUNT(*) FROM txs{where} GROUP BY contract, variant, error"
+        with self.read_lock:
+            return {(c, v, e): n for c, v, e, n in self.reader.execute(sql, values)}
+
+
+def test_tx_index():
+    import os
+    import tempfile
+    import time
+    path = os.path.join(tempfile.mkdtemp(), "txindex.sqlite")
+    contracts = [f"terra1contract{i}" for i in range(10)]
+    with TxIndex(path, batch_size=5000) as index:
+        start = time.perf_counter()
+        for i in range(200_000):
+            index.emit({"phase": "broadcast", "contract": contracts[i % 10], "variant": ("mint", "transfer")[i % 2],
+                        "ok": i % 97 != 0, "seconds": 0.01, "time": 0.0, "txhash": f"{i:064X}", "height": i,
+                        "sender": "terra1sender", "gas_used": 100, "events": [{"wasm": {"action": ["mint"]}}],
+                        "error": None if i % 97 else "Unauthorized"})
+        emitted = time.perf_counter() - start
+        index.emit({"phase": "sign", "ok": False})
+        index.emit({"phase": "simulate", "contract": contracts[0], "variant": "mint", "ok": False,
+                    "error": "out of gas", "sender": "terra1sender"})
+        index.flush()
+        assert(index.written == 200_001 and index.count() == 200_001)
+
+        start = time.perf_counter()
+        failed = index.find(contract=contracts[0], variant="mint", ok=False)
+        found = time.perf_counter() - start
+        assert(len(failed) == len([i for i in range(0, 200_000, 10) if i % 2 == 0 and i % 97 == 0]) + 1)
+        assert(failed[0]["txhash"] is None and failed[0]["error"] == "out of gas")
+        assert(failed[-1]["events"] == [{"wasm": {"action": ["mint"]}}])
+        assert(index.find(txhash=f"{5:064X}")[0]["height"] == 5)
+        assert(index.count(since=100, until=199) == 100)
+        assert(index.failures(contracts[0])[(contracts[0], "mint", "Unauthorized")] == len(failed) - 1)
+
+        # A row that can't be encoded is dropped, the writer keeps going
+        index.emit({"phase": "broadcast", "ok": True, "events": [object()]})
+        index.flush()
+        index.emit({"phase": "broadcast", "ok": True, "txhash": "after"})
+        index.flush()
+        assert(index.dropped == 1 and index.find(txhash="after"))
+    print(f"[+] Test tx index passed ({emitted / 200_000 * 1e6:.1f}µs per emit, {found * 1000:.2f}ms to find failures)")
+
+
+def test_tx_index_backend():
+    import os
+    import tempfile
+    from .backends import MockBackend, MockContract
+    from .client import configure
+    from .common import Contract, send
+    from .instrument import add_sink, remove_sink
+
+    class Token(MockContract):
+        def instantiate(self, env, msg):
+            self.minter = env.sender
+
+        def execute_mint(self, env, amount: str):
+            if env.sender != self.minter:
+                raise Exception("Unauthorized")
+            env.add_attribute("amount", amount)
+
+    mock = MockBackend()
+    mock.register_code("token", Token)
+    configure(client=mock)
+    deployer, bob = mock.wallets["test1"], mock.wallets["test2"]
+    token = Contract("token")
+    token.instantiate(deployer, mock.store_code(deployer, "token"), {})
+
+    index = add_sink(TxIndex(os.path.join(tempfile.mkdtemp(), "txindex.sqlite")))
+    for sender in (deployer, bob, deployer):
+        token.execute(sender, {"mint": {"amount": "10"}})
+    send(mock, deployer, bob.key.acc_address, "10uluna")
+    remove_sink(index)
+    index.close()
+    configure()
+
+    # Everything is on disk once closed
+    index = TxIndex(index.path)
+    failed = index.find(contract=token.address, variant="mint", ok=False)
+    assert(len(failed) == 1 and failed[0]["sender"] == bob.key.acc_address and "Unauthorized" in failed[0]["error"])
+    assert(index.count(contract=token.address, ok=True) == 2 and index.count(variant="send") == 1)
+    assert(all(row["txhash"] and row["height"] for row in index.find()))
+    index.close()
+    print("[+] Test tx index with a backend passed")
+
+
+if __name__ == "__main__":
+    test_tx_index()
+    test_tx_index_backend()
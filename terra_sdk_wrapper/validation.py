@@ -0,0 +1,359 @@
+"""
+Messages checked against the contract JSON schemas before anything is signed:
+- SchemaCompiler: JSON schema nodes to nested checks, compiled once
+- SchemaValidator: the validator of one root schema (ExecuteMsg, QueryMsg...), messages dispatched by variant
+- ContractValidator: the validators of a contract, loaded from its `schema/` directory
+
+    token = Contract("token", validator=ContractValidator.load("contracts/terraswap_token/schema"))
+    token.execute(deployer, {"transfer": {"amount": 10, "recipient": bob}})
+    # Exception: Invalid execute message: transfer.amount: expected a Uint128 string, got 10
+
+Checked: types, required and unknown fields, enum variants, integer formats,
+and the number strings (Uint128, Uint64, Decimal...).
+"""
+
+import json
+import os
+import re
+from typing import Callable, Dict, List
+
+#============================ Compilation ============================#
+
+# Checks return None when the value is valid, the error otherwise
+Check = Callable[[object, str], str]
+
+number_strings = {
+    "Uint64": re.compile(r"^[0-9]+$"),
+    "Uint128": re.compile(r"^[0-9]+$"),
+    "Uint256": re.compile(r"^[0-9]+$"),
+    "Int128": re.compile(r"^-?[0-9]+$"),
+    "Decimal": re.compile(r"^[0-9]+(\.[0-9]+)?$"),
+    "Decimal256": re.compile(r"^[0-9]+(\.[0-9]+)?$"),
+}
+
+integer_formats = {
+    "uint8": (0, 2**8 - 1),
+    "uint16": (0, 2**16 - 1),
+    "uint32": (0, 2**32 - 1),
+    "uint64": (0, 2**64 - 1),
+    "int32": (-2**31, 2**31 - 1),
+    "int64": (-2**63, 2**63 - 1),
+}
+
+type_checks = {
+    "string": lambda v: isinstance(v, str),
+    # bool is an int for python, not for JSON
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "null": lambda v: v is None,
+}
+
+
+def join(path: str, key) -> str:
+    return f"{path}.{key}" if path else str(key)
+
+
+class SchemaCompiler():
+    """
+    I turn JSON schema nodes into nested closures, once.
+    Definitions are compiled on first reference and shared, recursive ones included.
+    """
+
+    def __init__(self, definitions: Dict[str, dict] = None) -> None:
+        self.definitions = definitions or {}
+        self.compiled: Dict[str, Check] = {}
+
+    def ref(self, ref: str) -> Check:
+        name = ref.split("/")[-1]
+        if name not in self.compiled:
+            if name not in self.definitions:
+                raise Exception(f"Unknown definition {ref}")
+            # Placeholder first, so a recursive definition finds itself
+            cell = []
+            self.compiled[name] = lambda value, path: cell[0](value, path)
+            check = self.compile(self.definitions[name])
+            if name in number_strings:
+                check = self.number_string(name, check)
+            cell.append(check)
+            self.compiled[name] = check
+        return self.compiled[name]
+
+    def number_string(self, name: str, check: Check) -> Check:
+        pattern = number_strings[name]
+
+        def check_number(value, path):
+            if not isinstance(value, str) or not pattern.match(value):
+                return f"{path or 'msg'}: expected a {name} string, got {value!r}"
+            return check(value, path)
+        return check_number
+
+    def compile(self, schema) -> Check:
+        if schema is True or schema == {}:
+            return lambda value, path: None
+        checks: List[Check] = []
+        if "$ref" in schema:
+            checks.append(self.ref(schema["$ref"]))
+        if "type" in schema:
+            checks.append(self.compile_type(schema))
+        if "enum" in schema:
+            checks.append(self.compile_enum(schema["enum"]))
+        if "allOf" in schema:
+            checks.extend(self.compile(s) for s in schema["allOf"])
+        for key in ("anyOf", "oneOf"):
+            if key in schema:
+                checks.append(self.compile_union(schema[key]))
+        if len(checks) == 1:
+            return checks[0]
+
+        def check_all(value, path):
+            for check in checks:
+                error = check(value, path)
+                if error:
+                    return error
+        return check_all
+
+    def compile_type(self, schema: dict) -> Check:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        type_check = [type_checks[t] for t in types]
+        names = " or ".join(types)
+        extra: List[Check] = []
+        if "object" in types and ("properties" in schema or "required" in schema):
+            extra.append(self.compile_object(schema))
+        if "array" in types and isinstance(schema.get("items"), dict):
+            extra.append(self.compile_items(schema["items"]))
+        if "integer" in types and schema.get("format") in integer_formats:
+            extra.append(self.compile_range(*integer_formats[schema["format"]]))
+
+        def check_type(value, path):
+            for is_type in type_check:
+                if is_type(value):
+                    break
+            else:
+                return f"{path or 'msg'}: expected {names}, got {type(value).__name__}"
+            if value is None:
+                return None
+            for check in extra:
+                error = check(value, path)
+                if error:
+                    return error
+        return check_type
+
+    def compile_object(self, schema: dict) -> Check:
+        properties = {k: self.compile(v) for k, v in (schema.get("properties") or {}).items()}
+        required = list(schema.get("required") or [])
+        closed = schema.get("additionalProperties") is False
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return None
+            for key in required:
+                if key not in value:
+                    return f"{join(path, key)}: missing"
+            for key, item in value.items():
+                check = properties.get(key)
+                if check is None:
+                    if closed:
+                        return f"{join(path, key)}: unknown field"
+                    continue
+                error = check(item, join(path, key))
+                if error:
+                    return error
+        return check_object
+
+    def compile_items(self, items: dict) -> Check:
+        check_item = self.compile(items)
+
+        def check_items(value, path):
+            for i, item in enumerate(value):
+                error = check_item(item, join(path, i))
+                if error:
+                    return error
+        return check_items
+
+    def compile_range(self, low: int, high: int) -> Check:
+        def check_range(value, path):
+            if not low <= value <= high:
+                return f"{path or 'msg'}: {value} out of range [{low}, {high}]"
+        return check_range
+
+    def compile_enum(self, values: list) -> Check:
+        def check_enum(value, path):
+            if value not in values:
+                return f"{path or 'msg'}: expected one of {values}, got {value!r}"
+        return check_enum
+
+    def compile_union(self, schemas: list) -> Check:
+        checks = [self.compile(s) for s in schemas]
+
+        def check_union(value, path):
+            errors = []
+            for check in checks:
+                error = check(value, path)
+                if not error:
+                    return None
+                errors.append(error)
+            # The closest variant is the one that went the deepest
+            return max(errors, key=len)
+        return check_union
+
+#============================ Validators ============================#
+
+
+class SchemaValidator():
+    """
+    I validate the messages of one root schema.
+    Enum messages (`{"transfer": {...}}`) are dispatched on their variant:
+    each variant is compiled the first time such a message is seen, then reused.
+    """
+
+    def __init__(self, root_data: dict) -> None:
+        self.title = root_data.get("title")
+        self.compiler = SchemaCompiler(root_data.get("definitions"))
+        self.variants: Dict[str, dict] = {}
+        self.unit_variants: List[str] = []
+        for variant in root_data.get("anyOf", []) + root_data.get("oneOf", []):
+            if "enum" in variant:
+                self.unit_variants.extend(variant["enum"])
+            for name, schema in (variant.get("properties") or {}).items():
+                self.variants[name] = schema
+        self.root = None if self.variants or self.unit_variants else root_data
+        self.checks: Dict[str, Check] = {}
+
+    def error(self, msg) -> str:
+        """Why `msg` is invalid, None if it is valid"""
+        if self.root is not None:
+            if "" not in self.checks:
+                self.checks[""] = self.compiler.compile(self.root)
+            return self.checks[""](msg, "")
+        if isinstance(msg, str):
+            if msg in self.unit_variants:
+                return None
+            return f"msg: unknown variant {msg!r}"
+        if not isinstance(msg, dict) or len(msg) != 1:
+            return f"msg: expected one of {sorted(self.variants)} as the only key"
+        variant, params = next(iter(msg.items()))
+        check = self.checks.get(variant)
+        if check is None:
+            if variant not in self.variants:
+                return f"msg: unknown variant {variant!r}, expected one of {sorted(self.variants)}"
+            check = self.checks[variant] = self.compiler.compile(self.variants[variant])
+        return check(params, variant)
+
+    def is_valid(self, msg) -> bool:
+        return self.error(msg) is None
+
+
+# Schema titles to message kinds, as used by Contract
+schema_kinds = {"ExecuteMsg": "execute", "QueryMsg": "query", "InstantiateMsg": "instantiate",
+                "MigrateMsg": "migrate", "Cw20HookMsg": "cw20"}
+
+
+class ContractValidator():
+    """
+    I hold the validators of a contract by message kind (execute, query, instantiate...).
+    A kind without schema is not checked.
+    """
+
+    def __init__(self, root_schemas_data: List[dict]) -> None:
+        self.validators: Dict[str, SchemaValidator] = {}
+        for root_data in root_schemas_data:
+            title = root_data.get("title")
+            self.validators[schema_kinds.get(title, title)] = SchemaValidator(root_data)
+
+    @classmethod
+    def load(cls, schema_dir: str):
+        """Every `*_msg.json` of a schema directory"""
+        root_schemas_data = []
+        for name in sorted(os.listdir(schema_dir)):
+            if name.endswith("msg.json"):
+                with open(os.path.join(schema_dir, name)) as f:
+                    root_schemas_data.append(json.load(f))
+        return cls(root_schemas_data)
+
+    def error(self, kind: str, msg) -> str:
+        validator = self.validators.get(kind)
+        if validator is None:
+            return None
+        return validator.error(msg)
+
+    def validate(self, kind: str, msg) -> None:
+        """Raises if `msg` doesn't match the schema of `kind`"""
+        error = self.error(kind, msg)
+        if error:
+            raise Exception(f"Invalid {kind} message: {error}")
+
+
+def test_validation():
+    execute_schema = {
+        "title": "ExecuteMsg",
+        "oneOf": [
+            {"type": "object", "required": ["transfer"], "additionalProperties": False, "properties": {"transfer": {
+                "type": "object", "required": ["amount", "recipient"], "additionalProperties": False, "properties": {
+                    "amount": {"$ref": "#/definitions/Uint128"},
+                    "recipient": {"type": "string"},
+                    "expires": {"anyOf": [{"$ref": "#/definitions/Expiration"}, {"type": "null"}]}}}}},
+            {"type": "object", "required": ["set_limit"], "properties": {"set_limit": {
+                "type": "object", "required": ["limit"], "properties": {
+                    "limit": {"type": "integer", "format": "uint32", "minimum": 0}}}}},
+            {"type": "string", "enum": ["pause"]},
+        ],
+        "definitions": {
+            "Uint128": {"type": "string"},
+            "Expiration": {"oneOf": [
+                {"type": "object", "required": ["at_height"], "properties": {"at_height": {"type": "integer", "format": "uint64"}}},
+                {"type": "object", "required": ["never"], "properties": {"never": {"type": "object"}}},
+            ]},
+        },
+    }
+    validator = ContractValidator([execute_schema])
+    valid = [
+        {"transfer": {"amount": "10", "recipient": "terra1bob"}},
+        {"transfer": {"amount": "10", "recipient": "terra1bob", "expires": {"at_height": 5}}},
+        {"transfer": {"amount": "10", "recipient": "terra1bob", "expires": None}},
+        {"set_limit": {"limit": 3}},
+        "pause",
+    ]
+    for msg in valid:
+        assert(validator.error("execute", msg) is None), msg
+    invalid = {
+        "transfer.amount: expected a Uint128 string, got 10": {"transfer": {"amount": 10, "recipient": "b"}},
+        "transfer.amount: expected a Uint128 string, got '-1'": {"transfer": {"amount": "-1", "recipient": "b"}},
+        "transfer.recipient: missing": {"transfer": {"amount": "1"}},
+        "transfer.memo: unknown field": {"transfer": {"amount": "1", "recipient": "b", "memo": ""}},
+        "transfer.expires.at_height: expected integer, got str": {"transfer": {"amount": "1", "recipient": "b", "expires": {"at_height": "5"}}},
+        "set_limit.limit: -1 out of range [0, 4294967295]": {"set_limit": {"limit": -1}},
+        "set_limit.limit: expected integer, got bool": {"set_limit": {"limit": True}},
+    }
+    for expected, msg in invalid.items():
+        assert(validator.error("execute", msg) == expected), (validator.error("execute", msg), expected)
+    assert("unknown variant 'burn'" in validator.error("execute", {"burn": {}}))
+    assert(validator.error("query", {"anything": {}}) is None)
+    try:
+        validator.validate("execute", {"set_limit": {}})
+        assert(False)
+    except Exception as e:
+        assert(str(e) == "Invalid execute message: set_limit.limit: missing")
+    print("[+] Test validation passed")
+
+
+def test_validation_speed(n: int = 100_000):
+    import time
+    validator = SchemaValidator({"title": "ExecuteMsg", "oneOf": [
+        {"type": "object", "properties": {"transfer": {"type": "object", "required": ["amount", "recipient"], "properties": {
+            "amount": {"$ref": "#/definitions/Uint128"}, "recipient": {"type": "string"}}}}}],
+        "definitions": {"Uint128": {"type": "string"}}})
+    msg = {"transfer": {"amount": "1000", "recipient": "terra1bob"}}
+    start = time.perf_counter()
+    for _ in range(n):
+        validator.error(msg)
+    per_msg = (time.perf_counter() - start) / n
+    assert(per_msg < 50e-6)
+    print(f"[+] Test validation speed passed ({per_msg * 1e6:.2f}us per message)")
+
+
+if __name__ == "__main__":
+    test_validation()
+    test_validation_speed()